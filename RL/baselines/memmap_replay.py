@@ -0,0 +1,188 @@
+"""
+This module contains a replay buffer for Stable Baselines 3 whose arrays are memory mapped
+files, such that the buffer can be larger than the memory and is kept between trainings.
+"""
+import json
+import mmap
+import os
+from typing import Dict, Optional
+
+import gin
+import gym
+import numpy as np
+from stable_baselines3 import DQN
+from stable_baselines3.common.buffers import ReplayBuffer
+from stable_baselines3.common.type_aliases import ReplayBufferSamples
+from stable_baselines3.common.vec_env import VecNormalize
+
+from baselines.prioritized_dqn import PrioritizedDQN
+from baselines.vec_dqn import VecDQN
+from utilities.observation_codec import EncodedObservations, ObservationCodec
+
+
+@gin.configurable
+class MemmapReplayBuffer(ReplayBuffer):
+    """A ReplayBuffer stored in a folder, with one .npy file per array and a JSON file holding
+    the position of the buffer. Opening a folder that already contains a buffer of the same
+    shape resumes it, so a restarted training keeps its experiences.
+
+    Every observation is stored once, in row major order: the next observation of a transition
+    is the observation of the next slot (``optimize_memory_usage`` of Stable Baselines), which
+    halves the size of the buffer, and a transition is a contiguous row of the file.
+    """
+
+    def __init__(self,
+                 buffer_size: int,
+                 observation_space: gym.spaces.Space,
+                 action_space: gym.spaces.Space,
+                 folder: str,
+                 device: str = "cpu",
+                 flush_interval: int = 10000,
+                 codec: Optional[ObservationCodec] = None):
+        """
+        :param buffer_size: Max number of elements in the buffer
+        :type buffer_size: int
+        :param observation_space: Observation space
+        :type observation_space: gym.spaces.Space
+        :param action_space: Action space
+        :type action_space: gym.spaces.Space
+        :param folder: The folder of the files, created when it doesn't exist yet
+        :type folder: str
+        :param device: The device of the sampled tensors
+        :type device: str
+        :param flush_interval: Amount of added transitions between writing the buffer to disk
+        :type flush_interval: int
+        :param codec: Store the observations encoded by this codec, as they are when omitted
+        :type codec: Optional[ObservationCodec]
+        :raises ValueError: If the folder contains a buffer with different dimensions
+        """
+        super().__init__(buffer_size,
+                         observation_space,
+                         action_space,
+                         device,
+                         optimize_memory_usage=True)
+        self.folder = folder
+        self.flush_interval = flush_interval
+        self._unflushed = 0
+        if codec is not None:
+            self.observations = EncodedObservations(codec, self.observations.shape)
+
+        os.makedirs(folder, exist_ok=True)
+        state = self._read_state()
+        if state is not None and state['layout'] != self._layout():
+            raise ValueError("The replay buffer in {} has a different layout: {}".format(
+                folder, state['layout']))
+        mode = 'w+' if state is None else 'r+'
+
+        # The arrays of Stable Baselines are never written, so they don't take up any memory
+        for name, array in self._arrays().items():
+            memmap = np.lib.format.open_memmap(os.path.join(folder, name + '.npy'),
+                                               mode=mode,
+                                               dtype=array.dtype,
+                                               shape=array.shape)
+            if hasattr(mmap, 'MADV_RANDOM'):
+                # Sampling reads scattered rows, reading ahead would only waste IO
+                memmap._mmap.madvise(mmap.MADV_RANDOM)  # pylint: disable=protected-access
+            if name.startswith('observations_'):
+                setattr(self.observations, name[len('observations_'):], memmap)
+            else:
+                setattr(self, name, memmap)
+
+        if state is None:
+            self.flush()
+        else:
+            self.pos, self.full = state['pos'], state['full']
+            if os.path.isfile(self._rest_pose_file()):
+                self.observations.codec.rest_pose = np.load(self._rest_pose_file())
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        arrays = {'actions': self.actions, 'rewards': self.rewards, 'dones': self.dones}
+        if isinstance(self.observations, EncodedObservations):
+            arrays['observations_exact'] = self.observations.exact
+            arrays['observations_cloth'] = self.observations.cloth
+        else:
+            arrays['observations'] = self.observations
+        return arrays
+
+    def _layout(self) -> dict:
+        return {
+            name: {
+                'shape': list(array.shape),
+                'dtype': array.dtype.str
+            } for (name, array) in self._arrays().items()
+        }
+
+    def _state_file(self) -> str:
+        return os.path.join(self.folder, 'state.json')
+
+    def _rest_pose_file(self) -> str:
+        return os.path.join(self.folder, 'rest_pose.npy')
+
+    def _read_state(self) -> Optional[dict]:
+        if not os.path.isfile(self._state_file()):
+            return None
+        with open(self._state_file()) as file:
+            return json.load(file)
+
+    def flush(self) -> None:
+        """Write the buffer to disk, only the transitions added before the latest flush are
+        resumed after a crash
+        """
+        for array in self._arrays().values():
+            array.flush()
+        if isinstance(self.observations, EncodedObservations) and \
+                self.observations.codec.rest_pose is not None:
+            np.save(self._rest_pose_file(), self.observations.codec.rest_pose)
+        state = {
+            'pos': int(self.pos),
+            'full': bool(self.full),
+            'layout': self._layout()
+        }
+        # Replace the state at once, such that a crash never leaves half a state behind
+        temporary = self._state_file() + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(state, file)
+        os.replace(temporary, self._state_file())
+        self._unflushed = 0
+
+    def add(self, obs: np.ndarray, next_obs: np.ndarray, action: np.ndarray,
+            reward: np.ndarray, done: np.ndarray) -> None:
+        super().add(obs, next_obs, action, reward, done)
+        self._unflushed += 1
+        if self._unflushed >= self.flush_interval:
+            self.flush()
+
+    def _get_samples(self,
+                     batch_inds: np.ndarray,
+                     env: Optional[VecNormalize] = None) -> ReplayBufferSamples:
+        # The order within a batch doesn't matter, reading the rows in the order
+        # of the file keeps the reads of neighbouring rows on the same pages
+        return super()._get_samples(np.sort(batch_inds), env=env)
+
+
+def use_disk_replay_buffer(model: DQN,
+                           folder: str,
+                           codec: Optional[ObservationCodec] = None) -> MemmapReplayBuffer:
+    """Replace the replay buffer of a model by a MemmapReplayBuffer in the given folder
+
+    :param model: The model to train
+    :type model: DQN
+    :param folder: The folder of the replay buffer, e.g. inside the model folder
+    :type folder: str
+    :param codec: The codec of the stored observations, they are stored as they are when omitted
+    :type codec: Optional[ObservationCodec]
+    :raises ValueError: If the model replays its experiences prioritized, or collects them
+                        from several environments
+    :return: The new replay buffer of the model
+    :rtype: MemmapReplayBuffer
+    """
+    if isinstance(model, PrioritizedDQN):
+        raise ValueError("The disk replay buffer doesn't support prioritized replay")
+    if isinstance(model, VecDQN):
+        # The next observation of a transition is the observation of the next slot, which
+        # is the transition of the next worker when several workers add their steps
+        raise ValueError("The disk replay buffer doesn't support several environments")
+    model.replay_buffer = MemmapReplayBuffer(model.buffer_size, model.observation_space,
+                                             model.action_space, folder, model.device,
+                                             codec=codec)
+    return model.replay_buffer
@@ -0,0 +1,98 @@
+"""
+This module pretrains a DQN offline, on the transitions of an episode recording instead of on
+the transitions it collects itself, such that a stage can be trained without starting Unity.
+"""
+import time
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch as th
+
+from stable_baselines3 import DQN
+from stable_baselines3.common import logger
+from stable_baselines3.common.type_aliases import ReplayBufferSamples
+from stable_baselines3.common.utils import polyak_update
+from stable_baselines3.common.vec_env import VecNormalize
+
+from utilities.baxter_state import BaxterState
+from utilities.episode_recorder import EpisodeDataset
+
+
+class StreamedReplayBuffer:
+    """
+    Stands in for the replay buffer of a DQN during offline training, every sampled batch is the
+    next batch streamed from an episode recording. The batch size of ``sample`` is ignored, it
+    is the batch size of the stream.
+    """
+
+    def __init__(self, batches: Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray,
+                                               np.ndarray]], device: th.device):
+        """
+        :param batches: The batches of ``EpisodeDataset.batches``
+        :type batches: Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]]
+        :param device: The device of the sampled tensors
+        :type device: th.device
+        """
+        self.batches = batches
+        self.device = device
+
+    def to_torch(self, array: np.ndarray) -> th.Tensor:
+        return th.as_tensor(array).to(self.device)
+
+    def sample(self, batch_size: int, env: Optional[VecNormalize] = None) -> ReplayBufferSamples:
+        observations, next_observations, actions, rewards, dones = next(self.batches)
+        return ReplayBufferSamples(self.to_torch(observations), self.to_torch(actions[:, None]),
+                                   self.to_torch(next_observations),
+                                   self.to_torch(dones[:, None].astype(np.float32)),
+                                   self.to_torch(rewards[:, None]))
+
+
+def pretrain(model: DQN,
+             dataset: EpisodeDataset,
+             state: BaxterState,
+             observation_range: List[Tuple[int, int]],
+             gradient_steps: int,
+             batch_size: int = 4096,
+             shuffle_chunks: int = 8) -> None:
+    """Train a DQN on the recorded transitions of its stage. The target network is updated every
+    ``target_update_interval`` gradient steps of the model, as there are no environment steps,
+    and the progress is logged at every update. The batches are sampled uniformly, also for a
+    model with prioritized replay.
+
+    :param model: The model to train, its replay buffer is left as it is
+    :type model: DQN
+    :param dataset: The episode recording
+    :type dataset: EpisodeDataset
+    :param state: The stage of the model
+    :type state: BaxterState
+    :param observation_range: The observation range of the model
+    :type observation_range: List[Tuple[int, int]]
+    :param gradient_steps: The amount of batches to train on
+    :type gradient_steps: int
+    :param batch_size: The amount of transitions per batch
+    :type batch_size: int
+    :param shuffle_chunks: Amount of chunks of which the transitions are shuffled together
+    :type shuffle_chunks: int
+    :raises ValueError: If the recording holds no steps of the stage
+    """
+    replay_buffer = model.replay_buffer
+    model.replay_buffer = StreamedReplayBuffer(
+        dataset.batches(batch_size, state, observation_range, shuffle_chunks), model.device)
+    start = time.time()
+    done = 0
+    try:
+        while done < gradient_steps:
+            # Train up to the next update of the target network, the progress is logged then
+            steps = min(model.target_update_interval - done % model.target_update_interval,
+                        gradient_steps - done)
+            # The DQN update itself, PrioritizedDQN would sample with priorities
+            DQN.train(model, steps, batch_size)
+            done += steps
+            if done % model.target_update_interval == 0:
+                polyak_update(model.q_net.parameters(), model.q_net_target.parameters(),
+                              model.tau)
+            logger.record("offline/transitions_per_second",
+                          done * batch_size / (time.time() - start))
+            logger.dump(step=done)
+    finally:
+        model.replay_buffer = replay_buffer
@@ -0,0 +1,108 @@
+"""
+This module contains DQN variants that replay their experiences proportional to
+their TD error, using the PrioritizedReplayBuffer instead of the uniform ReplayBuffer.
+"""
+import numpy as np
+import torch as th
+from torch.nn import functional as F
+
+from stable_baselines3 import DQN
+from stable_baselines3.common import logger
+from stable_baselines3.common.utils import get_linear_fn
+
+from baselines.prioritized_replay import PrioritizedReplayBuffer
+from baselines.vec_dqn import VecDQN
+
+
+class PrioritizedDQN(DQN):
+    """A DQN with prioritized experience replay. The importance sampling correction beta
+    is annealed linearly from the initial beta of the buffer to 1 over the training.
+    """
+
+    def _setup_model(self) -> None:
+        """The setup of the DQN, except that the OffPolicyAlgorithm would allocate a uniform
+        ReplayBuffer of the full size first, which is why its setup is repeated here.
+        """
+        assert not self.optimize_memory_usage, \
+            "The prioritized replay buffer doesn't support optimize_memory_usage"
+        self._setup_lr_schedule()
+        self.set_random_seed(self.seed)
+        self.replay_buffer = PrioritizedReplayBuffer(self.buffer_size, self.observation_space,
+                                                     self.action_space, self.device)
+        self.policy = self.policy_class(self.observation_space, self.action_space,
+                                        self.lr_schedule, **self.policy_kwargs)
+        self.policy = self.policy.to(self.device)
+        self._convert_train_freq()
+
+        self._create_aliases()
+        self.exploration_schedule = get_linear_fn(self.exploration_initial_eps,
+                                                  self.exploration_final_eps,
+                                                  self.exploration_fraction)
+
+    def train(self, gradient_steps: int, batch_size: int = 100) -> None:
+        """Perform gradient steps on prioritized batches, weighting the loss of every
+        transition with its importance sampling weight
+
+        :param gradient_steps: The amount of batches to train on
+        :type gradient_steps: int
+        :param batch_size: The amount of transitions per batch
+        :type batch_size: int
+        """
+        self._update_learning_rate(self.policy.optimizer)
+
+        initial_beta = self.replay_buffer.beta
+        beta = initial_beta + (1. - initial_beta) * (1. - self._current_progress_remaining)
+
+        losses = []
+        for _ in range(gradient_steps):
+            replay_data = self.replay_buffer.sample(batch_size,
+                                                    env=self._vec_normalize_env,
+                                                    beta=beta)
+
+            with th.no_grad():
+                # Compute the next Q-values using the target network
+                next_q_values = self.q_net_target(replay_data.next_observations)
+                # Follow greedy policy: use the one with the highest value
+                next_q_values, _ = next_q_values.max(dim=1)
+                # Avoid potential broadcast issue
+                next_q_values = next_q_values.reshape(-1, 1)
+                # 1-step TD target
+                target_q_values = replay_data.rewards + \
+                    (1 - replay_data.dones) * self.gamma * next_q_values
+
+            # Get current Q-values estimates
+            current_q_values = self.q_net(replay_data.observations)
+
+            # Retrieve the q-values for the actions from the replay buffer
+            current_q_values = th.gather(current_q_values,
+                                         dim=1,
+                                         index=replay_data.actions.long())
+
+            # Huber loss per transition, weighted to correct for the prioritized sampling
+            elementwise_loss = F.smooth_l1_loss(current_q_values,
+                                                target_q_values,
+                                                reduction='none')
+            loss = (replay_data.weights * elementwise_loss).mean()
+            losses.append(loss.item())
+
+            # Optimize the policy
+            self.policy.optimizer.zero_grad()
+            loss.backward()
+            # Clip gradient norm
+            th.nn.utils.clip_grad_norm_(self.policy.parameters(), self.max_grad_norm)
+            self.policy.optimizer.step()
+
+            td_errors = (current_q_values - target_q_values).detach().cpu().numpy()
+            self.replay_buffer.update_priorities(replay_data.indices, td_errors.flatten())
+
+        # Increase update counter
+        self._n_updates += gradient_steps
+
+        logger.record("train/n_updates", self._n_updates, exclude="tensorboard")
+        logger.record("train/loss", np.mean(losses))
+        logger.record("train/per_beta", beta)
+
+
+class PrioritizedVecDQN(PrioritizedDQN, VecDQN):
+    """A VecDQN with prioritized experience replay
+    """
@@ -0,0 +1,216 @@
+"""
+This module contains a prioritized replay buffer for Stable Baselines 3, which
+samples the transitions proportional to their last TD error instead of uniformly.
+The priorities are kept in segment trees stored as flat arrays, such that a whole
+batch is sampled and updated with one vectorized operation per tree level.
+"""
+from typing import Callable, NamedTuple, Optional
+
+import gin
+import gym
+import numpy as np
+import torch as th
+
+from stable_baselines3.common.buffers import ReplayBuffer
+from stable_baselines3.common.vec_env import VecNormalize
+
+
+class SegmentTree:
+    """A binary tree over a fixed amount of leaves, where every node holds the result of
+    an associative operation over the leaves below it. Node 1 is the root and the children
+    of node i are 2i and 2i + 1, the leaves start at ``capacity``.
+    """
+
+    def __init__(self, capacity: int, operation: Callable[[np.ndarray, np.ndarray],
+                                                          np.ndarray], neutral: float):
+        """
+        :param capacity: The minimum amount of leaves, rounded up to a power of two
+        :type capacity: int
+        :param operation: Vectorized associative operation, e.g. np.add or np.minimum
+        :type operation: Callable[[np.ndarray, np.ndarray], np.ndarray]
+        :param neutral: The neutral element of the operation, the value of unused leaves
+        :type neutral: float
+        """
+        self.capacity = 1 << max(int(capacity) - 1, 0).bit_length()
+        self.operation = operation
+        self.tree = np.full(2 * self.capacity, neutral, dtype=np.float64)
+
+    def update(self, indices: np.ndarray, values: np.ndarray) -> None:
+        """Set a batch of leaves and recompute their ancestors, in O(batch log n)
+
+        :param indices: The indices of the leaves
+        :type indices: np.ndarray
+        :param values: The new values of the leaves
+        :type values: np.ndarray
+        """
+        nodes = np.asarray(indices) + self.capacity
+        self.tree[nodes] = values
+        # Halving keeps the nodes sorted, so only the first level needs a sort and the
+        # duplicate parents of the next levels are always next to each other
+        nodes = np.unique(nodes // 2)
+        while len(nodes) > 0:
+            self.tree[nodes] = self.operation(self.tree[2 * nodes], self.tree[2 * nodes + 1])
+            nodes = nodes // 2
+            nodes = nodes[np.concatenate(([True], nodes[1:] != nodes[:-1])) & (nodes >= 1)]
+
+    def __getitem__(self, indices: np.ndarray) -> np.ndarray:
+        return self.tree[np.asarray(indices) + self.capacity]
+
+    @property
+    def root(self) -> float:
+        """The result of the operation over all leaves
+        """
+        return self.tree[1]
+
+
+class SumSegmentTree(SegmentTree):
+    """Segment tree of sums, used to sample leaves proportional to their value
+    """
+
+    def __init__(self, capacity: int):
+        super().__init__(capacity, np.add, 0.)
+
+    def find_prefix_sum(self, prefix_sums: np.ndarray) -> np.ndarray:
+        """Find for every prefix sum the first leaf at which the cumulative sum
+        of the leaves exceeds it, all prefix sums descend the tree at once
+
+        :param prefix_sums: Values in [0, root)
+        :type prefix_sums: np.ndarray
+        :return: The indices of the leaves
+        :rtype: np.ndarray
+        """
+        remaining = np.array(prefix_sums, dtype=np.float64)
+        nodes = np.ones(len(remaining), dtype=np.int64)
+        while nodes[0] < self.capacity:
+            left = 2 * nodes
+            left_sums = self.tree[left]
+            go_right = remaining >= left_sums
+            remaining -= np.where(go_right, left_sums, 0.)
+            nodes = left + go_right
+        return nodes - self.capacity
+
+
+class MinSegmentTree(SegmentTree):
+    """Segment tree of minima, used to find the lowest priority
+    """
+
+    def __init__(self, capacity: int):
+        super().__init__(capacity, np.minimum, np.inf)
+
+
+class PrioritizedReplayBufferSamples(NamedTuple):
+    """The samples of a ReplayBuffer, with their importance sampling weights and their
+    indices to update their priorities after training on them.
+    """
+
+    observations: th.Tensor
+    actions: th.Tensor
+    next_observations: th.Tensor
+    dones: th.Tensor
+    rewards: th.Tensor
+    weights: th.Tensor
+    indices: np.ndarray
+
+
+@gin.configurable
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """Proportional prioritized experience replay (Schaul et al., 2016). New transitions get
+    the highest priority seen so far, so every transition is sampled at least once with a
+    high probability.
+    """
+
+    def __init__(self,
+                 buffer_size: int,
+                 observation_space: gym.spaces.Space,
+                 action_space: gym.spaces.Space,
+                 device: str = "cpu",
+                 n_envs: int = 1,
+                 alpha: float = 0.6,
+                 beta: float = 0.4,
+                 epsilon: float = 1e-6):
+        """
+        :param buffer_size: Max number of elements in the buffer
+        :type buffer_size: int
+        :param observation_space: Observation space
+        :type observation_space: gym.spaces.Space
+        :param action_space: Action space
+        :type action_space: gym.spaces.Space
+        :param device: The device of the sampled tensors
+        :type device: str
+        :param n_envs: Number of parallel environments
+        :type n_envs: int
+        :param alpha: How much the priorities are used, 0 samples uniformly
+        :type alpha: float
+        :param beta: The initial amount of importance sampling correction, it is
+                     annealed to 1 over the course of the training
+        :type beta: float
+        :param epsilon: Added to the TD errors, such that no transition has zero priority
+        :type epsilon: float
+        """
+        super().__init__(buffer_size, observation_space, action_space, device, n_envs=n_envs)
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = epsilon
+
+        self.sum_tree = SumSegmentTree(buffer_size)
+        self.min_tree = MinSegmentTree(buffer_size)
+        self.max_priority = 1.
+
+    def add(self, obs: np.ndarray, next_obs: np.ndarray, action: np.ndarray,
+            reward: np.ndarray, done: np.ndarray) -> None:
+        index = self.pos
+        super().add(obs, next_obs, action, reward, done)
+        priority = np.array([self.max_priority**self.alpha])
+        self.sum_tree.update([index], priority)
+        self.min_tree.update([index], priority)
+
+    def sample(self,
+               batch_size: int,
+               env: Optional[VecNormalize] = None,
+               beta: Optional[float] = None) -> PrioritizedReplayBufferSamples:
+        """Sample a batch proportional to the priorities, stratified over equal segments
+        of the total priority
+
+        :param batch_size: Number of elements to sample
+        :type batch_size: int
+        :param env: Associated VecEnv to normalize the observations/rewards when sampling
+        :type env: Optional[VecNormalize]
+        :param beta: The amount of importance sampling correction, defaults to the initial one
+        :type beta: Optional[float]
+        :return: The samples with their weights and indices
+        :rtype: PrioritizedReplayBufferSamples
+        """
+        beta = self.beta if beta is None else beta
+        size = self.buffer_size if self.full else self.pos
+
+        total = self.sum_tree.root
+        segment = total / batch_size
+        prefix_sums = (np.arange(batch_size) + np.random.random(batch_size)) * segment
+        # Rounding errors could still select an unused leaf at the end
+        indices = np.minimum(self.sum_tree.find_prefix_sum(np.minimum(prefix_sums, total)),
+                             size - 1)
+
+        # Importance sampling weights, normalized by the largest possible weight
+        probabilities = self.sum_tree[indices] / total
+        max_weight = (self.min_tree.root / total * size)**-beta
+        weights = (probabilities * size)**-beta / max_weight
+
+        samples = self._get_samples(indices, env=env)
+        return PrioritizedReplayBufferSamples(*samples,
+                                              weights=self.to_torch(
+                                                  weights.reshape(-1, 1).astype(np.float32)),
+                                              indices=indices)
+
+    def update_priorities(self, indices: np.ndarray, td_errors: np.ndarray) -> None:
+        """Set the priorities of sampled transitions after training on them
+
+        :param indices: The indices of the transitions
+        :type indices: np.ndarray
+        :param td_errors: The TD errors of the transitions
+        :type td_errors: np.ndarray
+        """
+        priorities = np.abs(td_errors) + self.epsilon
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        priorities = priorities**self.alpha
+        self.sum_tree.update(indices, priorities)
+        self.min_tree.update(indices, priorities)
@@ -0,0 +1,215 @@
+"""
+This module contains a DQN variant that collects its experiences
+from several environments at once, something the OffPolicyAlgorithm
+of Stable Baselines 3 does not support out of the box.
+"""
+from typing import Any, Dict, List, Optional, Tuple, Type, Union
+
+import gym
+import numpy as np
+import torch as th
+
+from stable_baselines3 import DQN
+from stable_baselines3.common.buffers import ReplayBuffer
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.noise import ActionNoise
+from stable_baselines3.common.off_policy_algorithm import OffPolicyAlgorithm
+from stable_baselines3.common.type_aliases import GymEnv, RolloutReturn, Schedule, TrainFreq
+from stable_baselines3.common.utils import should_collect_more_steps
+from stable_baselines3.common.vec_env import VecEnv
+from stable_baselines3.dqn.policies import DQNPolicy
+
+
+class VecDQN(DQN):
+    """A DQN which steps all environments of a VecEnv at once.
+
+    Every transition still counts as a single timestep, such that the
+    exploration schedule, the target update interval, ``learning_starts``
+    and ``train_freq`` keep their meaning from the single environment setup.
+    """
+
+    def __init__(self,  # pylint: disable=too-many-arguments,too-many-locals
+                 policy: Union[str, Type[DQNPolicy]],
+                 env: Union[GymEnv, str],
+                 learning_rate: Union[float, Schedule] = 1e-4,
+                 buffer_size: int = 1000000,
+                 learning_starts: int = 50000,
+                 batch_size: Optional[int] = 32,
+                 tau: float = 1.0,
+                 gamma: float = 0.99,
+                 train_freq: Union[int, Tuple[int, str]] = 4,
+                 gradient_steps: int = 1,
+                 optimize_memory_usage: bool = False,
+                 target_update_interval: int = 10000,
+                 exploration_fraction: float = 0.1,
+                 exploration_initial_eps: float = 1.0,
+                 exploration_final_eps: float = 0.05,
+                 max_grad_norm: float = 10,
+                 tensorboard_log: Optional[str] = None,
+                 create_eval_env: bool = False,
+                 policy_kwargs: Optional[Dict[str, Any]] = None,
+                 verbose: int = 0,
+                 seed: Optional[int] = None,
+                 device: Union[th.device, str] = "auto",
+                 _init_setup_model: bool = True):
+        """Takes the arguments of the DQN, which doesn't let the OffPolicyAlgorithm accept
+        a VecEnv with several environments, so its initialization is repeated here.
+        """
+        # pylint: disable=non-parent-init-called,super-init-not-called
+        OffPolicyAlgorithm.__init__(self,
+                                    policy,
+                                    env,
+                                    DQNPolicy,
+                                    learning_rate,
+                                    buffer_size,
+                                    learning_starts,
+                                    batch_size,
+                                    tau,
+                                    gamma,
+                                    train_freq,
+                                    gradient_steps,
+                                    action_noise=None,
+                                    policy_kwargs=policy_kwargs,
+                                    tensorboard_log=tensorboard_log,
+                                    verbose=verbose,
+                                    device=device,
+                                    support_multi_env=True,
+                                    create_eval_env=create_eval_env,
+                                    seed=seed,
+                                    sde_support=False,
+                                    optimize_memory_usage=optimize_memory_usage,
+                                    supported_action_spaces=(gym.spaces.Discrete,))
+
+        self.exploration_initial_eps = exploration_initial_eps
+        self.exploration_final_eps = exploration_final_eps
+        self.exploration_fraction = exploration_fraction
+        self.target_update_interval = target_update_interval
+        self.max_grad_norm = max_grad_norm
+        self.exploration_rate = 0.0
+        self.exploration_schedule = None
+        self.q_net, self.q_net_target = None, None
+        # The running episode rewards are kept between rollouts,
+        # since the episodes of the workers don't end at the same time.
+        self._episode_rewards = None
+
+        if _init_setup_model:
+            self._setup_model()
+
+    def _excluded_save_params(self) -> List[str]:
+        return super()._excluded_save_params() + ['_episode_rewards']
+
+    def collect_rollouts(
+        self,
+        env: VecEnv,
+        callback: BaseCallback,
+        train_freq: TrainFreq,
+        replay_buffer: ReplayBuffer,
+        action_noise: Optional[ActionNoise] = None,
+        learning_starts: int = 0,
+        log_interval: Optional[int] = None,
+    ) -> RolloutReturn:
+        """Collect experiences of all environments and store them into a ``ReplayBuffer``.
+
+        :param env: The (vectorized) training environment
+        :type env: VecEnv
+        :param callback: Callback that will be called once per step of the VecEnv
+        :type callback: BaseCallback
+        :param train_freq: How much experience to collect before training
+        :type train_freq: TrainFreq
+        :param replay_buffer: The buffer the transitions are stored in
+        :type replay_buffer: ReplayBuffer
+        :param action_noise: Unused for DQN, kept for compatibility
+        :type action_noise: Optional[ActionNoise]
+        :param learning_starts: Number of steps before learning for the warm-up phase.
+        :type learning_starts: int
+        :param log_interval: Log data every ``log_interval`` episodes
+        :type log_interval: Optional[int]
+        :return: The rollout statistics
+        :rtype: RolloutReturn
+        """
+        assert isinstance(env, VecEnv), "You must pass a VecEnv"
+        assert train_freq.frequency > 0, "Should at least collect one step or episode."
+
+        episode_rewards = []
+        num_collected_steps, num_collected_episodes = 0, 0
+
+        if self._episode_rewards is None or len(
+                self._episode_rewards) != env.num_envs:
+            self._episode_rewards = np.zeros(env.num_envs)
+
+        callback.on_rollout_start()
+
+        while should_collect_more_steps(train_freq, num_collected_steps,
+                                        num_collected_episodes):
+            actions = self._sample_actions(env.num_envs, learning_starts)
+            new_obs, rewards, dones, infos = env.step(actions)
+
+            # Give access to local variables
+            callback.update_locals(locals())
+            # Only stop training if return value is False, not when it is None.
+            if callback.on_step() is False:
+                return RolloutReturn(0.0,
+                                     num_collected_steps,
+                                     num_collected_episodes,
+                                     continue_training=False)
+
+            # Retrieve reward and episode length if using Monitor wrapper
+            self._update_info_buffer(infos, dones)
+
+            for idx in range(env.num_envs):
+                # As the VecEnv resets automatically, new_obs is already the
+                # first observation of the next episode
+                next_obs = new_obs[idx]
+                if dones[idx] and infos[idx].get(
+                        'terminal_observation') is not None:
+                    next_obs = infos[idx]['terminal_observation']
+                replay_buffer.add(self._last_obs[idx], next_obs, actions[idx],
+                                  rewards[idx], dones[idx])
+
+                self.num_timesteps += 1
+                num_collected_steps += 1
+                self._episode_rewards[idx] += rewards[idx]
+
+                self._update_current_progress_remaining(
+                    self.num_timesteps, self._total_timesteps)
+                # Target network update and exploration schedule
+                self._on_step()
+
+                if dones[idx]:
+                    num_collected_episodes += 1
+                    self._episode_num += 1
+                    episode_rewards.append(self._episode_rewards[idx])
+                    self._episode_rewards[idx] = 0.0
+
+                    if log_interval is not None and self._episode_num % log_interval == 0:
+                        self._dump_logs()
+
+            self._last_obs = new_obs
+
+        mean_reward = np.mean(
+            episode_rewards) if num_collected_episodes > 0 else 0.0
+
+        callback.on_rollout_end()
+
+        return RolloutReturn(mean_reward, num_collected_steps,
+                             num_collected_episodes, True)
+
+    def _sample_actions(self, n_envs: int, learning_starts: int) -> np.ndarray:
+        """Select an epsilon-greedy action for every environment, the greedy actions
+        of all workers are computed in a single forward pass.
+
+        :param n_envs: The amount of environments
+        :type n_envs: int
+        :param learning_starts: Number of steps before learning for the warm-up phase.
+        :type learning_starts: int
+        :return: One action per environment
+        :rtype: np.ndarray
+        """
+        random_actions = np.array(
+            [self.action_space.sample() for _ in range(n_envs)])
+        if self.num_timesteps < learning_starts:
+            return random_actions
+
+        actions, _ = self.policy.predict(self._last_obs, deterministic=True)
+        explore = np.random.rand(n_envs) < self.exploration_rate
+        return np.where(explore, random_actions, actions)
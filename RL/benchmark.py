@@ -0,0 +1,406 @@
+"""
+Microbenchmarks of the hot paths of the training and evaluation loops, they run without Unity.
+Every benchmark is a subcommand, e.g.
+
+    python benchmark.py inference --model models/fold_1/dqn_fold_1.zip
+"""
+import argparse
+import functools
+import time
+import tracemalloc
+from typing import Callable, List, Tuple
+
+import gin
+import gym
+import numpy as np
+from stable_baselines3 import DQN
+from stable_baselines3.common.buffers import ReplayBuffer
+from stable_baselines3.common.vec_env import SubprocVecEnv
+
+from baselines.custom_dqn_policies import AddaptedAdamDQNPolicy
+from baselines.prioritized_replay import PrioritizedReplayBuffer
+from q_learning.stand_in_env import StandInEnv
+from simulation import rewards
+from simulation.cloth_env import ClothEnv
+from utilities.baxter_state import BaxterState
+from utilities.episode_recorder import EpisodeDataset
+from utilities.filtered_wrapper import FilteredWrapper
+from utilities.inference import GreedyQPolicy
+from utilities.observation_codec import ObservationCodec, reward_error
+from utilities.observation_mask import compile_mask
+from utilities.shared_memory_vec_env import SharedMemoryVecEnv
+
+
+def _parse_range(value: str) -> List[Tuple[int, int]]:
+    """Parse an observation range in the gin notation, e.g. "0:4,2036:2037"
+
+    :param value: Comma separated start:stop pairs
+    :type value: str
+    :return: The observation range
+    :rtype: List[Tuple[int, int]]
+    """
+    return [tuple(int(bound) for bound in pair.split(':')) for pair in value.split(',')]
+
+
+def _time_per_call(function: Callable[[], None], repeats: int) -> float:
+    """Measure the mean duration of a call, after a short warm up
+
+    :param function: The function to call
+    :type function: Callable[[], None]
+    :param repeats: The amount of calls to measure
+    :type repeats: int
+    :return: The mean duration in microseconds
+    :rtype: float
+    """
+    for _ in range(min(repeats, 10)):
+        function()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats * 1e6
+
+
+def _allocated_per_call(function: Callable[[], None]) -> int:
+    """Measure the peak amount of memory allocated during a call, after a warm up call
+
+    :param function: The function to call
+    :type function: Callable[[], None]
+    :return: The allocated bytes
+    :rtype: int
+    """
+    function()
+    tracemalloc.start()
+    function()
+    allocated = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return allocated
+
+
+def benchmark_masking(args: argparse.Namespace) -> None:
+    """Compare indexing an observation with the fancy index of an observation range to the
+    compiled observation masks
+
+    :param args: The parsed command line arguments
+    :type args: argparse.Namespace
+    """
+    observation = np.random.randn(args.observation_size).astype(np.float32)
+    for observation_range in args.observation_ranges:
+        indices = np.concatenate([range(start, stop) for (start, stop) in observation_range])
+        mask = compile_mask(observation_range)
+        fancy = _time_per_call(lambda: observation[indices], args.repeats)
+        compiled = _time_per_call(lambda: mask(observation), args.repeats)
+        fancy_bytes = _allocated_per_call(lambda: observation[indices])
+        compiled_bytes = _allocated_per_call(lambda: mask(observation))
+        print("{} ({}): fancy index {:.2f} us, {} bytes/step, compiled {:.2f} us, "
+              "{} bytes/step".format(observation_range, "view" if mask.is_view else "gather",
+                                     fancy, fancy_bytes, compiled, compiled_bytes))
+
+
+def _fit_update(q_net, buffer) -> None:
+    """The update of ``MLPQNetwork.train`` before it was compiled into a single graph: the
+    targets are predicted with the target network and the online network is fit on them
+
+    :param q_net: The network to update
+    :type q_net: MLPQNetwork
+    :param buffer: The experiences
+    :type buffer: ReplayBuffer
+    """
+    for batch in buffer.batches(q_net.batch_size):
+        targets = q_net.mlp_target.predict(batch.observations)
+        future_targets = q_net.mlp_target.predict(batch.next_observations)
+        targets[np.arange(q_net.batch_size), batch.actions] = \
+            batch.rewards + (1. - batch.dones) * np.max(future_targets, axis=1) * q_net.gamma
+        q_net.mlp.fit(x=batch.observations,
+                      y=targets,
+                      epochs=1,
+                      batch_size=q_net.batch_size,
+                      verbose=0)
+
+
+def benchmark_q_update(args: argparse.Namespace) -> None:
+    """Compare the update throughput of the custom Double DQN with its former fit based update
+
+    :param args: The parsed command line arguments
+    :type args: argparse.Namespace
+    """
+    # TensorFlow is only needed by the custom Q-learning implementation
+    # pylint: disable=import-outside-toplevel
+    from q_learning.mlp_q_network import MLPQNetwork
+    from q_learning.replay_buffer import ReplayBuffer
+
+    buffer = ReplayBuffer(args.batch_size * args.batches + 1, args.observation_size)
+    observation = np.random.randn(args.observation_size)
+    for _ in range(buffer.capacity):
+        next_observation = np.random.randn(args.observation_size)
+        buffer.add(observation, np.random.randint(args.actions), np.random.randn(),
+                   np.random.random() < .05, next_observation)
+        observation = next_observation
+
+    q_net = MLPQNetwork(args.observation_size, args.actions, args.batch_size, 1, .99)
+    for name, update in (('fit', lambda: _fit_update(q_net, buffer)),
+                         ('tf.function', lambda: q_net.train(buffer))):
+        # The warm up of the measurement traces the graph
+        duration = _time_per_call(update, args.repeats) / 1e6
+        print("{:12s}: {:8.1f} updates/s".format(name, args.batches / duration))
+
+
+def benchmark_actor_learner(args: argparse.Namespace) -> None:
+    """Run the asynchronous actor/learner training of the custom Double DQN against the
+    local stand-in environment and report the throughput of both sides
+
+    :param args: The parsed command line arguments
+    :type args: argparse.Namespace
+    """
+    # TensorFlow is only needed by the custom Q-learning implementation
+    # pylint: disable=import-outside-toplevel
+    from q_learning.actor_learner import ActorLearner
+    from q_learning.mlp_q_network import MLPQNetwork
+
+    # The observation layout of the stand-in environment: 8 joints followed by the cloth
+    gin.parse_config([
+        'ModelsConfig.baxter_start=0', 'ModelsConfig.baxter_end=7',
+        'ModelsConfig.cloth_start=8',
+        'ModelsConfig.cloth_end={}'.format(args.observation_size - 1)
+    ])
+    q_net = MLPQNetwork(args.observation_size, 14, args.batch_size, 1, .99)
+    actor_learner = ActorLearner(functools.partial(StandInEnv, args.observation_size),
+                                 q_net,
+                                 num_actors=args.actors,
+                                 max_staleness=args.max_staleness,
+                                 gin_config=gin.config_str())
+    actor_learner.run(args.updates)
+
+
+def benchmark_vec_env(args: argparse.Namespace) -> None:
+    """Compare the step throughput of workers sending their observations through pipes, with
+    the SubprocVecEnv of Stable Baselines, to workers writing them to shared memory, on the
+    local stand-in environment
+
+    :param args: The parsed command line arguments
+    :type args: argparse.Namespace
+    """
+    env_fns = [functools.partial(StandInEnv, args.observation_size)] * args.workers
+    print("{} workers, observation size {}, {} steps".format(args.workers,
+                                                             args.observation_size, args.steps))
+    for name, vec_env_class in (('pipes', SubprocVecEnv), ('shared memory', SharedMemoryVecEnv)):
+        env = vec_env_class(env_fns)
+        actions = np.stack([env.action_space.sample() for _ in range(args.workers)])
+        env.reset()
+        duration = _time_per_call(lambda: env.step(actions), args.steps)
+        env.close()
+        print("{:14s}: {:8.1f} us/step, {:9.1f} transitions/s".format(
+            name, duration, args.workers / duration * 1e6))
+
+
+def benchmark_prioritized_replay(args: argparse.Namespace) -> None:
+    """Compare sampling a batch from the prioritized replay buffer and updating its priorities
+    with sampling uniformly from the ReplayBuffer of Stable Baselines, at full capacity
+
+    :param args: The parsed command line arguments
+    :type args: argparse.Namespace
+    """
+    observation_space = gym.spaces.Box(-np.inf, np.inf, (args.observation_size,), np.float32)
+    action_space = gym.spaces.Discrete(14)
+    uniform = ReplayBuffer(args.capacity, observation_space, action_space)
+    prioritized = PrioritizedReplayBuffer(args.capacity, observation_space, action_space)
+    for buffer in (uniform, prioritized):
+        buffer.observations[:] = np.random.randn(*buffer.observations.shape)
+        buffer.next_observations[:] = np.random.randn(*buffer.next_observations.shape)
+        buffer.full = True
+    prioritized.update_priorities(np.arange(args.capacity), np.random.exponential(
+        size=args.capacity))
+
+    td_errors = np.random.exponential(size=args.batch_size)
+    indices = prioritized.sample(args.batch_size).indices
+    print("capacity {}, batch {}, {} repeats".format(args.capacity, args.batch_size,
+                                                    args.repeats))
+    for name, function in (
+        ('uniform sample', lambda: uniform.sample(args.batch_size)),
+        ('prioritized sample', lambda: prioritized.sample(args.batch_size)),
+        ('priority update', lambda: prioritized.update_priorities(indices, td_errors)),
+    ):
+        print("{:18s}: {:9.1f} us".format(name, _time_per_call(function, args.repeats)))
+
+
+def benchmark_codec(args: argparse.Namespace) -> None:
+    """Measure the size of the encoded observations and the cost of encoding them, and verify
+    that the rewards of the decoded observations match the rewards of the originals
+
+    :param args: The parsed command line arguments
+    :type args: argparse.Namespace
+    """
+    env = ClothEnv(single_stage=True)
+    observations = [env.reset()]
+    for _ in range(args.steps - 1):
+        observation, _, done, _ = env.step(env.action_space.sample())
+        observations.append(env.reset() if done else observation)
+    observations = np.array(observations)
+    size = observations.shape[1]
+
+    print("{} observations of {} bytes".format(len(observations), size * 4))
+    for float16, delta_to_rest in ((False, False), (True, False), (True, True)):
+        codec = ObservationCodec(float16=float16,
+                                 delta_to_rest=delta_to_rest,
+                                 compression_level=args.compression_level,
+                                 rest_pose=observations[0, rewards.CLOTH_START:rewards.CLOTH_END])
+        encoded = codec.encode(observations)
+        compressed = len(codec.compress(observations)) / len(observations)
+        encode = _time_per_call(lambda: codec.encode(observations), args.repeats)
+        decode = _time_per_call(lambda: codec.decode(*encoded), args.repeats)
+        print("float16 {!s:5} delta {!s:5}: {:5d} bytes, {:7.1f} compressed, encode {:6.2f} "
+              "us, decode {:6.2f} us per observation".format(
+                  float16, delta_to_rest, codec.bytes_per_observation(size), compressed,
+                  encode / len(observations), decode / len(observations)))
+        for state in BaxterState:
+            error, changed = reward_error(codec, state, observations)
+            print("    {:12s} max reward error {:.2e}, {} changed success/failure".format(
+                str(state), error, changed))
+
+
+def benchmark_dataset(args: argparse.Namespace) -> None:
+    """Measure how fast the shuffled batches of an episode recording are streamed, which bounds
+    the speed of an offline training
+
+    :param args: The parsed command line arguments
+    :type args: argparse.Namespace
+    """
+    dataset = EpisodeDataset(args.dataset)
+    state = None if args.state is None else BaxterState.from_str(args.state)
+    batches = dataset.batches(args.batch_size, state, args.observation_range, args.shuffle_chunks)
+    next(batches)
+    start = time.perf_counter()
+    for _ in range(args.batches):
+        next(batches)
+    elapsed = time.perf_counter() - start
+    print("{} episodes, {:.0f} transitions/s, {:.2f} ms per batch of {}".format(
+        len(dataset.episodes(state)), args.batches * args.batch_size / elapsed,
+        elapsed / args.batches * 1e3, args.batch_size))
+
+
+def benchmark_inference(args: argparse.Namespace) -> None:
+    """Compare the latency of ``predict`` of Stable Baselines with the greedy inference engine
+    used for the models of the earlier states
+
+    :param args: The parsed command line arguments
+    :type args: argparse.Namespace
+    """
+    env = FilteredWrapper(ClothEnv(), args.observation_range)
+    if args.model is None:
+        model = DQN(AddaptedAdamDQNPolicy, env, buffer_size=1)
+    else:
+        model = DQN.load(args.model, env=env)
+    policy = GreedyQPolicy.from_model(model)
+
+    size = env.observation_space.shape[0]
+    print("observation size {}, {} repeats".format(size, args.repeats))
+    for batch_size in args.batch_sizes:
+        observations = np.random.randn(batch_size, size).astype(np.float32)
+        observation = observations[0] if batch_size == 1 else observations
+        sb3 = _time_per_call(lambda: model.predict(observation, deterministic=True),
+                             args.repeats)
+        greedy = _time_per_call(lambda: policy.predict(observation), args.repeats)
+        print("batch {:4d}: predict {:9.1f} us/step, engine {:9.1f} us/step ({:.1f}x)".format(
+            batch_size, sb3 / batch_size, greedy / batch_size, sb3 / greedy))
+
+
+parser = argparse.ArgumentParser(description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+subparsers = parser.add_subparsers(dest='benchmark')
+subparsers.required = True
+
+inference_parser = subparsers.add_parser(
+    'inference', help='Latency of the models of the earlier states per step')
+inference_parser.add_argument(
+    '--model',
+    help='Saved DQN model to evaluate, a freshly initialised model when omitted',
+    default=None)
+inference_parser.add_argument('--observation-range',
+                              type=_parse_range,
+                              help='Observation range of the model, e.g. 0:4,2036:2037',
+                              default=[(0, 2036)])
+inference_parser.add_argument('--batch-sizes',
+                              type=int,
+                              nargs='+',
+                              help='Amount of environments evaluated at once',
+                              default=[1, 8, 64])
+inference_parser.add_argument('--repeats', type=int, default=1000)
+inference_parser.set_defaults(function=benchmark_inference)
+
+q_update_parser = subparsers.add_parser(
+    'q-update', help='Update throughput of the custom Double DQN of q_learning')
+q_update_parser.add_argument('--observation-size', type=int, default=2036)
+q_update_parser.add_argument('--actions', type=int, default=14)
+q_update_parser.add_argument('--batch-size', type=int, default=64)
+q_update_parser.add_argument('--batches',
+                             type=int,
+                             help='Amount of batches per update of the network',
+                             default=50)
+q_update_parser.add_argument('--repeats', type=int, default=5)
+q_update_parser.set_defaults(function=benchmark_q_update)
+
+actor_learner_parser = subparsers.add_parser(
+    'actor-learner',
+    help='Throughput of the asynchronous actor/learner training on a stand-in environment')
+actor_learner_parser.add_argument('--observation-size', type=int, default=2036)
+actor_learner_parser.add_argument('--batch-size', type=int, default=64)
+actor_learner_parser.add_argument('--actors', type=int, default=2)
+actor_learner_parser.add_argument('--max-staleness', type=int, default=2)
+actor_learner_parser.add_argument('--updates', type=int, default=2000)
+actor_learner_parser.set_defaults(function=benchmark_actor_learner)
+
+vec_env_parser = subparsers.add_parser(
+    'vec-env', help='Step throughput of the workers with pipes and with shared memory')
+vec_env_parser.add_argument('--workers', type=int, default=4)
+vec_env_parser.add_argument('--observation-size', type=int, default=2036)
+vec_env_parser.add_argument('--steps', type=int, default=2000)
+vec_env_parser.set_defaults(function=benchmark_vec_env)
+
+per_parser = subparsers.add_parser(
+    'per', help='Sample and priority update cost of the prioritized replay buffer')
+per_parser.add_argument('--capacity', type=int, default=1000000)
+per_parser.add_argument('--batch-size', type=int, default=2048)
+per_parser.add_argument('--observation-size',
+                        type=int,
+                        help='Kept small, such that 1M transitions fit in memory',
+                        default=5)
+per_parser.add_argument('--repeats', type=int, default=100)
+per_parser.set_defaults(function=benchmark_prioritized_replay)
+
+codec_parser = subparsers.add_parser(
+    'codec', help='Size, cost and reward precision of the encoded observations')
+codec_parser.add_argument('--steps',
+                          type=int,
+                          help='Amount of observations collected with random actions',
+                          default=1000)
+codec_parser.add_argument('--compression-level', type=int, default=6)
+codec_parser.add_argument('--repeats', type=int, default=10)
+codec_parser.set_defaults(function=benchmark_codec)
+
+dataset_parser = subparsers.add_parser(
+    'dataset', help='Throughput of the batches streamed from an episode recording')
+dataset_parser.add_argument('--dataset', help='Folder of the recording', required=True)
+dataset_parser.add_argument('--state', help='Only the steps of this stage', default=None)
+dataset_parser.add_argument('--observation-range',
+                            type=_parse_range,
+                            help='The observation range, e.g. 0:4,2036:2037',
+                            default=None)
+dataset_parser.add_argument('--batch-size', type=int, default=4096)
+dataset_parser.add_argument('--shuffle-chunks', type=int, default=8)
+dataset_parser.add_argument('--batches', type=int, default=100)
+dataset_parser.set_defaults(function=benchmark_dataset)
+
+masking_parser = subparsers.add_parser(
+    'masking', help='Latency and allocations of the observation masks per step')
+masking_parser.add_argument(
+    '--observation-ranges',
+    type=_parse_range,
+    nargs='+',
+    help='Observation ranges to compare, e.g. 0:4,2036:2037 0:2036',
+    default=[[(0, 4), (2036, 2037)], [(0, 4)], [(0, 2036)]])
+masking_parser.add_argument('--observation-size', type=int, default=2037)
+masking_parser.add_argument('--repeats', type=int, default=100000)
+masking_parser.set_defaults(function=benchmark_masking)
+
+if __name__ == "__main__":
+    arguments = parser.parse_args()
+    arguments.function(arguments)
@@ -4,16 +4,42 @@ initializing Stable Baselines DQN models and performing
 the training.
 """
 import argparse
+import os
 import sys
-import gin
+from typing import TYPE_CHECKING, Any, List, Optional, Union
 
-from mlagents_envs.environment import UnityEnvironment
-from stable_baselines3.common.monitor import Monitor
-from stable_baselines3.common.callbacks import EvalCallback
+import gin
 
+# The profiler starts when it is imported, so before the other modules of the project
+from utilities.startup import BackgroundImporter, profiler
 from utilities.state_manager import StateManager, StateChannel, BaxterState
-from utilities.volatile_space_gym_wrapper import VolatileSpaceUnityGymWrapper
 from utilities.mode_channel import ModeChannel
+from utilities.episode_recorder import EpisodeDataset
+from utilities.observation_codec import ObservationCodec, use_observation_codec
+from simulation.cloth_env import ClothEnv
+
+if TYPE_CHECKING:
+    from mlagents_envs.environment import UnityEnvironment
+    from stable_baselines3 import DQN
+    from stable_baselines3.common.callbacks import BaseCallback
+    from baselines.memmap_replay import MemmapReplayBuffer
+
+profiler.record('import main.py', profiler.start)
+
+# The modules only needed for training, which import PyTorch and Stable Baselines. These are
+# imported in the background while Unity starts, the evaluation doesn't import them at all.
+TRAINING_MODULES = [
+    'torch', 'stable_baselines3', 'baselines.custom_dqn_policies', 'baselines.prioritized_dqn',
+    'baselines.memmap_replay', 'baselines.offline_dqn', 'utilities.parallel_eval',
+    'utilities.checkpoint', 'utilities.pipeline', 'utilities.step_profiler', 'utilities.vec_env',
+    'utilities.volatile_space_gym_wrapper'
+]
+# The configurables of the training modules, their bindings are skipped until the modules
+# are imported
+TRAINING_CONFIGURABLES = [
+    'Checkpointer', 'MemmapReplayBuffer', 'ParallelEvalCallback', 'PrioritizedReplayBuffer',
+    'StepProfilerCallback', 'build_vec_env'
+]
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--config',
@@ -33,6 +59,51 @@ parser.add_argument(
     help=
     'Single stage mode (train a single stage), else the model will be trained in a chained manner.',
     default=False)
+parser.add_argument(
+    '--num-envs',
+    type=int,
+    help=
+    'The amount of Unity instances collecting experiences in parallel, each in its own process.',
+    default=1)
+parser.add_argument(
+    '--headless',
+    action='store_true',
+    help=
+    'Simulate the scene in Python instead of running Unity, the simulation is an approximation of the Unity scene.',
+    default=False)
+parser.add_argument(
+    '--offline',
+    help=
+    'Train the stage of --train on the transitions of an episode recording, before training it in Unity when offline_training.finetune is set.',
+    default=None)
+parser.add_argument(
+    '--pipeline',
+    action='store_true',
+    help=
+    'Train all stages at once, each in its own process, the later stages reload the latest checkpoints of the earlier stages.',
+    default=False)
+parser.add_argument(
+    '--worker-offset',
+    type=int,
+    help='Offset of the worker ids of the Unity instances, to run several trainings side by side.',
+    default=0)
+parser.add_argument(
+    '--resume',
+    action='store_true',
+    help=
+    'Continue the training from the latest checkpoint in the model folder, with its optimizer, timesteps and replay buffer.',
+    default=False)
+parser.add_argument(
+    '--gin-binding',
+    action='append',
+    help='A gin binding overriding the config profile, e.g. train_fold1.gamma=0.95, can be repeated.',
+    default=[])
+parser.add_argument(
+    '--profile-startup',
+    action='store_true',
+    help=
+    'Print the duration of the imports, the Unity handshake and the other steps of the startup once the training or evaluation starts.',
+    default=False)
 args, known = parser.parse_known_args()
 
 # Check arguments for mutual exclusivity
@@ -42,17 +113,303 @@ if args.single and args.eval:
 if args.train and args.eval:
     print('--train and --eval are mutually exclusive', file=sys.stderr)
     sys.exit(1)
+if args.offline and not args.train:
+    print('--offline requires --train', file=sys.stderr)
+    sys.exit(1)
+if args.pipeline and (args.eval or args.single or args.offline):
+    print('--pipeline can\'t be combined with --eval, --single or --offline', file=sys.stderr)
+    sys.exit(1)
+if args.resume and args.eval:
+    print('--resume and --eval are mutually exclusive', file=sys.stderr)
+    sys.exit(1)
+if args.num_envs < 1:
+    print('--num-envs should be at least 1', file=sys.stderr)
+    sys.exit(1)
 
 training_name = args.name
 train_state = None if args.train is None else BaxterState.from_str(args.train)
 config_file = args.config
-evaluate_mode = args.eval or train_state is None
+evaluate_mode = args.eval or (train_state is None and not args.pipeline)
 single_stage_mode = args.single
+num_envs = args.num_envs
+headless_mode = args.headless
+offline_dataset = args.offline
+pipeline_mode = args.pipeline
+worker_offset = args.worker_offset
+profile_startup = args.profile_startup
+resume_training = args.resume
+config_path = 'configs/{}.gin'.format(config_file)
+gin_bindings = args.gin_binding
+# The training modules being imported, None once they are loaded
+training_modules: Optional[BackgroundImporter] = None
+
+# The EvalCallback is called once per step of all workers
+eval_freq = max(10000 // num_envs, 1)
+
+
+def load_training_modules() -> None:
+    """Wait until the training modules are imported and parse the config again, now that all
+    its configurables are registered. This has to be called before the config is changed by
+    the code, only the first call parses the config.
+    """
+    global training_modules  # pylint: disable=global-statement
+    if training_modules is None:
+        return
+    training_modules.wait()
+    training_modules = None
+    parse_config()
+
+
+def parse_config(skip_unknown: Union[bool, List[str]] = False) -> None:
+    """Parse the config profile and the bindings of --gin-binding, which override it
+
+    :param skip_unknown: The configurables whose bindings are skipped, e.g. when their modules
+                         aren't imported yet
+    :type skip_unknown: Union[bool, List[str]]
+    """
+    with profiler.measure('parse {}'.format(config_path)):
+        gin.parse_config_files_and_bindings([config_path],
+                                            gin_bindings,
+                                            finalize_config=False,
+                                            skip_unknown=skip_unknown)
+
+
+def start_unity(**kwargs) -> 'UnityEnvironment':
+    """Start Unity, or wait for the play button of the editor, and finish the handshake.
+    The training modules and the evaluation models keep loading in the background meanwhile.
+
+    :param kwargs: The arguments of the UnityEnvironment
+    :return: The environment
+    :rtype: UnityEnvironment
+    """
+    # pylint: disable=import-outside-toplevel
+    with profiler.measure('import mlagents_envs.environment'):
+        from mlagents_envs.environment import UnityEnvironment
+    with profiler.measure('Unity handshake'):
+        return UnityEnvironment(**kwargs)
+
+
+def report_startup() -> None:
+    """Print the steps of the startup with --profile-startup, called once the training or
+    evaluation starts
+    """
+    global profile_startup  # pylint: disable=global-statement
+    if profile_startup:
+        print(profiler.report(), file=sys.stderr)
+        profile_startup = False
+
+
+def _worker_folder(episodes_folder: Optional[str], worker_id: int) -> Optional[str]:
+    return None if episodes_folder is None else \
+        '{}worker_{}/'.format(episodes_folder, worker_id)
+
+
+def create_vec_envs(unity_file: str,
+                    unity_log_file: str,
+                    single_stage: bool,
+                    episodes_folder: Optional[str] = None):
+    """Start the Unity workers used for training, each with their own worker id.
+    In headless mode, the workers simulate the scene in Python instead.
+
+    :param unity_file: Path to the Unity executable
+    :type unity_file: str
+    :param unity_log_file: Path to store the log files of the Unity executables.
+    :type unity_log_file: str
+    :param single_stage: Whether a single stage is trained
+    :type single_stage: bool
+    :param episodes_folder: Folder to record the episodes of the training workers in
+    :type episodes_folder: Optional[str]
+    :return: the vectorized training environment
+    """
+    # pylint: disable=import-outside-toplevel
+    from utilities.vec_env import make_unity_worker, make_headless_worker, build_vec_env
+
+    if headless_mode:
+        env = build_vec_env([
+            make_headless_worker(train_state, single_stage, gin.config_str(),
+                                 _worker_folder(episodes_folder, worker_id))
+            for worker_id in range(num_envs)
+        ])
+        return env
+
+    if unity_file is None:
+        print('--num-envs requires a Unity executable, the editor can only run a single instance',
+              file=sys.stderr)
+        sys.exit(1)
+
+    log_folder = unity_log_file + training_name
+    gin_config = gin.config_str()
+    return build_vec_env([
+        make_unity_worker(worker_offset + worker_id, train_state, unity_file, log_folder,
+                          single_stage, gin_config,
+                          _worker_folder(episodes_folder, worker_id))
+        for worker_id in range(num_envs)
+    ])
+
+
+@gin.configurable
+def create_eval_callback(unity_file: Optional[str],
+                         unity_log_file: str,
+                         single_stage: bool,
+                         model_folder: str,
+                         eval_env=None,
+                         eval_workers: int = 2,
+                         n_eval_episodes: int = 5) -> 'BaseCallback':
+    """Create the callback evaluating the model during the training. The evaluations run
+    in worker processes with their own Unity instances (using the worker ids after the
+    training workers) or headless simulations, while the training continues. The Unity
+    editor can only run a single instance, so then the training environment is used.
+
+    :param unity_file: Path to the Unity executable or None when using the Unity editor
+    :type unity_file: Optional[str]
+    :param unity_log_file: Path to store the log files of the Unity executables.
+    :type unity_log_file: str
+    :param single_stage: Whether a single stage is trained
+    :type single_stage: bool
+    :param model_folder: Folder where to store the best model and the evaluations
+    :type model_folder: str
+    :param eval_env: The environment to evaluate on when using the Unity editor
+    :type eval_env: gym.Env
+    :param eval_workers: The amount of evaluation worker processes
+    :type eval_workers: int
+    :param n_eval_episodes: The amount of episodes per evaluation
+    :type n_eval_episodes: int
+    :return: The evaluation callback
+    :rtype: BaseCallback
+    """
+    # pylint: disable=import-outside-toplevel
+    from stable_baselines3.common.callbacks import EvalCallback
+    from utilities.parallel_eval import ParallelEvalCallback
+    from utilities.vec_env import make_unity_worker, make_headless_worker
+
+    if not headless_mode and unity_file is None:
+        return EvalCallback(eval_env,
+                            best_model_save_path=model_folder + 'best/',
+                            log_path=model_folder + 'logs/',
+                            eval_freq=eval_freq,
+                            n_eval_episodes=n_eval_episodes,
+                            deterministic=True,
+                            render=False)
+
+    if headless_mode:
+        env_fns = [make_headless_worker(train_state, single_stage) for _ in range(eval_workers)]
+    else:
+        log_folder = unity_log_file + training_name
+        env_fns = [
+            make_unity_worker(worker_offset + num_envs + worker, train_state, unity_file,
+                              log_folder, single_stage)
+            for worker in range(eval_workers)
+        ]
+    return ParallelEvalCallback(env_fns,
+                                eval_freq,
+                                best_model_save_path=model_folder + 'best/',
+                                log_path=model_folder + 'logs/',
+                                n_eval_episodes=n_eval_episodes,
+                                gin_config=gin.config_str())
+
+
+def create_step_profiler(state_manager: StateManager, env: Any, state_channel: Any,
+                         model_folder: str) -> 'BaseCallback':
+    """Time the phases of the training steps of the model of the state manager
+
+    :param state_manager: The state manager of the training
+    :type state_manager: StateManager
+    :param env: The training environment
+    :type env: Union[gym.Env, VecEnv]
+    :param state_channel: The state channel of the Unity environment, if any
+    :type state_channel: Optional[StateChannel]
+    :param model_folder: Folder to write the summary in when there are no TensorBoard logs
+    :type model_folder: str
+    :return: The callback timing the gradient steps and logging the durations
+    :rtype: BaseCallback
+    """
+    # pylint: disable=import-outside-toplevel
+    from utilities.step_profiler import StepProfiler, StepProfilerCallback, instrument_training
+    step_profiler = StepProfiler(lambda: state_manager.curr_state)
+    instrument_training(step_profiler, state_manager.train_model, env, state_channel)
+    return StepProfilerCallback(step_profiler, model_folder)
+
+
+def learn(model: 'DQN', total_timesteps: int, model_folder: str, save_name: str,
+          callbacks: List['BaseCallback'], replay_buffer: Optional['MemmapReplayBuffer'],
+          checkpoint_freq: int) -> None:
+    """Train the model, resumed from its latest checkpoint with --resume, and save it in the
+    background once it's done
+
+    :param model: The model to train
+    :type model: DQN
+    :param total_timesteps: The total amount of timesteps of the training, including the
+                            timesteps of a resumed checkpoint
+    :type total_timesteps: int
+    :param model_folder: Folder where to store the training weights
+    :type model_folder: str
+    :param save_name: Name of the file in which to store the model
+    :type save_name: str
+    :param callbacks: The callbacks of the training
+    :type callbacks: List[BaseCallback]
+    :param replay_buffer: The disk replay buffer of the model, if any
+    :type replay_buffer: Optional[MemmapReplayBuffer]
+    :param checkpoint_freq: Amount of steps between the checkpoints, 0 writes none
+    :type checkpoint_freq: int
+    """
+    # pylint: disable=import-outside-toplevel
+    from stable_baselines3.common.callbacks import CallbackList
+    from utilities.checkpoint import save_model
+
+    checkpoint_callback = create_checkpoint_callback(model, model_folder, checkpoint_freq)
+    if checkpoint_callback is not None:
+        callbacks = callbacks + [checkpoint_callback]
+    report_startup()
+    try:
+        model.learn(total_timesteps=total_timesteps - model.num_timesteps,
+                    tb_log_name=save_name,
+                    callback=CallbackList(callbacks) if len(callbacks) > 1 else callbacks[0],
+                    reset_num_timesteps=model.num_timesteps == 0)
+    finally:
+        # Keep the experiences for the next training, also when it is interrupted
+        if replay_buffer is not None:
+            replay_buffer.flush()
+    save_model(model, model_folder + save_name)
+
+
+def create_checkpoint_callback(model: 'DQN', model_folder: str,
+                               checkpoint_freq: int) -> Optional['BaseCallback']:
+    """Restore the latest checkpoint in the model folder with --resume, and create the
+    callback writing the checkpoints of the training
+
+    :param model: The model to train
+    :type model: DQN
+    :param model_folder: Folder of the model, the checkpoints are kept in its checkpoints/
+    :type model_folder: str
+    :param checkpoint_freq: Amount of steps between the checkpoints, 0 writes none
+    :type checkpoint_freq: int
+    :return: The callback writing the checkpoints, if any
+    :rtype: Optional[BaseCallback]
+    """
+    # pylint: disable=import-outside-toplevel
+    from utilities.checkpoint import CheckpointCallback, Checkpointer
+    checkpointer = Checkpointer(model_folder + 'checkpoints/', resume=resume_training)
+    if resume_training:
+        if checkpointer.restore(model):
+            print('Resuming the training at {} timesteps'.format(model.num_timesteps))
+        else:
+            print('There is no checkpoint in {}checkpoints/ to resume'.format(model_folder),
+                  file=sys.stderr)
+    if checkpoint_freq <= 0:
+        return None
+    # The callback is called once per step of all workers
+    return CheckpointCallback(checkpointer, max(checkpoint_freq // num_envs, 1))
 
 
 @gin.configurable
 def train_loop(unity_file: str, unity_log_file: str, total_timesteps: int,
-               model_folder: str, save_name: str):
+               model_folder: str, save_name: str, disk_replay_buffer: bool = False,
+               compress_observations: bool = False,
+               episodes_folder: Optional[str] = None,
+               pretrained: Optional[str] = None,
+               callback: Optional['BaseCallback'] = None,
+               profile_steps: bool = False,
+               checkpoint_freq: int = 0):
     """This method will start a training loop of the Reinforcement Learning
     using the specified parameters.
 
@@ -67,33 +424,90 @@ def train_loop(unity_file: str, unity_log_file: str, total_timesteps: int,
     :type model_folder: str
     :param save_name: Name of the file in which to store the model
     :type save_name: str
+    :param disk_replay_buffer: Keep the replay buffer in memory mapped files in the model
+                               folder, which resumes the buffer of an earlier training
+    :type disk_replay_buffer: bool
+    :param compress_observations: Store the observations in the replay buffer encoded by
+                                  the ``ObservationCodec``
+    :type compress_observations: bool
+    :param episodes_folder: Folder to record the training episodes in, with a subfolder per
+                            worker of a vectorized environment, nothing is recorded when None
+    :type episodes_folder: Optional[str]
+    :param pretrained: Start from the weights of this model, e.g. of an offline training
+    :type pretrained: Optional[str]
+    :param callback: Called during the training next to the evaluation
+    :type callback: Optional[BaseCallback]
+    :param profile_steps: Log the durations of the phases of the training steps
+    :type profile_steps: bool
+    :param checkpoint_freq: Amount of steps between writing a checkpoint to resume the training
+                            from with --resume, 0 writes none
+    :type checkpoint_freq: int
     """
     print(f'training {train_state}')
+    # The training modules are imported in the background until Unity has started
+    # pylint: disable=import-outside-toplevel
 
     state_manager = StateManager(train_state)
-    state_channel = StateChannel(state_manager)
 
-    env = UnityEnvironment(file_name=unity_file,
-                           seed=1,
-                           side_channels=[state_channel],
-                           log_folder=unity_log_file + training_name)
-    env = VolatileSpaceUnityGymWrapper(env, state_manager)
-    state_manager.initialize_env(env)
+    eval_env = None
+    state_channel = None
+    if num_envs > 1:
+        load_training_modules()
+        env = create_vec_envs(unity_file, unity_log_file, False, episodes_folder)
+        state_manager.initialize_env(env)
+    elif headless_mode:
+        load_training_modules()
+        from utilities.vec_env import record_episodes
+        env = record_episodes(ClothEnv(state_manager), episodes_folder, state_manager)
+        state_manager.initialize_env(env)
+    else:
+        state_channel = StateChannel(state_manager)
 
-    # let unity know which model we're training, so it can end the episode after this state
-    state_channel.send_string(train_state)
-
-    eval_callback = EvalCallback(Monitor(state_manager.train_model.env.envs[0]),
-                                 best_model_save_path=model_folder + 'best/',
-                                 log_path=model_folder + 'logs/',
-                                 eval_freq=10000,
-                                 deterministic=True,
-                                 render=False)
-    state_manager.train_model.learn(total_timesteps=total_timesteps,
-                                    tb_log_name=save_name,
-                                    callback=eval_callback)
-    state_manager.train_model.save(model_folder + save_name)
+        env = start_unity(file_name=unity_file,
+                          worker_id=worker_offset,
+                          seed=1,
+                          side_channels=[state_channel],
+                          log_folder=unity_log_file + training_name)
+        load_training_modules()
+        from stable_baselines3.common.monitor import Monitor
+        from utilities.vec_env import record_episodes
+        from utilities.volatile_space_gym_wrapper import VolatileSpaceUnityGymWrapper
+        env = VolatileSpaceUnityGymWrapper(env, state_manager, state_channel)
+        env = record_episodes(env, episodes_folder, state_manager)
+        state_manager.initialize_env(env)
+
+        # let unity know which model we're training, so it can end the episode after this state
+        state_channel.send_train_state(train_state)
+        eval_env = Monitor(state_manager.train_model.env.envs[0])
+
+    if pretrained is not None:
+        state_manager.train_model.set_parameters(pretrained)
+
+    from baselines.memmap_replay import use_disk_replay_buffer
+
+    codec = ObservationCodec.for_observation_range(state_manager.train_observation_range) \
+        if compress_observations else None
+    replay_buffer = None
+    if disk_replay_buffer:
+        replay_buffer = use_disk_replay_buffer(state_manager.train_model,
+                                               model_folder + 'replay_buffer/', codec)
+    elif codec is not None:
+        use_observation_codec(state_manager.train_model.replay_buffer, codec)
+
+    callbacks = [
+        create_eval_callback(unity_file, unity_log_file, False, model_folder, eval_env)
+    ]
+    if callback is not None:
+        callbacks.append(callback)
+    if profile_steps:
+        callbacks.append(create_step_profiler(state_manager, env, state_channel, model_folder))
+    learn(state_manager.train_model, total_timesteps, model_folder, save_name, callbacks,
+          replay_buffer, checkpoint_freq)
     env.close()
+    # The model is written in the background while the environment closes
+    # pylint: disable=import-outside-toplevel
+    from utilities.checkpoint import writer
+    writer.wait()
 
 
 def eval_loop():
@@ -101,18 +515,23 @@ def eval_loop():
     """
     print("evaluation mode")
     state_manager = StateManager()
-    state_channel = StateChannel(state_manager)
 
-    env = UnityEnvironment(file_name=None,
-                           seed=1,
-                           side_channels=[state_channel])
-    env = VolatileSpaceUnityGymWrapper(env)
+    if headless_mode:
+        env = ClothEnv(state_manager)
+    else:
+        # pylint: disable=import-outside-toplevel
+        from utilities.volatile_space_gym_wrapper import VolatileSpaceUnityGymWrapper
+        state_channel = StateChannel(state_manager)
+
+        env = start_unity(file_name=None, seed=1, side_channels=[state_channel])
+        env = VolatileSpaceUnityGymWrapper(env, state_channel=state_channel)
     state_manager.initialize_env(env)
+    report_startup()
 
     steps = 10000
     obs = env.reset()
     for _ in range(steps):
-        action, _state = state_manager.eval_model.predict(obs)
+        action, _state = state_manager.eval_policy.predict(obs)
         obs, _, done, _ = env.step(action)
         env.render()
         if done:
@@ -123,7 +542,12 @@ def eval_loop():
 @gin.configurable
 def single_stage_training(unity_file: str, unity_log_file: str,
                           total_timesteps: int, model_folder: str,
-                          save_name: str):
+                          save_name: str, disk_replay_buffer: bool = False,
+                          compress_observations: bool = False,
+                          episodes_folder: Optional[str] = None,
+                          pretrained: Optional[str] = None,
+                          profile_steps: bool = False,
+                          checkpoint_freq: int = 0):
     """This method will start the training of a single stage with the specified
     training stage
 
@@ -138,44 +562,190 @@ def single_stage_training(unity_file: str, unity_log_file: str,
     :type model_folder: str
     :param save_name: Name of the file in which to store the model
     :type save_name: str
+    :param disk_replay_buffer: Keep the replay buffer in memory mapped files in the model
+                               folder, which resumes the buffer of an earlier training
+    :type disk_replay_buffer: bool
+    :param compress_observations: Store the observations in the replay buffer encoded by
+                                  the ``ObservationCodec``
+    :type compress_observations: bool
+    :param episodes_folder: Folder to record the training episodes in, with a subfolder per
+                            worker of a vectorized environment, nothing is recorded when None
+    :type episodes_folder: Optional[str]
+    :param pretrained: Start from the weights of this model, e.g. of an offline training
+    :type pretrained: Optional[str]
+    :param profile_steps: Log the durations of the phases of the training steps
+    :type profile_steps: bool
+    :param checkpoint_freq: Amount of steps between writing a checkpoint to resume the training
+                            from with --resume, 0 writes none
+    :type checkpoint_freq: int
     """
     print("training single stage {}".format(train_state))
-
-    mode_channel = ModeChannel()
+    # The training modules are imported in the background until Unity has started
+    # pylint: disable=import-outside-toplevel
 
     state_manager = StateManager(train_state)
-    state_channel = StateChannel(state_manager)
 
-    env = UnityEnvironment(file_name=unity_file,
-                           seed=1,
-                           side_channels=[state_channel, mode_channel],
-                           log_folder=unity_log_file + training_name)
-    env = VolatileSpaceUnityGymWrapper(env, state_manager)
+    eval_env = None
+    state_channel = None
+    if num_envs > 1:
+        load_training_modules()
+        env = create_vec_envs(unity_file, unity_log_file, True, episodes_folder)
+        state_manager.initialize_env(env)
+    elif headless_mode:
+        load_training_modules()
+        from utilities.vec_env import record_episodes
+        env = record_episodes(ClothEnv(state_manager, single_stage=True), episodes_folder,
+                              state_manager)
+        state_manager.initialize_env(env)
+    else:
+        mode_channel = ModeChannel()
+        state_channel = StateChannel(state_manager)
+
+        env = start_unity(file_name=unity_file,
+                          worker_id=worker_offset,
+                          seed=1,
+                          side_channels=[state_channel, mode_channel],
+                          log_folder=unity_log_file + training_name)
+        load_training_modules()
+        from stable_baselines3.common.monitor import Monitor
+        from utilities.vec_env import record_episodes
+        from utilities.volatile_space_gym_wrapper import VolatileSpaceUnityGymWrapper
+        env = VolatileSpaceUnityGymWrapper(env, state_manager, state_channel)
+        env = record_episodes(env, episodes_folder, state_manager)
+        state_manager.initialize_env(env)
+
+        mode_channel.send_mode('Single')
+        # let unity know which model we're training, so it can end the episode after this state
+        state_channel.send_train_state(train_state)
+        eval_env = Monitor(env)
+
+    if pretrained is not None:
+        state_manager.train_model.set_parameters(pretrained)
+
+    from baselines.memmap_replay import use_disk_replay_buffer
+
+    codec = ObservationCodec.for_observation_range(state_manager.train_observation_range) \
+        if compress_observations else None
+    replay_buffer = None
+    if disk_replay_buffer:
+        replay_buffer = use_disk_replay_buffer(state_manager.train_model,
+                                               model_folder + 'replay_buffer/', codec)
+    elif codec is not None:
+        use_observation_codec(state_manager.train_model.replay_buffer, codec)
+
+    callbacks = [
+        create_eval_callback(unity_file, unity_log_file, True, model_folder, eval_env)
+    ]
+    if profile_steps:
+        callbacks.append(create_step_profiler(state_manager, env, state_channel, model_folder))
+    learn(state_manager.train_model, total_timesteps, model_folder, save_name, callbacks,
+          replay_buffer, checkpoint_freq)
+    env.close()
+    # The model is written in the background while the environment closes
+    # pylint: disable=import-outside-toplevel
+    from utilities.checkpoint import writer
+    writer.wait()
+
+
+@gin.configurable
+def offline_training(gradient_steps: int,
+                     model_folder: str,
+                     save_name: str,
+                     batch_size: int = 4096,
+                     shuffle_chunks: int = 8,
+                     finetune: bool = False):
+    """This method will train the model of the training stage on the transitions of an episode
+    recording, without starting Unity. The headless simulation only provides the spaces of the
+    model.
+
+    :param gradient_steps: The amount of batches to train on
+    :type gradient_steps: int
+    :param model_folder: Folder where to store the training weights
+    :type model_folder: str
+    :param save_name: Name of the file in which to store the model
+    :type save_name: str
+    :param batch_size: The amount of transitions per batch, streamed from the recording
+    :type batch_size: int
+    :param shuffle_chunks: Amount of chunks of the recording of which the transitions
+                           are shuffled together
+    :type shuffle_chunks: int
+    :param finetune: Continue with the online training of the stage, starting from the
+                     offline trained model
+    :type finetune: bool
+    """
+    print("offline training {} on {}".format(train_state, offline_dataset))
+    load_training_modules()
+    # pylint: disable=import-outside-toplevel
+    from baselines.offline_dqn import pretrain
+
+    state_manager = StateManager(train_state)
+    env = ClothEnv(state_manager, single_stage=single_stage_mode)
     state_manager.initialize_env(env)
+    report_startup()
 
-    mode_channel.send_string('Single')
-    # let unity know which model we're training, so it can end the episode after this state
-    state_channel.send_string(train_state)
-
-    eval_callback = EvalCallback(Monitor(env),
-                                 best_model_save_path=model_folder + 'best/',
-                                 log_path=model_folder + 'logs/',
-                                 eval_freq=10000,
-                                 deterministic=True,
-                                 render=False)
-    state_manager.train_model.learn(total_timesteps=total_timesteps,
-                                    tb_log_name=save_name,
-                                    callback=eval_callback)
+    pretrain(state_manager.train_model, EpisodeDataset(offline_dataset), train_state,
+             state_manager.train_observation_range, gradient_steps, batch_size, shuffle_chunks)
     state_manager.train_model.save(model_folder + save_name)
     env.close()
 
+    if finetune:
+        # The arguments are configured using gin
+        # pylint: disable=no-value-for-parameter
+        if single_stage_mode:
+            single_stage_training(pretrained=model_folder + save_name)
+        else:
+            train_loop(pretrained=model_folder + save_name)
+
+
+@gin.configurable
+def pipeline_training(folder: str, publish_freq: int = 10000):
+    """This method will train all stages at once. Without a training stage, it starts a
+    process per stage running this method with that stage. A stage trains in the chained
+    manner, with the latest checkpoints of the earlier stages as their evaluation models.
+
+    :param folder: Folder of the checkpoints of the stages, with a model folder per stage
+    :type folder: str
+    :param publish_freq: Amount of steps between publishing a checkpoint of a stage
+    :type publish_freq: int
+    """
+    # pylint: disable=import-outside-toplevel
+    from utilities import pipeline
+
+    if train_state is None:
+        if not headless_mode and gin.query_parameter('train_loop.unity_file') is None:
+            print('--pipeline requires a Unity executable, '
+                  'the editor can only run a single instance',
+                  file=sys.stderr)
+            sys.exit(1)
+        pipeline.seed_checkpoints(folder)
+        sys.exit(pipeline.launch_stages(sys.argv[1:], training_name))
+
+    print("pipeline training {}".format(train_state))
+    # The config is parsed again once the training modules are loaded, so before changing it
+    load_training_modules()
+    checkpoint = pipeline.checkpoint_file(folder, train_state)
+    pipeline.configure_stage(folder, train_state)
+    gin.bind_parameter('train_loop.model_folder',
+                       '{}{}/'.format(folder, BaxterState.to_csharp(train_state)))
+    pipeline.wait_for_upstream(folder, train_state)
+    # The arguments are configured using gin
+    # pylint: disable=no-value-for-parameter
+    train_loop(pretrained=checkpoint if os.path.isfile(checkpoint) else None,
+               callback=pipeline.CheckpointPublisher(checkpoint, publish_freq))
+
 
 if __name__ == "__main__":
-    gin.parse_config_file('configs/{}.gin'.format(config_file))
+    parse_config(skip_unknown=TRAINING_CONFIGURABLES)
+    if not evaluate_mode and train_state is not None:
+        training_modules = BackgroundImporter(TRAINING_MODULES)
     # pylint doesn't pick up that this model is configured using gin, and thus doesn't need arguments.
     # pylint: disable=no-value-for-parameter
     if evaluate_mode:
         eval_loop()
+    elif offline_dataset is not None:
+        offline_training()
+    elif pipeline_mode:
+        pipeline_training()
     elif single_stage_mode:
         single_stage_training()
     else:
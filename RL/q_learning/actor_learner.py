@@ -0,0 +1,303 @@
+"""
+This module contains an asynchronous variant of the Trainer: actor processes
+keep collecting experiences while the learner keeps training the QNetwork.
+"""
+import multiprocessing as mp
+import queue
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+import gin
+import gym
+import numpy as np
+
+import q_learning.q_network as q_network
+from q_learning.models import Observation
+from q_learning.replay_buffer import ReplayBatch, ReplayBuffer, Transition
+from q_learning.trainer import Trainer
+from utilities.inference import GreedyQPolicy
+
+if TYPE_CHECKING:
+    # Only the learner uses TensorFlow, the actor processes import this module without it
+    from q_learning.mlp_q_network import MLPQNetwork
+
+class PublishedQNetwork(q_network.QNetwork):
+    """
+    The QNetwork used by the actors, running the weights published by the learner
+    with NumPy so the actors don't need a TensorFlow model of their own.
+    """
+
+    def __init__(self, weights: List[np.ndarray]):
+        self.policy = GreedyQPolicy.from_dense_weights(weights)
+
+    def set_weights(self, weights: List[np.ndarray]) -> None:
+        """Replace the weights by newly published ones
+
+        :param weights: The kernel and bias of every layer, alternating
+        :type weights: List[np.ndarray]
+        """
+        self.policy = GreedyQPolicy.from_dense_weights(weights)
+
+    def inference(self, obs: Observation) -> np.ndarray:
+        return self.policy.q_values(obs.observation_space[None])[0]
+
+
+def _put(target: mp.Queue, item, stop: mp.Event) -> bool:
+    """Put an item on a bounded queue, without blocking once the training stopped
+
+    :return: Whether the item was put on the queue
+    :rtype: bool
+    """
+    while not stop.is_set():
+        try:
+            target.put(item, timeout=1.)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _run_actor(actor_id: int, env_fn: Callable[[], gym.Env], epsilon: float,
+               chunk_size: int, max_staleness: int, gin_config: Optional[str],
+               experiences: mp.Queue, weights: mp.Queue, published: mp.Value,
+               steps: mp.Value, stop: mp.Event) -> None:
+    """Collect experiences until the learner stops, this runs in the process of an actor
+
+    :param actor_id: The index of the actor
+    :param env_fn: Function creating the environment of the actor
+    :param epsilon: The probability of performing a random action
+    :param chunk_size: Amount of experiences sent to the learner at once
+    :param max_staleness: Amount of weight versions the actor may lag behind the learner
+    :param gin_config: The gin configuration to parse in the actor process
+    :param experiences: Queue of the experience chunks to the learner
+    :param weights: Queue of the published weights of this actor
+    :param published: The latest published weights version
+    :param steps: Counter of the environment steps of this actor
+    :param stop: Set by the learner once the training is done
+    """
+    if gin_config is not None:
+        gin.parse_config(gin_config, skip_unknown=True)
+    # Don't wait for the learner to read the last chunks when exiting
+    experiences.cancel_join_thread()
+
+    env = env_fn()
+    version, latest = weights.get()
+    q_net = PublishedQNetwork(latest)
+
+    chunk: List[Transition] = []
+    for _, experience in Trainer.collect_experiences(env, q_net, epsilon):
+        with steps.get_lock():
+            steps.value += 1
+        if stop.is_set():
+            break
+        if experience is None:
+            continue
+        chunk.append(experience)
+        if len(chunk) < chunk_size:
+            continue
+
+        if not _put(experiences, (actor_id, version, chunk), stop):
+            break
+        chunk = []
+
+        # Take the latest weights, only wait for them when the actor lags too far behind
+        while not stop.is_set():
+            stale = published.value - version > max_staleness
+            try:
+                version, latest = weights.get(block=stale, timeout=1. if stale else None)
+            except queue.Empty:
+                if stale:
+                    continue
+                break
+            q_net.set_weights(latest)
+    env.close()
+
+
+@gin.configurable
+class ActorLearner:
+    """
+    Trains an MLPQNetwork while several actor processes collect experiences with the
+    latest weights the learner published. Like ``MLPQNetwork.inference``, the actors act with
+    the target network, so the weights are published whenever the target network is updated.
+    Every actor keeps its own part of the replay memory, as the experiences of a ReplayBuffer
+    have to arrive in the order they happened.
+
+    The staleness is bounded: an actor acting with weights that are more than
+    ``max_staleness`` versions old waits for the next weights before collecting more.
+    """
+
+    def __init__(self,
+                 env_fn: Callable[[], gym.Env],
+                 q_net: 'MLPQNetwork',
+                 num_actors: int = 2,
+                 buffer_size: int = 100000,
+                 chunk_size: int = 64,
+                 learning_starts: int = 1000,
+                 epsilon: float = 0.1,
+                 target_update_interval: int = 500,
+                 max_staleness: int = 2,
+                 start_method: Optional[str] = None,
+                 gin_config: Optional[str] = None):
+        """
+        :param env_fn: Function creating the environment of an actor, it has to be picklable
+        :type env_fn: Callable[[], gym.Env]
+        :param q_net: The QNetwork to train
+        :type q_net: MLPQNetwork
+        :param num_actors: Amount of actor processes
+        :type num_actors: int
+        :param buffer_size: Amount of experiences kept in the replay memory, over all actors
+        :type buffer_size: int
+        :param chunk_size: Amount of experiences an actor sends to the learner at once
+        :type chunk_size: int
+        :param learning_starts: Amount of experiences to collect before training starts
+        :type learning_starts: int
+        :param epsilon: The probability of performing a random action
+        :type epsilon: float
+        :param target_update_interval: Amount of updates between updating the target network
+                                       and publishing its weights
+        :type target_update_interval: int
+        :param max_staleness: Amount of weight versions an actor may lag behind the learner
+        :type max_staleness: int
+        :param start_method: The multiprocessing start method of the actors, defaults to
+                             forkserver when available, as TensorFlow doesn't survive a fork
+        :type start_method: Optional[str]
+        :param gin_config: The gin configuration to parse in the actor processes
+        :type gin_config: Optional[str]
+        """
+        self.env_fn = env_fn
+        self.q_net = q_net
+        self.num_actors = num_actors
+        self.chunk_size = chunk_size
+        self.learning_starts = learning_starts
+        self.epsilon = epsilon
+        self.target_update_interval = target_update_interval
+        self.max_staleness = max_staleness
+        self.gin_config = gin_config
+
+        if start_method is None:
+            start_method = 'forkserver' if 'forkserver' in mp.get_all_start_methods() \
+                else 'spawn'
+        self._context = mp.get_context(start_method)
+
+        self.buffers = [
+            ReplayBuffer(buffer_size // num_actors, q_net.input_size)
+            for _ in range(num_actors)
+        ]
+        self.version = 0
+        self.updates = 0
+        self.received = 0
+
+    def _buffered(self) -> int:
+        return sum(len(buffer) for buffer in self.buffers)
+
+    def _sample(self, batch_size: int) -> ReplayBatch:
+        """Sample a batch from the memories of all actors, proportional to their size
+
+        :param batch_size: The amount of experiences
+        :type batch_size: int
+        :return: The sampled experiences
+        :rtype: ReplayBatch
+        """
+        sizes = np.array([len(buffer) for buffer in self.buffers], dtype=np.float64)
+        counts = np.random.multinomial(batch_size, sizes / sizes.sum())
+        batches = [
+            buffer.sample(count) for buffer, count in zip(self.buffers, counts) if count > 0
+        ]
+        return ReplayBatch(*[np.concatenate(field) for field in zip(*batches)])
+
+    def _receive(self, experiences: mp.Queue, block: bool) -> None:
+        """Move the chunks the actors sent into their replay memory
+
+        :param experiences: Queue of the experience chunks
+        :type experiences: mp.Queue
+        :param block: Wait for a chunk when none has arrived yet
+        :type block: bool
+        """
+        while True:
+            try:
+                actor_id, _, chunk = experiences.get(block=block, timeout=1. if block else None)
+            except queue.Empty:
+                return
+            for experience in chunk:
+                self.buffers[actor_id].add(*experience)
+            self.received += len(chunk)
+            block = False
+
+    def _publish(self, weights: List[mp.Queue], published: mp.Value) -> None:
+        self.version += 1
+        latest = self.q_net.get_weights()
+        for actor_weights in weights:
+            actor_weights.put((self.version, latest))
+        published.value = self.version
+
+    def run(self, total_updates: int, log_interval: float = 10.) -> Dict[str, float]:
+        """Train until the learner performed the given amount of updates
+
+        :param total_updates: The amount of batches to train on
+        :type total_updates: int
+        :param log_interval: Seconds between printing the throughput counters
+        :type log_interval: float
+        :return: The throughput counters of the actors and the learner
+        :rtype: Dict[str, float]
+        """
+        experiences = self._context.Queue(maxsize=2 * self.num_actors)
+        weights = [self._context.Queue() for _ in range(self.num_actors)]
+        published = self._context.Value('i', 0)
+        steps = [self._context.Value('l', 0) for _ in range(self.num_actors)]
+        stop = self._context.Event()
+
+        actors = [
+            self._context.Process(target=_run_actor,
+                                  args=(actor_id, self.env_fn, self.epsilon, self.chunk_size,
+                                        self.max_staleness, self.gin_config, experiences,
+                                        weights[actor_id], published, steps[actor_id], stop),
+                                  daemon=True) for actor_id in range(self.num_actors)
+        ]
+        for actor in actors:
+            actor.start()
+        self._publish(weights, published)
+
+        start = last_log = time.perf_counter()
+        try:
+            while self.updates < total_updates:
+                warming_up = self._buffered() < self.learning_starts
+                self._receive(experiences, block=warming_up)
+                if warming_up:
+                    continue
+
+                self.q_net.update(self._sample(self.q_net.batch_size))
+                self.updates += 1
+                if self.updates % self.target_update_interval == 0:
+                    self.q_net.update_target()
+                    self._publish(weights, published)
+
+                if time.perf_counter() - last_log >= log_interval:
+                    last_log = time.perf_counter()
+                    print(self._counters(steps, last_log - start))
+        finally:
+            stop.set()
+            for actor in actors:
+                actor.join(timeout=5.)
+                if actor.is_alive():
+                    actor.terminate()
+
+        counters = self._counters(steps, time.perf_counter() - start)
+        print(counters)
+        return counters
+
+    def _counters(self, steps: List[mp.Value], duration: float) -> Dict[str, float]:
+        """Collect the throughput counters of both sides
+
+        :return: The totals and rates of the actors and the learner
+        :rtype: Dict[str, float]
+        """
+        actor_steps = sum(counter.value for counter in steps)
+        return {
+            'actor_steps': actor_steps,
+            'actor_steps_per_second': actor_steps / duration,
+            'received_experiences': self.received,
+            'learner_updates': self.updates,
+            'learner_updates_per_second': self.updates / duration,
+            'learner_samples_per_second': self.updates * self.q_net.batch_size / duration,
+            'weights_version': self.version,
+        }
@@ -2,14 +2,92 @@
 This module provides a wrapper for the Unity Environment
 that was used in our custom MLP QNetwork.
 """
-
-from typing import List
+import functools
+from typing import List, Union
 
 import numpy as np
 from gym_unity.envs import UnityToGymWrapper, GymStepResult
 from mlagents_envs.base_env import BaseEnv
 
-from q_learning.models import ModelsConfig
+from q_learning.models import models_config
+
+# The amount of decisions of the MLP QNetwork: 7 joints, backwards or forwards
+DECISIONS = 14
+# The decision index of an output without any decision, which doesn't move any joint
+NO_OP = DECISIONS
+
+
+def _unity_action(position: int, size: int) -> np.ndarray:
+    """Convert a single decision to the input of the Unity environment
+
+    :param position: The index of the decision, NO_OP for no decision
+    :type position: int
+    :param size: The size of the Unity action, ``baxter_end + 1``
+    :type size: int
+    :return: The Unity action
+    :rtype: np.ndarray
+    """
+    result = np.zeros(size)
+    if position == NO_OP:
+        return result
+
+    # Determine which joint moves
+    joint = 1 + (position // 2)
+    # 0 in our decision means backwards; 1 means forward; we convert this for Unity
+    result[joint] = 1 if position % 2 else -1
+
+    # For stretching joints we won't mirror the action and
+    # just perform the same action on the joint on the opposite arm,
+    # for rotating joints we will however mirror the action itself
+    mirror = 1
+    if (joint - 1) % 2 == 0:
+        mirror = -1
+    result[-7:] = result[1:8] * mirror
+    return result
+
+
+@functools.lru_cache(maxsize=None)
+def action_table(size: int) -> np.ndarray:
+    """The Unity actions of all decisions, with the mirroring of the opposite arm applied.
+    Row ``i`` holds the action of decision ``i``, the last row is the NO_OP action.
+
+    :param size: The size of the Unity action, ``baxter_end + 1``
+    :type size: int
+    :return: The read-only table of the Unity actions, of shape (DECISIONS + 1, size)
+    :rtype: np.ndarray
+    """
+    table = np.stack([_unity_action(position, size) for position in range(DECISIONS + 1)])
+    table.flags.writeable = False
+    return table
+
+
+def decision_indices(decision_outputs: np.ndarray) -> Union[int, np.ndarray]:
+    """The indices of the decisions of the MLP QNetwork: the action with the highest value,
+    or NO_OP when all values are zero
+
+    :param decision_outputs: The outputs of the DQN, of shape (14,) or (N, 14) for N envs
+    :type decision_outputs: np.ndarray
+    :return: The decision index, or an array of N indices
+    :rtype: Union[int, np.ndarray]
+    """
+    decision_outputs = np.asarray(decision_outputs)
+    if decision_outputs.ndim == 1:
+        return int(np.argmax(decision_outputs)) if decision_outputs.any() else NO_OP
+    return np.where(decision_outputs.any(axis=1), decision_outputs.argmax(axis=1), NO_OP)
+
+
+def decode_actions(decisions: Union[int, np.ndarray], size: int) -> np.ndarray:
+    """Convert a decision, or the decisions of N envs at once, to their Unity actions
+
+    :param decisions: The decision index, or the decision indices of the envs,
+                      NO_OP for no decision
+    :type decisions: Union[int, np.ndarray]
+    :param size: The size of the Unity action, ``baxter_end + 1``
+    :type size: int
+    :return: The Unity action of shape (size,), or the Unity actions of shape (N, size)
+    :rtype: np.ndarray
+    """
+    return action_table(size)[decisions]
 
 
 class UnityToMLPGymWrapper(UnityToGymWrapper):
@@ -21,44 +99,18 @@ class UnityToMLPGymWrapper(UnityToGymWrapper):
 
     def __init__(self, unity_env: BaseEnv):
         super().__init__(unity_env)
-        # pylint doesn't pick up that this model is configured using gin, and thus doesn't need arguments.
-        # pylint: disable=no-value-for-parameter
-        self.models_config = ModelsConfig()
+        self.models_config = models_config()
+        self.action_size = self.models_config.baxter_end + 1
 
-    def step(self, action: List[float]) -> GymStepResult:
+    def step(self, action: Union[List[float], np.ndarray]) -> GymStepResult:
         """Perform one timestep in the environment, taking our own
         MLPQNetwork's action as input and transforming it a single action for Unity
 
         :param action: The output of the DQN; in the MLP QNetwork configured to be
-         of length 7 (one for each joint on a single arm)
-        :type action: List[float]
+         of length 14 (backwards and forwards for each joint on a single arm)
+        :type action: Union[List[float], np.ndarray]
         :return: The output of a GymStep by the Unity Gym Environment
         :rtype: GymStepResult
         """
-        action = np.array(action)
-
-        # Determine which joint moves
-        position = np.argmax(action)
-        joint = 1 + (position // 2)
-
-        # Convert this to the input position expected by unity
-        unity_action = (position % 2)
-
-        # Creating a list for the input of the Unity environment
-        result = np.zeros(self.models_config.baxter_end + 1)
-        if action.any():
-            # 0 in our unity_action means backwards; 1 means forward; we convert this for Unity
-            if unity_action == 0:
-                unity_action = -1
-            result[joint] = unity_action
-
-            # For stretching joints we won't mirror the action and
-            # just perform the same action on the joint on the opposite arm,
-            # for rotating joints we will however mirror the action itself
-            mirror = 1
-            if (joint - 1) % 2 == 0:
-                mirror = -1
-            result[-7:] = result[1:8] * mirror
-
         # Perform the action on the Unity Environment
-        return super().step(list(result))
+        return super().step(decode_actions(decision_indices(action), self.action_size))
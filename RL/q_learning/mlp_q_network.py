@@ -2,7 +2,7 @@
 This module contains an implementation of an
 MLP backed Double DQN based on TensorFlow.
 """
-import random
+from typing import List
 
 import gin
 import q_learning.q_network as q_network
@@ -10,14 +10,16 @@ import tensorflow as tf
 import numpy as np
 from tensorflow.keras.layers import Dense
 from tensorflow.keras.models import Sequential
-from q_learning.models import Observation, Buffer
+from q_learning.models import Observation
+from q_learning.replay_buffer import Buffer, ReplayBatch
 
 
 @gin.configurable
 class MLPQNetwork(q_network.QNetwork):
     """
     This class implements an MLP-Based
-    Double Deep Q Network using TensorFlow
+    Double Deep Q Network using TensorFlow, the online network selects
+    the next action and the target network evaluates it
     """
 
     def __init__(self, input_size: int, output_size: int, batch_size: int,
@@ -31,6 +33,7 @@ class MLPQNetwork(q_network.QNetwork):
         self.batch_size = batch_size
         self.epochs = epochs
         self.gamma = gamma
+        self.optimizer = self.mlp.optimizer
 
     def inference(self, obs: Observation) -> np.ndarray:
         observation = obs.observation_space
@@ -42,44 +45,71 @@ class MLPQNetwork(q_network.QNetwork):
 
     def train(self, buffer: Buffer) -> None:
         batch_size = min(len(buffer), self.batch_size)
-        random.shuffle(buffer)
-        # Split the buffer into batches
-        batches = [
-            buffer[batch_size * start:batch_size * (start + 1)]
-            for start in range(len(buffer) // batch_size)
-        ]
-        for batch in batches:
-            for _ in range(self.epochs):
-                X = []
-                Y = []
-                targets = self.mlp_target.predict(
-                    tf.convert_to_tensor(np.stack(
-                        [ex.obs.observation_space for ex in batch]),
-                                         dtype=tf.float32))
-                future_targets = self.mlp_target.predict(
-                    tf.convert_to_tensor(np.stack(
-                        [ex.next_obs.observation_space for ex in batch]),
-                                         dtype=tf.float32))
-                for idx, _ in enumerate(batch):
-                    sample = batch[idx]
-                    state = sample.obs.observation_space.reshape(1, -1)
-                    reward = sample.reward
-                    done = sample.done
-                    action = np.argmax(sample.action.decision_output)
-                    target = targets[idx]
-                    if done:
-                        target[action] = reward
-                    else:
-                        # Compute the Bellman Equation
-                        q_future = max(future_targets[idx])
-                        target[action] = reward + q_future * self.gamma
-                    X.append(state)
-                    Y.append(target.reshape(1, -1))
-                X = tf.concat(X, 0)
-                Y = tf.concat(Y, 0)
-                self.mlp.fit(x=X, y=Y, epochs=1, batch_size=batch_size)
+        for batch in buffer.batches(batch_size):
+            self.update(batch)
+        self.update_target()
+
+    def update(self, batch: ReplayBatch) -> float:
+        """Train the online network on a single batch of experiences for ``epochs`` steps
+
+        :param batch: The experiences
+        :type batch: ReplayBatch
+        :return: The loss of the last step
+        :rtype: float
+        """
+        tensors = [tf.convert_to_tensor(array) for array in batch]
+        loss = 0.
+        for _ in range(self.epochs):
+            loss = self._train_step(*tensors)
+        return float(loss)
+
+    def update_target(self) -> None:
+        """Copy the weights of the online network to the target network
+        """
         self.mlp_target.set_weights(self.mlp.get_weights())
 
+    def get_weights(self) -> List[np.ndarray]:
+        """Get the weights of the target network, which ``inference`` acts with, e.g. to act
+        with them in another process
+
+        :return: The kernel and bias of every layer, alternating
+        :rtype: List[np.ndarray]
+        """
+        return self.mlp_target.get_weights()
+
+    @tf.function
+    def _train_step(self, observations: tf.Tensor, actions: tf.Tensor,
+                    rewards: tf.Tensor, dones: tf.Tensor,
+                    next_observations: tf.Tensor) -> tf.Tensor:
+        """Perform a single gradient step on a batch of experiences, compiled into one graph
+
+        :param observations: The observations, shape (batch, input_size)
+        :type observations: tf.Tensor
+        :param actions: The indices of the performed actions, shape (batch,)
+        :type actions: tf.Tensor
+        :param rewards: The rewards, shape (batch,)
+        :type rewards: tf.Tensor
+        :param dones: 1 when the episode ended after the action, 0 otherwise
+        :type dones: tf.Tensor
+        :param next_observations: The observations after the actions
+        :type next_observations: tf.Tensor
+        :return: The mean squared error of the Q-values of the performed actions
+        :rtype: tf.Tensor
+        """
+        # Compute the Bellman Equation, there is no future reward once done
+        next_actions = tf.argmax(self.mlp(next_observations, training=False), axis=1)
+        q_future = tf.gather(self.mlp_target(next_observations, training=False),
+                             next_actions,
+                             batch_dims=1)
+        targets = rewards + tf.where(dones > 0., 0., q_future * self.gamma)
+
+        with tf.GradientTape() as tape:
+            q_values = tf.gather(self.mlp(observations, training=True), actions, batch_dims=1)
+            loss = tf.reduce_mean(tf.square(tf.stop_gradient(targets) - q_values))
+        gradients = tape.gradient(loss, self.mlp.trainable_variables)
+        self.optimizer.apply_gradients(zip(gradients, self.mlp.trainable_variables))
+        return loss
+
     @staticmethod
     def _build_model(input_size: int, output_size: int):
         """This static method generates
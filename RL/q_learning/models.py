@@ -1,7 +1,9 @@
 """
 Contains the data models used in the Deep Q Learning implementation.
 """
+import functools
 from typing import NamedTuple, List, Tuple
+
 import gin
 import numpy as np
 
@@ -33,23 +35,42 @@ class ModelsConfig:
         self.cloth_end = cloth_end
 
 
+@functools.lru_cache(maxsize=None)
+def models_config() -> ModelsConfig:
+    """Get the structure of the training observations, the gin configuration
+    is only resolved once instead of for every observation.
+
+    :return: The configured structure of the observations
+    :rtype: ModelsConfig
+    """
+    # pylint doesn't pick up that this model is configured using gin, and thus doesn't need arguments.
+    # pylint: disable=no-value-for-parameter
+    return ModelsConfig()
+
+
 class Observation:
     """
     Wrapper class used for converting
     the observation space yielded by
     a .step() to a more structured format.
+    The state of Baxter and the cloth are views on the
+    observation space, only created when they are used.
     """
 
+    __slots__ = ('observation_space', '_baxter', '_cloth')
+
     class Baxter:
         """
         Wrapper class for the state of Baxter's joints
         """
 
+        __slots__ = ('points',)
+
         def __init__(self, points: np.ndarray):
             """Create a wrapper around the joint state as observed in Unity
 
-            :param points: [description]
-            :type points: [type]
+            :param points: The joint states, a view on the observation space
+            :type points: np.ndarray
             """
             self.points = points
 
@@ -67,6 +88,8 @@ class Observation:
         Wrapper class for the state of the Cloth
         """
 
+        __slots__ = ('amount_of_points_x', 'amount_of_points_z', 'points')
+
         def __init__(self, amount_of_points_x: int, amount_of_points_z: int,
                      points: np.ndarray):
             self.amount_of_points_x = amount_of_points_x
@@ -86,14 +109,19 @@ class Observation:
             index = self.amount_of_points_x * row * 3 + col * 3
             return self.points[index:index + 3]
 
-        def __str__(self):
-            i = 2
-            vectors = []
-            while i <= self.points.size - 1:
-                vectors.append(str(self.points[i - 2:i + 1]))
-                i += 3
+        @property
+        def grid(self) -> np.ndarray:
+            """Get the points as a view of shape (x, z, 3), in the order Unity observes them
 
-            return "[" + "\n".join(vectors) + "]"
+            :return: The position of every point of the cloth
+            :rtype: np.ndarray
+            """
+            return self.points[:self.amount_of_points_x * self.amount_of_points_z * 3].reshape(
+                self.amount_of_points_x, self.amount_of_points_z, 3)
+
+        def __str__(self):
+            vectors = self.points[:self.points.size // 3 * 3].reshape(-1, 3)
+            return "[" + "\n".join(map(str, vectors)) + "]"
 
         def __repr__(self):
             return "Cloth(" + str(self) + ")"
@@ -106,23 +134,35 @@ class Observation:
         :param observation_space: State from GymEnvironment
         :type observation_space: np.ndarray
         """
-        # pylint doesn't pick up that this model is configured using gin, and thus doesn't need arguments.
-        # pylint: disable=no-value-for-parameter
-        models_config = ModelsConfig()
-
         self.observation_space = observation_space
-        self.baxter = Observation.Baxter(
-            observation_space[models_config.
-                              baxter_start:models_config.baxter_end + 1])
-        # Note: The number of X and Z points of the cloth were specified in the observations
-        #       in our custom Q Network. Due to the fact our models are also trained
-        #       with these two additional inputs, we were unable to remove this within
-        #       the time constraints
-        self.cloth = Observation.Cloth(
-            int(observation_space[models_config.cloth_start]),
-            int(observation_space[models_config.cloth_start + 1]),
-            observation_space[models_config.cloth_start +
-                              2:models_config.cloth_end + 1])
+        self._baxter = None
+        self._cloth = None
+
+    @property
+    def baxter(self) -> 'Observation.Baxter':
+        """The state of Baxter, a view on the observation space
+        """
+        if self._baxter is None:
+            config = models_config()
+            self._baxter = Observation.Baxter(
+                self.observation_space[config.baxter_start:config.baxter_end + 1])
+        return self._baxter
+
+    @property
+    def cloth(self) -> 'Observation.Cloth':
+        """The state of the cloth, a view on the observation space
+        """
+        if self._cloth is None:
+            config = models_config()
+            # Note: The number of X and Z points of the cloth were specified in the observations
+            #       in our custom Q Network. Due to the fact our models are also trained
+            #       with these two additional inputs, we were unable to remove this within
+            #       the time constraints
+            self._cloth = Observation.Cloth(
+                int(self.observation_space[config.cloth_start]),
+                int(self.observation_space[config.cloth_start + 1]),
+                self.observation_space[config.cloth_start + 2:config.cloth_end + 1])
+        return self._cloth
 
     def get_baxter(self):
         """Get the state of Baxter.
@@ -156,6 +196,8 @@ class Action:
     as given to our gym environment
     """
 
+    __slots__ = ('decision_output',)
+
     def __init__(self, decision_output: np.ndarray):
         """This method takes the output of our DQN and allows easy conversion
         to the action format expected by our Unity gym environment.
@@ -185,6 +227,3 @@ class Experience(NamedTuple):
 
 # A Trajectory is an ordered sequence of Experiences
 Trajectory = List[Experience]
-
-# A Buffer is an unordered list of Experiences from multiple Trajectories
-Buffer = List[Experience]
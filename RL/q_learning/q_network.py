@@ -5,7 +5,8 @@ implementation (i.e. DDQN).
 """
 
 import numpy as np
-from q_learning.models import Buffer, Observation
+from q_learning.models import Observation
+from q_learning.replay_buffer import Buffer
 
 
 class QNetwork:
@@ -0,0 +1,181 @@
+"""
+Contains the replay memory used in the Deep Q Learning implementation, the
+experiences are stored in preallocated arrays instead of Python objects.
+"""
+from typing import Iterator, List, NamedTuple, Tuple
+
+import gin
+import numpy as np
+
+from q_learning.models import models_config
+
+
+class Transition(NamedTuple):
+    """
+    A single experience, in the order of the arguments of ``ReplayBuffer.add``.
+    """
+
+    obs: np.ndarray
+    action: int
+    reward: float
+    done: bool
+    next_obs: np.ndarray
+
+
+class ReplayBatch(NamedTuple):
+    """
+    A batch of experiences, with one row per experience.
+    """
+
+    observations: np.ndarray
+    actions: np.ndarray
+    rewards: np.ndarray
+    dones: np.ndarray
+    next_observations: np.ndarray
+
+
+@gin.configurable
+class ReplayBuffer:
+    """
+    Ring buffer of experiences. Once the buffer is full, every new experience replaces
+    the oldest one.
+
+    The next observation of an experience is stored in the slot of the observation of the
+    next experience, which is the same observation as long as the experiences are added in
+    the order they happened. The only exception is the last experience of an episode, whose
+    next observation is replaced by the first observation of the next episode, but it isn't
+    needed as there is no future reward after an episode is done.
+    """
+
+    def __init__(self,
+                 capacity: int,
+                 observation_size: int,
+                 compress_cloth: bool = False):
+        """Allocate the buffer
+
+        :param capacity: The maximum amount of experiences
+        :type capacity: int
+        :param observation_size: The size of a single observation
+        :type observation_size: int
+        :param compress_cloth: Store the observations of the cloth, as configured in
+                               ``ModelsConfig``, as float16 to halve their memory
+        :type compress_cloth: bool
+        """
+        self.capacity = capacity
+        self.observation_size = observation_size
+
+        # The parts of an observation with the type they are stored in
+        self._segments: List[Tuple[slice, np.dtype]] = [(slice(0, observation_size),
+                                                         np.float32)]
+        if compress_cloth:
+            config = models_config()
+            cloth_start, cloth_end = config.cloth_start, config.cloth_end + 1
+            self._segments = [(segment, dtype) for (segment, dtype) in [
+                (slice(0, cloth_start), np.float32),
+                (slice(cloth_start, cloth_end), np.float16),
+                (slice(cloth_end, observation_size), np.float32),
+            ] if segment.stop > segment.start]
+        self._observations = [
+            np.zeros((capacity, segment.stop - segment.start), dtype=dtype)
+            for (segment, dtype) in self._segments
+        ]
+        self._actions = np.zeros(capacity, dtype=np.int64)
+        self._rewards = np.zeros(capacity, dtype=np.float32)
+        self._dones = np.zeros(capacity, dtype=np.float32)
+
+        self._position = 0
+        self._full = False
+
+    def __len__(self) -> int:
+        """The amount of experiences that can be sampled, as the slot that will be written
+        next holds the next observation of the latest experience instead of its own
+        observation, it can't be sampled once the buffer wrapped around.
+        """
+        return self.capacity - 1 if self._full else self._position
+
+    @property
+    def full(self) -> bool:
+        """Whether every slot of the buffer has been written
+        """
+        return self._full
+
+    def _store_observation(self, index: int, observation: np.ndarray) -> None:
+        for (segment, _), storage in zip(self._segments, self._observations):
+            storage[index] = observation[segment]
+
+    def _load_observations(self, indices: np.ndarray) -> np.ndarray:
+        observations = np.empty((len(indices), self.observation_size), dtype=np.float32)
+        for (segment, _), storage in zip(self._segments, self._observations):
+            observations[:, segment] = storage[indices]
+        return observations
+
+    def add(self, obs: np.ndarray, action: int, reward: float, done: bool,
+            next_obs: np.ndarray) -> None:
+        """Store a single experience, in O(1)
+
+        :param obs: The observation before the action
+        :type obs: np.ndarray
+        :param action: The index of the performed action
+        :type action: int
+        :param reward: The reward for the action
+        :type reward: float
+        :param done: Whether the episode ended after the action
+        :type done: bool
+        :param next_obs: The observation after the action
+        :type next_obs: np.ndarray
+        """
+        self._store_observation(self._position, obs)
+        self._store_observation((self._position + 1) % self.capacity, next_obs)
+        self._actions[self._position] = action
+        self._rewards[self._position] = reward
+        self._dones[self._position] = done
+
+        self._position = (self._position + 1) % self.capacity
+        self._full = self._full or self._position == 0
+
+    def _valid_indices(self) -> np.ndarray:
+        """Get the slots of the experiences that can be sampled, from old to new
+
+        :return: The indices of the experiences
+        :rtype: np.ndarray
+        """
+        if not self._full:
+            return np.arange(self._position)
+        return (np.arange(1, self.capacity) + self._position) % self.capacity
+
+    def _gather(self, indices: np.ndarray) -> ReplayBatch:
+        return ReplayBatch(observations=self._load_observations(indices),
+                           actions=self._actions[indices],
+                           rewards=self._rewards[indices],
+                           dones=self._dones[indices],
+                           next_observations=self._load_observations(
+                               (indices + 1) % self.capacity))
+
+    def sample(self, batch_size: int) -> ReplayBatch:
+        """Sample a random batch of experiences, with replacement
+
+        :param batch_size: The amount of experiences
+        :type batch_size: int
+        :return: The sampled experiences
+        :rtype: ReplayBatch
+        """
+        valid = self._valid_indices()
+        return self._gather(valid[np.random.randint(len(valid), size=batch_size)])
+
+    def batches(self, batch_size: int) -> Iterator[ReplayBatch]:
+        """Go over all experiences once in a random order, like shuffling a list of experiences
+        and splitting it into batches. The experiences which don't fill a whole batch are
+        skipped.
+
+        :param batch_size: The amount of experiences per batch
+        :type batch_size: int
+        :return: The batches of experiences
+        :rtype: Iterator[ReplayBatch]
+        """
+        indices = np.random.permutation(self._valid_indices())
+        for start in range(0, len(indices) - batch_size + 1, batch_size):
+            yield self._gather(indices[start:start + batch_size])
+
+
+# A Buffer is the replay memory of Experiences from multiple Trajectories
+Buffer = ReplayBuffer
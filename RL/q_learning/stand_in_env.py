@@ -0,0 +1,62 @@
+"""
+This module provides a local stand-in for the Unity environment of the custom
+MLP QNetwork, used to test the training code without running Unity.
+"""
+from typing import List
+
+import gym
+import numpy as np
+from gym import spaces
+
+
+class StandInEnv(gym.Env):
+    """
+    A random walk with the observation layout and action format of the
+    ``UnityToMLPGymWrapper``: the agent moves one of seven joints forwards or
+    backwards and is rewarded for keeping the joints close to zero. The remaining
+    observations stay fixed, like a cloth lying still.
+    """
+
+    def __init__(self,
+                 observation_size: int = 2036,
+                 episode_length: int = 200,
+                 step_size: float = 0.05):
+        """
+        :param observation_size: The size of an observation
+        :type observation_size: int
+        :param episode_length: The amount of steps after which the episode is done
+        :type episode_length: int
+        :param step_size: The change of a joint for a single action
+        :type step_size: float
+        """
+        self.observation_space = spaces.Box(low=-np.inf,
+                                            high=np.inf,
+                                            shape=(observation_size,),
+                                            dtype=np.float32)
+        self.action_space = spaces.Box(low=0., high=1., shape=(14,), dtype=np.float32)
+        self.episode_length = episode_length
+        self.step_size = step_size
+
+        self._observation = np.zeros(observation_size, dtype=np.float32)
+        self._steps = 0
+
+    def reset(self) -> np.ndarray:
+        self._observation = np.random.uniform(-1., 1., self._observation.shape).astype(
+            np.float32)
+        self._steps = 0
+        return self._observation.copy()
+
+    def step(self, action: List[float]):
+        action = np.asarray(action)
+        if action.any():
+            # Same decoding as the UnityToMLPGymWrapper: 7 joints, backwards or forwards
+            position = np.argmax(action)
+            self._observation[position // 2] += self.step_size * (1 if position % 2 else -1)
+        self._steps += 1
+
+        reward = -float(np.abs(self._observation[:7]).sum())
+        done = self._steps >= self.episode_length
+        return self._observation.copy(), reward, done, {}
+
+    def render(self, mode='human'):
+        pass
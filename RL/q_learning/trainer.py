@@ -5,14 +5,18 @@ with a chosen QNetwork implementation.
 """
 
 import random
-from typing import Tuple, Optional
+from typing import TYPE_CHECKING, Iterator, Tuple, Optional
 
 import gin
-from gym_unity.envs import UnityToGymWrapper
-from q_learning.models import Buffer, Trajectory, Experience, Observation, Action
+from q_learning.models import Observation, Action
+from q_learning.replay_buffer import Buffer, ReplayBuffer, Transition
 import numpy as np
 import q_learning.q_network as q_network
 
+if TYPE_CHECKING:
+    # The actor processes collect experiences without the Unity dependencies
+    from gym_unity.envs import UnityToGymWrapper
+
 
 class Trainer:
     """
@@ -21,59 +25,40 @@ class Trainer:
     """
 
     @staticmethod
-    @gin.configurable
-    def generate_trajectories(env: UnityToGymWrapper, q_net: q_network.QNetwork,
-                              buffer_size: int,
-                              epsilon: float) -> Tuple[Buffer, float]:
-        """Given a Unity Gym Environment and a Q-Network, this method will generate a
-        buffer of Experiences obtained by running the Environment with the Policy
-        derived from the Q-Network.
+    def collect_experiences(env: 'UnityToGymWrapper', q_net: q_network.QNetwork,
+                            epsilon: float) -> Iterator[Tuple[float, Optional[Transition]]]:
+        """Run the Environment with the Policy derived from the Q-Network for as long
+        as experiences are requested, the environment is reset after every episode.
 
         :param env: The Unity Gym Environment to perform our training against
         :type env: UnityToGymWrapper
         :param q_net: The QNetwork determining the agent's policy
         :type q_net: QNetwork
-        :param buffer_size: The size of the experience Buffer (replay memory) we want to attain
-        :type buffer_size: int
-        :param epsilon: A parameter used to perturb the actions using a numpy randn()
+        :param epsilon: The probability of performing a random action instead
         :type epsilon: float
-        :return: The obtained experiences
-        :rtype: Buffer
+        :return: For every step the reward and the obtained experience, which is None
+                 for the first step of an episode
+        :rtype: Iterator[Tuple[float, Optional[Transition]]]
         """
-        # Create an empty Buffer
-        buffer: Buffer = []
-
         # Reset the environment
         env.reset()
 
-        # Trajectory for the current agent
-        trajectory: Trajectory = []
-
-        last_observation: Optional[Observation] = None
-        cumulative_rewards = 0.0
+        last_observation: Optional[np.ndarray] = None
 
         # The last action of the agent (using a one hot encoding of the possible actions)
         last_action: Action = Action(np.zeros(14))
-        while len(buffer) < buffer_size:  # While not enough data in the buffer
-            observation, reward, done, _ = env.step(
-                last_action.decision_output.tolist())
+        while True:
+            observation, reward, done, _ = env.step(last_action.decision_output)
             reward += 70
 
-            cumulative_rewards += reward
             if done:
                 # Create its last experience (is last because the Agent terminated)
-                last_experience = Experience(
-                    obs=Observation(last_observation) if last_observation
-                    is not None else Observation(observation.copy()),
-                    reward=reward,
-                    done=done,
-                    action=last_action,
-                    next_obs=Observation(observation.copy()),
-                )
-                # Add the Trajectory and the last experience to the buffer
-                buffer.extend(trajectory)
-                buffer.append(last_experience)
-                trajectory = []
+                yield reward, Transition(obs=last_observation
+                                         if last_observation is not None else observation,
+                                         action=np.argmax(last_action.decision_output),
+                                         reward=reward,
+                                         done=True,
+                                         next_obs=observation)
 
                 # Clear its last observation and action (Since the trajectory is over)
                 last_observation = None
@@ -81,22 +66,18 @@ class Trainer:
                 last_action = Action(np.zeros(14))
                 env.reset()
                 continue
-            else:
-                # If the Agent requesting a decision has a "last observation"
-                if last_observation is not None and last_action.decision_output.any(
-                ):
-                    # Create an Experience from the last observation and the Decision Step
-                    exp = Experience(
-                        obs=Observation(last_observation),
-                        reward=reward,
-                        done=False,
-                        action=last_action,
-                        next_obs=Observation(observation.copy()),
-                    )
-                    # Update the Trajectory of the Agent
-                    trajectory.append(exp)
-                # Store the observation as the new "last observation"
-                last_observation = observation.copy()
+
+            experience = None
+            # If the Agent requesting a decision has a "last observation"
+            if last_observation is not None and last_action.decision_output.any():
+                # Create an Experience from the last observation and the Decision Step
+                experience = Transition(obs=last_observation,
+                                        action=np.argmax(last_action.decision_output),
+                                        reward=reward,
+                                        done=False,
+                                        next_obs=observation)
+            # Store the observation as the new "last observation"
+            last_observation = observation
 
             # Generate an action for all the Agents that requested a decision
             # Compute the values for each action given the observation
@@ -110,6 +91,40 @@ class Trainer:
             # Store the action that was picked, it will be put in the trajectory later
             last_action = Action(actions_values)
 
+            yield reward, experience
+
+    @staticmethod
+    @gin.configurable
+    def generate_trajectories(env: 'UnityToGymWrapper', q_net: q_network.QNetwork,
+                              buffer_size: int,
+                              epsilon: float) -> Tuple[Buffer, float]:
+        """Given a Unity Gym Environment and a Q-Network, this method will generate a
+        buffer of Experiences obtained by running the Environment with the Policy
+        derived from the Q-Network.
+
+        :param env: The Unity Gym Environment to perform our training against
+        :type env: UnityToGymWrapper
+        :param q_net: The QNetwork determining the agent's policy
+        :type q_net: QNetwork
+        :param buffer_size: The size of the experience Buffer (replay memory) we want to attain
+        :type buffer_size: int
+        :param epsilon: A parameter used to perturb the actions using a numpy randn()
+        :type epsilon: float
+        :return: The obtained experiences
+        :rtype: Buffer
+        """
+        # Create an empty Buffer, with a spare slot for the next observation of the latest
+        # experience, which keeps one written slot from being sampled
+        buffer: Buffer = ReplayBuffer(buffer_size + 1, env.observation_space.shape[0])
+        cumulative_rewards = 0.0
+
+        for reward, experience in Trainer.collect_experiences(env, q_net, epsilon):
+            cumulative_rewards += reward
+            if experience is not None:
+                buffer.add(*experience)
+            if len(buffer) >= buffer_size:  # Until enough data in the buffer
+                break
+
         return buffer, cumulative_rewards
 
     @staticmethod
@@ -0,0 +1,168 @@
+"""
+Simplified kinematics of the two arms of Baxter, only the four joints that are controlled
+by the models are modelled: the upper shoulder (S0), lower shoulder (S1), lower elbow (E1)
+and lower forearm (W1). Positions are expressed in the frame of Baxter, which looks
+along the negative z axis with the table surface at y = 0.
+"""
+from typing import Optional, Tuple
+
+import gin
+import numpy as np
+
+# Joint limits in radians, in the order the joints appear in the observations
+JOINT_LIMITS = np.array([
+    [-1.7016, 1.7016],
+    [-2.147, 1.047],
+    [-0.05, 2.618],
+    [-1.5707, 2.094],
+])
+
+# Only the upper shoulder of the partner arm moves in the opposite direction
+MIRRORED_JOINTS = np.array([True, False, False, False])
+
+
+@gin.configurable
+class BaxterArms:
+    """
+    Forward kinematics for a batch of Baxters. The joints are moved the way ``JointUtils`` of
+    the Unity simulation moves them: every action is a step of a normalized joint rotation,
+    which is also applied to the joint of the other arm. The joints reach their target
+    immediately, there is no drive pulling them towards it.
+    """
+
+    def __init__(self,
+                 num_robots: int = 1,
+                 step_size: float = 0.004,
+                 shoulder_offset: float = 0.5,
+                 shoulder_height: float = 1.,
+                 upper_arm_length: float = 1.8,
+                 forearm_length: float = 1.8,
+                 hand_length: float = 0.9):
+        """Create the arms, with all joints at their rest position
+
+        :param num_robots: Amount of Baxters
+        :type num_robots: int
+        :param step_size: Change of the normalized joint rotation for a single action during
+                          a fixed timestep, the joint drives of Unity lag behind their target
+                          so this is smaller than the step size of the agent
+        :type step_size: float
+        :param shoulder_offset: Distance of the shoulders from the centre of Baxter
+        :type shoulder_offset: float
+        :param shoulder_height: Height of the shoulders above the table
+        :type shoulder_height: float
+        :param upper_arm_length: Length from shoulder to elbow
+        :type upper_arm_length: float
+        :param forearm_length: Length from elbow to wrist
+        :type forearm_length: float
+        :param hand_length: Length from wrist to the grabber
+        :type hand_length: float
+        """
+        self.num_robots = num_robots
+        self.step_size = step_size
+        self.shoulder_offset = shoulder_offset
+        self.shoulder_height = shoulder_height
+        self.lengths = (upper_arm_length, forearm_length, hand_length)
+
+        self._lower_limits = np.tile(JOINT_LIMITS[:, 0], 2)
+        self._ranges = np.tile(JOINT_LIMITS[:, 1] - JOINT_LIMITS[:, 0], 2)
+        self._shoulders = np.array([shoulder_offset, -shoulder_offset])
+        self._rest = np.tile(self.rest_position(), 2)
+        self._robots = np.arange(num_robots)
+
+        # Normalized rotations of the right joints, followed by the mirrored left joints
+        self.joints = np.empty((num_robots, 2 * len(JOINT_LIMITS)))
+        self._hands = None
+        self.reset()
+
+    @staticmethod
+    def rest_position() -> np.ndarray:
+        """Get the normalized rotation of the joints when their angle is 0
+
+        :return: The normalized rest rotation of every joint of a single arm
+        :rtype: np.ndarray
+        """
+        return -JOINT_LIMITS[:, 0] / (JOINT_LIMITS[:, 1] - JOINT_LIMITS[:, 0])
+
+    def reset(self, robots: Optional[np.ndarray] = None) -> None:
+        """Move the joints back to their rest position
+
+        :param robots: Indices or mask of the robots to reset, defaults to all of them
+        :type robots: Optional[np.ndarray]
+        """
+        if robots is None:
+            robots = slice(None)
+        self.joints[robots] = self._rest
+        self._hands = None
+
+    def set_joints(self, joints: np.ndarray, robots: Optional[np.ndarray] = None) -> None:
+        """Move the joints to the given normalized rotations at once
+
+        :param joints: Normalized rotations of the right joints, followed by the left joints
+        :type joints: np.ndarray
+        :param robots: Indices or mask of the robots to move, defaults to all of them
+        :type robots: Optional[np.ndarray]
+        """
+        if robots is None:
+            robots = slice(None)
+        self.joints[robots] = joints
+        self._hands = None
+
+    def apply_actions(self,
+                      actions: np.ndarray,
+                      enabled: Optional[np.ndarray] = None) -> None:
+        """Move one joint of every robot, and its partner in the other arm
+
+        :param actions: One discrete action per robot, joint = action // 2, the direction
+                        is positive for even actions and negative for odd actions
+        :type actions: np.ndarray
+        :param enabled: Mask of the robots which should perform their action
+        :type enabled: Optional[np.ndarray]
+        """
+        actions = np.asarray(actions)
+        joint = actions // 2
+        change = np.where(actions % 2 == 0, self.step_size, -self.step_size)
+        if enabled is not None:
+            change = np.where(enabled, change, 0.)
+        robots = self._robots
+        partner_change = np.where(MIRRORED_JOINTS[joint], -change, change)
+
+        self.joints[robots, joint] = np.clip(self.joints[robots, joint] + change, 0., 1.)
+        partner = joint + len(JOINT_LIMITS)
+        self.joints[robots, partner] = np.clip(
+            self.joints[robots, partner] + partner_change, 0., 1.)
+        self._hands = None
+
+    def angles(self) -> np.ndarray:
+        """Get the joint angles in radians
+
+        :return: The angles of the right joints, followed by the left joints
+        :rtype: np.ndarray
+        """
+        return self._lower_limits + self.joints * self._ranges
+
+    def hand_positions(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Get the position of the grabbers and the height of the right wrist, the positions
+        are only calculated again after the joints have moved
+
+        :return: The left grabbers, the right grabbers and the height of the right wrists
+        :rtype: Tuple[np.ndarray, np.ndarray, np.ndarray]
+        """
+        if self._hands is None:
+            # Shape (robots, arm, joint), the right arm comes first
+            angles = self.angles().reshape(self.num_robots, 2, len(JOINT_LIMITS))
+            yaw = angles[..., 0]
+            # The lower shoulder, elbow and forearm all bend in the same vertical plane,
+            # a positive angle bends the arm downwards.
+            pitches = np.cumsum(angles[..., 1:], axis=-1)
+            reach = np.cumsum(np.cos(pitches) * self.lengths, axis=-1)
+            drop = np.cumsum(np.sin(pitches) * self.lengths, axis=-1)
+
+            # As the partner's upper shoulder is mirrored, the yaw of the left arm is
+            # mirrored around the centre of Baxter as well.
+            hands = np.empty((self.num_robots, 2, 3))
+            hands[..., 0] = self._shoulders - np.sin(yaw) * reach[..., 2]
+            hands[..., 1] = self.shoulder_height - drop[..., 2]
+            hands[..., 2] = -np.cos(yaw) * reach[..., 2]
+            wrist_height = self.shoulder_height - drop[:, 0, 1]
+            self._hands = (hands[:, 1], hands[:, 0], wrist_height)
+        return self._hands
@@ -0,0 +1,344 @@
+"""
+NumPy port of the mass-spring cloth of the Unity simulation, i.e. the ``RectangularCloth``
+spring grid together with the ``SpringDamper`` forces and the integrators of ``SoftBody/Cpu``.
+All nodes and springs are updated at once and several cloths can be simulated side by side.
+"""
+from typing import Optional, Tuple
+import xml.etree.ElementTree as ET
+
+import gin
+import numpy as np
+
+# Gravity used by Unity for the cloth, before the multiplier of the configuration is applied
+CLOTH_GRAVITY = -9.81
+
+
+@gin.configurable
+class PhysicsConfig:
+    """
+    This class mirrors the physics world configuration of the Unity simulation,
+    the default values are the ones of ``defaultConfiguration.xml``.
+    """
+
+    def __init__(self,
+                 gravity_multiplier: float = 0.25,
+                 delta_time_divisor: int = 20,
+                 integration_type: str = 'Verlet',
+                 elastic_spring_constant: float = 5400.,
+                 shear_spring_constant: float = 3000.,
+                 bend_spring_constant: float = 2400.,
+                 spring_inverse_mass: float = 0.125,
+                 spring_damping: float = 38.,
+                 restitution_constant: float = 0.025,
+                 friction_constant: float = 0.95):
+        """Configure the physics of the cloth
+
+        :param gravity_multiplier: Multiplier for the gravity acting on the cloth
+        :type gravity_multiplier: float
+        :param delta_time_divisor: How many timesteps to divide the delta time in
+        :type delta_time_divisor: int
+        :param integration_type: Either 'Verlet', 'RK4' or 'ExplicitEuler'
+        :type integration_type: str
+        :param elastic_spring_constant: Stiffness of the springs between direct neighbours
+        :type elastic_spring_constant: float
+        :param shear_spring_constant: Stiffness of the diagonal springs
+        :type shear_spring_constant: float
+        :param bend_spring_constant: Stiffness of the springs skipping a node
+        :type bend_spring_constant: float
+        :param spring_inverse_mass: Inverse mass of a single node
+        :type spring_inverse_mass: float
+        :param spring_damping: Damping of the relative velocity along a spring
+        :type spring_damping: float
+        :param restitution_constant: How much relative velocity is kept after collision
+        :type restitution_constant: float
+        :param friction_constant: Friction on surfaces due to collision
+        :type friction_constant: float
+        """
+        if integration_type not in ('Verlet', 'RK4', 'ExplicitEuler'):
+            raise ValueError(
+                'unknown integration type {}'.format(integration_type))
+
+        self.gravity_multiplier = gravity_multiplier
+        self.delta_time_divisor = delta_time_divisor
+        self.integration_type = integration_type
+        self.elastic_spring_constant = elastic_spring_constant
+        self.shear_spring_constant = shear_spring_constant
+        self.bend_spring_constant = bend_spring_constant
+        self.spring_inverse_mass = spring_inverse_mass
+        self.spring_damping = spring_damping
+        self.restitution_constant = restitution_constant
+        self.friction_constant = friction_constant
+
+    @staticmethod
+    def from_xml(path: str) -> 'PhysicsConfig':
+        """Read the physics world from a Unity configuration file
+
+        :param path: Path to the xml configuration, e.g. defaultConfiguration.xml
+        :type path: str
+        :return: The configuration of the file
+        :rtype: PhysicsConfig
+        """
+        world = ET.parse(path).getroot().find('PhysicsWorld')
+
+        def _float(tag: str) -> float:
+            return float(world.findtext(tag))
+
+        return PhysicsConfig(
+            gravity_multiplier=_float('GravityMultiplier'),
+            delta_time_divisor=int(world.findtext('DeltaTimeDivisor')),
+            integration_type=world.findtext('IntegrationType'),
+            elastic_spring_constant=_float('ElasticSpringConstant'),
+            shear_spring_constant=_float('ShearSpringConstant'),
+            bend_spring_constant=_float('BendSpringConstant'),
+            spring_inverse_mass=_float('SpringInverseMass'),
+            spring_damping=_float('SpringDamping'),
+            restitution_constant=_float('RestitutionConstant'),
+            friction_constant=_float('FrictionConstant'))
+
+
+def _grid_slices(dx: int, dz: int) -> Tuple[tuple, tuple]:
+    """Get the slices selecting the first and second node of all the springs
+    connecting node (x, z) with node (x + dx, z + dz)
+
+    :param dx: Offset of the second node along the x axis, at least 0
+    :type dx: int
+    :param dz: Offset of the second node along the z axis
+    :type dz: int
+    :return: The slices of the first and the second nodes in a (cloths, x, z) grid
+    :rtype: Tuple[tuple, tuple]
+    """
+    first_x, second_x = slice(0, -dx if dx else None), slice(dx, None)
+    if dz >= 0:
+        first_z, second_z = slice(0, -dz if dz else None), slice(dz, None)
+    else:
+        first_z, second_z = slice(-dz, None), slice(0, dz)
+    return (slice(None), first_x, first_z), (slice(None), second_x, second_z)
+
+
+class ClothSimulator:
+    """
+    A batch of rectangular cloths, every node is connected to its neighbours by elastic, shear
+    and bend springs just like the ``RectangularCloth`` of Unity. Since all springs of a kind
+    have the same offset in the grid, their forces are computed on shifted views of the
+    position array instead of looping over the springs.
+
+    Compared to the Unity scene, collisions between the nodes themselves are not handled and the
+    table is the only collider.
+    """
+
+    def __init__(self,
+                 num_cloths: int = 1,
+                 divisions: int = 25,
+                 width: float = 3.5,
+                 height: float = 3.5,
+                 origin: Tuple[float, float, float] = (0., 0., 0.),
+                 table_height: float = 0.,
+                 config: Optional[PhysicsConfig] = None):
+        """Create the cloths at their initial state, flat on the table
+
+        :param num_cloths: Amount of cloths simulated side by side
+        :type num_cloths: int
+        :param divisions: Amount of divisions of the mesh along a single axis
+        :type divisions: int
+        :param width: Size of the cloth along the x axis
+        :type width: float
+        :param height: Size of the cloth along the z axis
+        :type height: float
+        :param origin: Position of node (0, 0), the cloth is lifted when it would sink
+                       into the table
+        :type origin: Tuple[float, float, float]
+        :param table_height: Height of the surface of the table
+        :type table_height: float
+        :param config: The physics configuration, defaults to the gin configured one
+        :type config: Optional[PhysicsConfig]
+        """
+        self.config = config if config is not None else PhysicsConfig()
+        self.num_cloths = num_cloths
+        self.points_x = divisions + 1
+        self.points_z = divisions + 1
+        self.width = width
+        self.height = height
+        self.table_height = table_height
+        self.radius = 1. / divisions / 2. * 0.95 * min(width, height)
+
+        step_x = width / divisions
+        step_z = height / divisions
+        x, z = np.meshgrid(np.arange(self.points_x) * step_x,
+                           np.arange(self.points_z) * step_z,
+                           indexing='ij')
+        self.initial_positions = np.stack([x, np.zeros_like(x), z], axis=-1)
+        self.initial_positions += np.asarray(origin, dtype=np.float64)
+        # The nodes are spheres, so they rest on the table with their radius
+        self.initial_positions[..., 1] = np.maximum(self.initial_positions[..., 1],
+                                                    table_height + self.radius)
+
+        diagonal = np.hypot(step_x, step_z)
+        constants = self.config
+        # (dx, dz, rest length, spring constant) for each kind of spring
+        self.springs = [
+            (1, 0, step_x, constants.elastic_spring_constant),
+            (0, 1, step_z, constants.elastic_spring_constant),
+            (1, 1, diagonal, constants.shear_spring_constant),
+            (1, -1, diagonal, constants.shear_spring_constant),
+            (2, 0, 2 * step_x, constants.bend_spring_constant),
+            (0, 2, 2 * step_z, constants.bend_spring_constant),
+        ]
+        self._spring_slices = [_grid_slices(dx, dz) for dx, dz, _, _ in self.springs]
+        self.gravity = np.array(
+            [0., CLOTH_GRAVITY * self.config.gravity_multiplier, 0.])
+
+        shape = (num_cloths, self.points_x, self.points_z, 3)
+        self.positions = np.empty(shape)
+        self.velocities = np.empty(shape)
+        self._old_acceleration = np.empty(shape)
+        self._forces = np.empty(shape)
+        # Grabbed nodes follow a grabber instead of the simulation
+        self.pinned = np.zeros(shape[:-1], dtype=bool)
+        self.pin_targets = np.zeros(shape)
+        self.reset()
+
+    def reset(self, cloths: Optional[np.ndarray] = None) -> None:
+        """Reset cloths to their initial state and release all of their grabbed nodes
+
+        :param cloths: Indices or mask of the cloths to reset, defaults to all of them
+        :type cloths: Optional[np.ndarray]
+        """
+        if cloths is None:
+            cloths = slice(None)
+        self.positions[cloths] = self.initial_positions
+        self.velocities[cloths] = 0.
+        self._old_acceleration[cloths] = 0.
+        self.pinned[cloths] = False
+
+    def set_positions(self, cloths: np.ndarray, positions: np.ndarray) -> None:
+        """Place the nodes of cloths at the given positions at rest, the grabbed nodes
+        are released
+
+        :param cloths: Indices or mask of the cloths to place
+        :type cloths: np.ndarray
+        :param positions: The new positions, shape (x, z, 3) or (cloths, x, z, 3)
+        :type positions: np.ndarray
+        """
+        self.positions[cloths] = positions
+        self.velocities[cloths] = 0.
+        self._old_acceleration[cloths] = 0.
+        self.pinned[cloths] = False
+
+    def rotate(self, cloths: np.ndarray) -> None:
+        """Rotate cloths 90 degrees around the centre of their initial position, like the
+        cloth is rotated in between the two folds in Unity. The velocities are reset.
+
+        :param cloths: Indices or mask of the cloths to rotate
+        :type cloths: np.ndarray
+        """
+        centre = self.initial_positions.mean(axis=(0, 1))
+        relative = self.positions[cloths] - centre
+        rotated = relative.copy()
+        rotated[..., 0] = relative[..., 2]
+        rotated[..., 2] = -relative[..., 0]
+        self.positions[cloths] = rotated + centre
+        self.velocities[cloths] = 0.
+        self._old_acceleration[cloths] = 0.
+
+    def nodes_within(self, points: np.ndarray, radius: float) -> np.ndarray:
+        """Find the nodes within a given distance of one point per cloth
+
+        :param points: One point per cloth, shape (cloths, 3)
+        :type points: np.ndarray
+        :param radius: The maximum distance
+        :type radius: float
+        :return: Mask of the nodes within range, shape (cloths, x, z)
+        :rtype: np.ndarray
+        """
+        difference = self.positions - points[:, None, None, :]
+        return np.einsum('bxzi,bxzi->bxz', difference, difference) <= radius * radius
+
+    def _spring_forces(self, positions: np.ndarray,
+                       velocities: np.ndarray) -> np.ndarray:
+        """Calculate the total force of all the springs on each node
+
+        :param positions: Positions of the nodes
+        :type positions: np.ndarray
+        :param velocities: Velocities of the nodes
+        :type velocities: np.ndarray
+        :return: The forces on the nodes
+        :rtype: np.ndarray
+        """
+        forces = self._forces
+        forces.fill(0.)
+        damping = self.config.spring_damping
+        for (_, _, rest, constant), (first, second) in zip(self.springs,
+                                                           self._spring_slices):
+            direction = positions[second] - positions[first]
+            distance = np.sqrt(np.einsum('...i,...i->...', direction, direction))
+            # Without collisions between the nodes, folded layers can end up in the same spot
+            direction /= np.maximum(distance, 1e-9)[..., None]
+            relative_velocity = velocities[second] - velocities[first]
+            projected = np.einsum('...i,...i->...', relative_velocity, direction)
+            force = direction * (constant * (distance - rest) +
+                                 damping * projected)[..., None]
+            forces[first] += force
+            forces[second] -= force
+        return forces
+
+    def _integrate(self, dt: float) -> None:
+        """Advance all nodes a single sub step with the configured integrator
+
+        :param dt: Duration of the sub step
+        :type dt: float
+        """
+        acceleration = self._spring_forces(self.positions, self.velocities)
+        acceleration *= self.config.spring_inverse_mass
+        acceleration += self.gravity
+
+        integration_type = self.config.integration_type
+        if integration_type == 'Verlet':
+            self.positions += self.velocities * dt + self._old_acceleration * (
+                dt * dt * 0.5)
+            self.velocities += (self._old_acceleration + acceleration) * (dt * 0.5)
+            self._old_acceleration[...] = acceleration
+        elif integration_type == 'RK4':
+            # The acceleration is constant over the step, as in the Unity integrator
+            self.positions += self.velocities * dt + acceleration * (dt * dt * 0.5)
+            self.velocities += acceleration * dt
+        else:
+            self.positions += self.velocities * dt
+            self.velocities += acceleration * dt
+
+    def _collide_with_table(self) -> None:
+        """Push the nodes that sink into the table back on top of it, including the
+        restitution and friction response of the Unity ``SpringNode``.
+        """
+        penetration = self.table_height + self.radius - self.positions[..., 1]
+        # Only respond when the node isn't already moving away from the table
+        colliding = (penetration >= 0.) & (self.velocities[..., 1] <= 0.)
+        if not colliding.any():
+            return
+
+        # The table is immovable, so the inverse masses cancel out in the impulses
+        self.positions[..., 1] += np.where(colliding, penetration, 0.)
+        self.velocities[..., 1] *= np.where(
+            colliding, -self.config.restitution_constant, 1.)
+        self.velocities[..., 0::2] *= np.where(
+            colliding, 1. - self.config.friction_constant, 1.)[..., None]
+
+    def step(self, dt: float) -> None:
+        """Advance all cloths by a single fixed timestep of Unity, this is divided in
+        ``delta_time_divisor`` sub steps. The collisions are resolved once at the end.
+
+        :param dt: The fixed timestep
+        :type dt: float
+        """
+        pinned = self.pinned.any()
+        if pinned:
+            # Like SnapTo with updateVelocity, grabbed nodes get the velocity to reach their target
+            self.velocities[self.pinned] = (self.pin_targets[self.pinned] -
+                                            self.positions[self.pinned]) / dt
+
+        divisor = self.config.delta_time_divisor
+        for _ in range(divisor):
+            self._integrate(dt / divisor)
+
+        if pinned:
+            self.positions[self.pinned] = self.pin_targets[self.pinned]
+        self._collide_with_table()
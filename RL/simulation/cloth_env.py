@@ -0,0 +1,403 @@
+"""
+Headless stand-in for the Unity scene, the cloth and the arms of Baxter are simulated in NumPy
+such that training and testing don't require the Unity build nor a display server.
+"""
+from typing import List, Optional, Tuple
+
+import gin
+import gym
+from gym import spaces
+import numpy as np
+
+from simulation import rewards
+from simulation.baxter import BaxterArms
+from simulation.cloth import ClothSimulator, PhysicsConfig
+from utilities.baxter_state import BaxterState
+from utilities.observation_mask import compile_mask
+
+SUCCESS_REWARD = 10000.
+FAILURE_REWARD = -10000.
+# Below this speed, an untouched cloth is considered to be lying still
+REST_VELOCITY = 1e-2
+
+
+@gin.configurable
+class ClothEnv(gym.Env):
+    """
+    Gym environment with the same observations, actions, rewards and stages as the Unity
+    scene. Like the ``VolatileSpaceUnityGymWrapper``, it hides the observations which are not
+    used by the current model and uses the evaluation models of the ``StateManager`` to
+    reach the state that is being trained.
+
+    The observations consist of the normalized rotations of the right joints (0..4), the
+    mirrored left joints (4..8), the position of the cloth nodes relative to Baxter (8..2036)
+    and the height of the right wrist (2036).
+    """
+
+    metadata = {'render.modes': []}
+
+    def __init__(self,
+                 state_dto: 'StateManager' = None,
+                 train_state: Optional[BaxterState] = None,
+                 single_stage: bool = False,
+                 decision_period: int = 10,
+                 fixed_timestep: float = 0.02,
+                 max_step: int = 3000,
+                 check_radius: float = 0.4,
+                 divisions: int = 25,
+                 cloth_size: float = 3.5,
+                 cloth_distance: float = 0.5,
+                 physics_config: Optional[PhysicsConfig] = None):
+        """Create the scene with the cloth flat on the table in front of Baxter
+
+        :param state_dto: If this parameter is passed, it will use the embedded model to
+                          pre-evaluate the model until it reaches the desired state to start
+                          training, like the VolatileSpaceUnityGymWrapper
+        :type state_dto: StateManager
+        :param train_state: The state that ends the episode, defaults to the train state of
+                            the state_dto or to the last state
+        :type train_state: Optional[BaxterState]
+        :param single_stage: Whether each episode starts in the train state instead of
+                             going through the previous states
+        :type single_stage: bool
+        :param decision_period: Amount of fixed timesteps an action is repeated for
+        :type decision_period: int
+        :param fixed_timestep: Duration of a single fixed timestep
+        :type fixed_timestep: float
+        :param max_step: Maximum amount of fixed timesteps in an episode
+        :type max_step: int
+        :param check_radius: The radius the grabber needs to be within to grab a cloth node
+        :type check_radius: float
+        :param divisions: Amount of divisions of the cloth along a single axis
+        :type divisions: int
+        :param cloth_size: Width and height of the cloth
+        :type cloth_size: float
+        :param cloth_distance: Distance between Baxter and the near edge of the cloth
+        :type cloth_distance: float
+        :param physics_config: The physics configuration, defaults to the gin configured one
+        :type physics_config: Optional[PhysicsConfig]
+        """
+        super().__init__()
+        self.state_dto = state_dto
+        if train_state is None:
+            train_state = BaxterState.FOLD_2 if state_dto is None or \
+                state_dto.train_state is None else state_dto.train_state
+        self.train_state = train_state
+        self.single_stage = single_stage
+        self.decision_period = decision_period
+        self.fixed_timestep = fixed_timestep
+        self.max_step = max_step
+        self.check_radius = check_radius
+
+        self.cloth = ClothSimulator(num_cloths=1,
+                                    divisions=divisions,
+                                    width=cloth_size,
+                                    height=cloth_size,
+                                    origin=(-cloth_size / 2., 0.,
+                                            -cloth_distance - cloth_size),
+                                    config=physics_config)
+        self.arms = BaxterArms(num_robots=1)
+
+        size = 8 + 3 * self.cloth.points_x * self.cloth.points_z + 1
+        self.observation_space = spaces.Box(low=-np.inf,
+                                            high=np.inf,
+                                            shape=(size,),
+                                            dtype=np.float32)
+        self.action_space = spaces.Discrete(8)
+        self.__observation_mask = compile_mask([(0, size)])
+
+        self.curr_state = None
+        self._steps = 0
+        self._has_rotated = False
+        self._grabbers_on = False
+        # Per hand (left, right): the grabbed nodes and their offset to the hand
+        self._grabbed = [None, None]
+        self._offsets = [None, None]
+        # A cloth which is lying still and isn't touched doesn't need to be simulated
+        self._cloth_at_rest = True
+
+    def set_observation_range(self, ranges: List[Tuple[int, int]]) -> None:
+        """ Hides the non-relevant observations from the Gym class using this environment by
+        passing a list of ranges of relevant observations
+        @param ranges: list of ranges [(start, stop), (start, stop)] in the observation space
+        """
+        self.__observation_mask = compile_mask(ranges)
+
+    def _observe(self) -> np.ndarray:
+        """Collect the full observation, in the same layout as the Unity agent
+
+        :return: The observation
+        :rtype: np.ndarray
+        """
+        _, _, wrist_height = self.arms.hand_positions()
+        return np.concatenate([
+            self.arms.joints[0],
+            self.cloth.positions[0].reshape(-1), wrist_height
+        ]).astype(np.float32)
+
+    def mask_observation(self, observation: np.ndarray, use_train_mask: bool) -> np.ndarray:
+        """ Hides the non-relevant observations of a step
+        @param observation: the full observation
+        @param use_train_mask: uses the mask of the model that is being trained
+        """
+        mask = self.__observation_mask if not use_train_mask else \
+            self.state_dto.train_observation_mask
+        return mask(observation)
+
+    @property
+    def last_observation(self) -> np.ndarray:
+        """The full observation of the current state of the scene, before it is masked
+        """
+        return self._observe()
+
+    def _set_state(self, state: BaxterState) -> None:
+        """Move to the next stage, and let the state manager know like the Unity side channel does
+
+        :param state: The new state
+        :type state: BaxterState
+        """
+        self.curr_state = state
+        if self.state_dto is not None:
+            self.state_dto.set_state(state)
+
+    def _grab(self, hand: int, position: np.ndarray, nodes: np.ndarray) -> None:
+        """Attach nodes to a grabber, the nodes keep their offset to the grabber
+
+        :param hand: 0 for the left grabber, 1 for the right grabber
+        :type hand: int
+        :param position: Position of the grabber
+        :type position: np.ndarray
+        :param nodes: Mask of the nodes to attach
+        :type nodes: np.ndarray
+        """
+        self._grabbed[hand] = nodes
+        self._offsets[hand] = self.cloth.positions[0][nodes] - position
+        self.cloth.pinned[0] |= nodes
+        self._cloth_at_rest = False
+
+    def _release(self) -> None:
+        """Turn off both grabbers and detach the cloth
+        """
+        self._grabbers_on = False
+        self._grabbed = [None, None]
+        self._offsets = [None, None]
+        self.cloth.pinned[0] = False
+
+    def _can_grab(self, position: np.ndarray) -> np.ndarray:
+        """Get the nodes within the check radius of a grabber
+
+        :param position: Position of the grabber
+        :type position: np.ndarray
+        :return: Mask of the nodes in range, shape (x, z)
+        :rtype: np.ndarray
+        """
+        return self.cloth.nodes_within(position[None], self.check_radius)[0]
+
+    def _simulate(self, steps: int = 1) -> None:
+        """Advance the cloth a number of fixed timesteps, the grabbed nodes follow the grabbers
+
+        :param steps: Amount of fixed timesteps
+        :type steps: int
+        """
+        left, right, _ = self.arms.hand_positions()
+        for hand, position in enumerate((left[0], right[0])):
+            if self._grabbers_on and self._grabbed[hand] is None:
+                nodes = self._can_grab(position)
+                if nodes.any():
+                    self._grab(hand, position, nodes)
+            if self._grabbed[hand] is not None:
+                self.cloth.pin_targets[0][self._grabbed[hand]] = position + self._offsets[hand]
+
+        if self._cloth_at_rest:
+            return
+        for _ in range(steps):
+            self.cloth.step(self.fixed_timestep)
+        if not self.cloth.pinned.any():
+            self._cloth_at_rest = np.abs(self.cloth.velocities).max() < REST_VELOCITY
+
+    def _corner_nodes(self, *coordinates: Tuple[int, int]) -> List[np.ndarray]:
+        """Get the nodes around cloth nodes, as a grabber placed on them would grab them
+
+        :return: Mask of the nodes within the check radius for each coordinate
+        :rtype: List[np.ndarray]
+        """
+        return [self._can_grab(self.cloth.positions[0, x, z]) for x, z in coordinates]
+
+    def _make_fold(self) -> None:
+        """Perform an artificial fold and rotate, like the MakeFold of the Unity cloth
+        """
+        positions = self.cloth.positions[0]
+        divisions = self.cloth.points_z - 1
+        middle = positions[0, divisions // 2, 2]
+        folded = positions[:, divisions // 2:]
+        folded[..., 1] += 2. / divisions
+        folded[..., 2] = middle - (folded[..., 2] - middle)
+        self.cloth.rotate([0])
+        self._has_rotated = True
+        self._cloth_at_rest = False
+
+    def _hold(self, *coordinates: Tuple[int, int]) -> None:
+        """Let the grabbers hold the cloth at the given nodes, as if the grabbers moved
+        there from their current position
+
+        :param coordinates: The node held by the left and by the right grabber
+        :type coordinates: Tuple[int, int]
+        """
+        left, right, _ = self.arms.hand_positions()
+        for hand, (position, nodes) in enumerate(
+                zip((left[0], right[0]), self._corner_nodes(*coordinates))):
+            self._grab(hand, position, nodes)
+        self._grabbers_on = True
+
+    def _reset_scene(self) -> None:
+        """Reset the cloth, the grabbers and the joints, like the OnEpisodeBegin of the agent
+        """
+        self._steps = 0
+        self._has_rotated = False
+        self._release()
+        self.cloth.reset()
+        self.arms.reset()
+        self._cloth_at_rest = True
+
+        last_x, last_z = self.cloth.points_x - 1, self.cloth.points_z - 1
+        state = self.train_state if self.single_stage else BaxterState.GRAB_CLOTH_1
+        if state in (BaxterState.GRAB_CLOTH_2, BaxterState.FOLD_2):
+            self._make_fold()
+        if state == BaxterState.FOLD_1:
+            self._hold((0, last_z), (last_x, last_z))
+        elif state == BaxterState.FOLD_2:
+            self._hold((0, last_z), (0, (last_z + 1) // 2))
+        self._set_state(state)
+
+    def _restore(self, state: BaxterState, observation: np.ndarray) -> None:
+        """Start the episode from a snapshot of a state instead, like the RestoreSnapshot of
+        the agent. The cloth is at rest, when the grabbers are on they grab the cloth again.
+
+        :param state: The state of the snapshot
+        :type state: BaxterState
+        :param observation: The full observation when the state was reached
+        :type observation: np.ndarray
+        """
+        cloth_end = 8 + 3 * self.cloth.points_x * self.cloth.points_z
+        self.arms.set_joints(observation[:8])
+        self.cloth.set_positions([0], observation[8:cloth_end].reshape(
+            self.cloth.points_x, self.cloth.points_z, 3))
+        self._has_rotated = state in (BaxterState.GRAB_CLOTH_2, BaxterState.FOLD_2)
+        self._grabbers_on = state in (BaxterState.FOLD_1, BaxterState.FOLD_2)
+        self._cloth_at_rest = False
+        self._set_state(state)
+
+    def _reward(self) -> Tuple[float, bool, bool]:
+        """Calculate the reward of the current state
+
+        :return: The reward, whether the state succeeded and whether it failed
+        :rtype: Tuple[float, bool, bool]
+        """
+        left, right, _ = self.arms.hand_positions()
+        reward, success, failure = rewards.evaluate_points(self.curr_state,
+                                                           self.cloth.positions,
+                                                           left,
+                                                           right,
+                                                           has_rotated=self._has_rotated,
+                                                           radius=self.check_radius,
+                                                           width=self.cloth.width)
+        return float(reward[0]), bool(success[0]), bool(failure[0])
+
+    def _next_state(self) -> None:
+        """Make the transition to the next state, like the NextState of the agent
+        """
+        if self.curr_state in (BaxterState.GRAB_CLOTH_1, BaxterState.GRAB_CLOTH_2):
+            self._grabbers_on = True
+            self._set_state(BaxterState(self.curr_state.value + 1))
+        elif self.curr_state == BaxterState.FOLD_1:
+            self._set_state(BaxterState.GRAB_CLOTH_2)
+            # Stabilization time before the cloth is released
+            self._simulate(int(round(3. / self.fixed_timestep)))
+            self._release()
+            self.arms.reset()
+            self._simulate(int(round(.1 / self.fixed_timestep)))
+            self.cloth.rotate([0])
+            self._has_rotated = True
+
+    def _step(self, action: int) -> Tuple[float, bool]:
+        """Perform the action for a single fixed timestep
+
+        :param action: The discrete action
+        :type action: int
+        :return: The reward of the step and whether the episode has ended
+        :rtype: Tuple[float, bool]
+        """
+        fold = self.curr_state in (BaxterState.FOLD_1, BaxterState.FOLD_2)
+        if not fold or action // 2 != 0:
+            self.arms.apply_actions(np.array([action]))
+        self._simulate()
+        self._steps += 1
+
+        reward, success, failure = self._reward()
+        if success:
+            if self.curr_state == self.train_state or self.single_stage:
+                return SUCCESS_REWARD, True
+            self._next_state()
+            return SUCCESS_REWARD, False
+        if failure:
+            return FAILURE_REWARD, True
+        return reward, self._steps >= self.max_step
+
+    def step(self, action, use_train_mask=True):
+        """ Perform one decision in the environment, the action is repeated for
+        ``decision_period`` fixed timesteps like the decision requester of the Unity agent.
+
+        :param action: The discrete action
+        :param use_train_mask: Uses the mask of the model that is being trained, if available
+        :return:
+            observation (object/list): agent's observation of the current environment
+            reward (float/list) : amount of reward returned after previous action
+            done (boolean/list): whether the episode has ended.
+            info (dict): contains auxiliary diagnostic information.
+        """
+        use_train_mask = use_train_mask and self.state_dto is not None and \
+            self.state_dto.train_observation_mask is not None
+
+        reward, done = 0., False
+        for _ in range(self.decision_period):
+            reward, done = self._step(int(action))
+            if done:
+                break
+
+        return self.mask_observation(self._observe(), use_train_mask), reward, done, \
+            {'state': self.curr_state}
+
+    def reset(self) -> np.ndarray:
+        """ Resets the state of the environment and returns an initial observation.
+        Returns: observation (object/list): the initial observation of the
+        space.
+        """
+        self._reset_scene()
+
+        # When evaluating, there is no state to reach
+        use_cache = self.state_dto is not None and self.state_dto.train_state is not None
+        if use_cache and self.state_dto.train_state != self.state_dto.curr_state:
+            snapshot = self.state_dto.start_states.sample(self.state_dto.train_state)
+            if snapshot is not None:
+                self._restore(self.state_dto.train_state, snapshot)
+        obs = self.__observation_mask(self._observe())
+
+        replayed = False
+        while use_cache and self.state_dto.train_state != self.state_dto.curr_state:
+            replayed = True
+            action, _state = self.state_dto.eval_policy.predict(obs)
+            obs, _, done, _ = self.step(action, False)
+            if done:
+                print(
+                    "evaluation of previous models did not reach"\
+                     "a state where it could start training {}"
+                    .format(self.state_dto.train_state))
+                self._reset_scene()
+                obs = self.__observation_mask(self._observe())
+
+        if replayed:
+            self.state_dto.start_states.add(self.state_dto.train_state, self._observe())
+        return obs
+
+    def render(self, mode='human'):
+        pass
@@ -0,0 +1,297 @@
+"""
+Vectorized port of the reward functions of ``RectangularClothRewards.cs`` and of the success
+and failure conditions of ``Baxter.cs``. Every function scores a whole batch of observations
+at once, such that it can be used by the headless environment as well as for relabelling
+recorded observations.
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+
+from simulation.baxter import BaxterArms
+from utilities.baxter_state import BaxterState
+
+# Layout of the observations of the Unity agent
+CLOTH_START = 8
+POINTS_X = 26
+POINTS_Z = 26
+CLOTH_END = CLOTH_START + 3 * POINTS_X * POINTS_Z
+# Size of the cloth in the Unity scene
+CLOTH_WIDTH = 3.5
+
+GRAB_RADIUS = 0.4
+GRAB_BONUS = 50.
+TOTAL_DISTANCE_MULTIPLIER = 500.
+CORNER_DISTANCE_MULTIPLIER = 50.
+
+
+def cloth_points(observations: np.ndarray,
+                 points_x: int = POINTS_X,
+                 points_z: int = POINTS_Z) -> np.ndarray:
+    """Get a view on the cloth nodes of a batch of observations
+
+    :param observations: Full observations, shape (batch, at least 2036)
+    :type observations: np.ndarray
+    :param points_x: Amount of nodes along the x axis
+    :type points_x: int
+    :param points_z: Amount of nodes along the z axis
+    :type points_z: int
+    :return: The positions of the nodes, shape (batch, x, z, 3)
+    :rtype: np.ndarray
+    """
+    observations = np.asarray(observations)
+    end = CLOTH_START + 3 * points_x * points_z
+    return observations[:, CLOTH_START:end].reshape(-1, points_x, points_z, 3)
+
+
+def _norm(vectors: np.ndarray) -> np.ndarray:
+    """Euclidean norm over the last axis
+    """
+    return np.sqrt(np.einsum('...i,...i->...', vectors, vectors))
+
+
+def hand_positions(observations: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Approximate the position of the grabbers from the joints in the observations, using
+    the kinematic model of the headless simulation. Unity doesn't observe the grabbers.
+
+    :param observations: Full observations, shape (batch, at least 8)
+    :type observations: np.ndarray
+    :return: The left and right grabbers, both of shape (batch, 3)
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    observations = np.asarray(observations)
+    arms = BaxterArms(num_robots=len(observations))
+    arms.set_joints(observations[:, :CLOTH_START])
+    left, right, _ = arms.hand_positions()
+    return left, right
+
+
+def nodes_within(points: np.ndarray, hands: np.ndarray,
+                 radius: float = GRAB_RADIUS) -> np.ndarray:
+    """Get the nodes a grabber can grab
+
+    :param points: The cloth nodes, shape (batch, x, z, 3)
+    :type points: np.ndarray
+    :param hands: One grabber per cloth, shape (batch, 3)
+    :type hands: np.ndarray
+    :param radius: The check radius of the grabber
+    :type radius: float
+    :return: Mask of the nodes within the radius, shape (batch, x, z)
+    :rtype: np.ndarray
+    """
+    difference = points - hands[:, None, None, :]
+    return np.einsum('bxzi,bxzi->bxz', difference, difference) <= radius * radius
+
+
+def grab_cloth_1_reward(points: np.ndarray, left_hands: np.ndarray,
+                        right_hands: np.ndarray) -> np.ndarray:
+    """The reward for the initial grabbing of the cloth, the negative distance
+    of both grabbers to the corners closest to Baxter
+
+    :param points: The cloth nodes, shape (batch, x, z, 3)
+    :type points: np.ndarray
+    :param left_hands: The left grabbers, shape (batch, 3)
+    :type left_hands: np.ndarray
+    :param right_hands: The right grabbers, shape (batch, 3)
+    :type right_hands: np.ndarray
+    :return: The rewards, shape (batch,)
+    :rtype: np.ndarray
+    """
+    return -(_norm(left_hands - points[:, 0, -1]) + _norm(right_hands - points[:, -1, -1]))
+
+
+def grab_cloth_2_reward(points: np.ndarray,
+                        left_hands: np.ndarray,
+                        right_hands: np.ndarray,
+                        radius: float = GRAB_RADIUS) -> np.ndarray:
+    """The reward for grabbing the folded cloth, the negative distance of the grabbers to
+    their targets with a bonus for every grabber that can grab the nodes around its target
+
+    :param points: The cloth nodes, shape (batch, x, z, 3)
+    :type points: np.ndarray
+    :param left_hands: The left grabbers, shape (batch, 3)
+    :type left_hands: np.ndarray
+    :param right_hands: The right grabbers, shape (batch, 3)
+    :type right_hands: np.ndarray
+    :param radius: The check radius of the grabbers
+    :type radius: float
+    :return: The rewards, shape (batch,)
+    :rtype: np.ndarray
+    """
+    half_z = points.shape[2] // 2
+    rewards = -(_norm(left_hands - points[:, 0, -1]) +
+                _norm(right_hands - points[:, 0, half_z]))
+    left_targets = points[:, :3, :3]
+    right_targets = points[:, :3, half_z - 3:half_z]
+    rewards += GRAB_BONUS * nodes_within(left_targets, left_hands, radius).any(axis=(1, 2))
+    rewards += GRAB_BONUS * nodes_within(right_targets, right_hands, radius).any(axis=(1, 2))
+    return rewards
+
+
+def _normalization(points: np.ndarray) -> float:
+    """Normalization of the total distances w.r.t. the amount of nodes and their radius
+    """
+    points_x, points_z = points.shape[1:3]
+    return points_x * (points_z // 2) * (points_z - 1)
+
+
+def corner_distances(points: np.ndarray, width: float = CLOTH_WIDTH) -> np.ndarray:
+    """How much the distances between the corners and the middle of the sides of an unfolded
+    cloth differ from their expected length, normalized w.r.t. the expected lengths
+
+    :param points: The cloth nodes, shape (batch, x, z, 3)
+    :type points: np.ndarray
+    :param width: The width of the cloth
+    :type width: float
+    :return: The corner distances, shape (batch,)
+    :rtype: np.ndarray
+    """
+    half_z = points.shape[2] // 2
+    # top left, middle left, bottom left, top right, middle right, bottom right
+    corners = points[:, [0, 0, 0, -1, -1, -1], [-1, half_z, 0, -1, half_z, 0]]
+    first, second = [0, 1, 2, 0, 1, 3, 4], [3, 4, 5, 1, 2, 4, 5]
+    expected = np.array([width] * 3 + [width / 2.] * 4)
+    distances = _norm(corners[:, first] - corners[:, second])
+    return np.abs(expected - distances).sum(axis=1) / (width / 2. * 4. + width * 3.)
+
+
+def corner_distances_fold_2(points: np.ndarray, width: float = CLOTH_WIDTH) -> np.ndarray:
+    """How much the distances between the corners, the middle of the sides and the middle of a
+    cloth that is folded once differ from half the width, normalized w.r.t. the expected lengths
+
+    :param points: The cloth nodes, shape (batch, x, z, 3)
+    :type points: np.ndarray
+    :param width: The width of the cloth
+    :type width: float
+    :return: The corner distances, shape (batch,)
+    :rtype: np.ndarray
+    """
+    half_x, half_z = points.shape[1] // 2, points.shape[2] // 2
+    # top left, top middle, top right, bottom left, bottom middle, bottom right,
+    # left middle, right middle, middle
+    corners = points[:, [0, half_x, -1, 0, half_x, -1, 0, -1, half_x],
+                     [-1, -1, -1, 0, 0, 0, half_z, half_z, half_z]]
+    first = [1, 1, 4, 4, 6, 6, 7, 7, 8, 8, 8, 8]
+    second = [0, 2, 3, 5, 0, 3, 2, 5, 1, 4, 6, 7]
+    distances = _norm(corners[:, first] - corners[:, second])
+    return np.abs(width / 2. - distances).sum(axis=1) / (width / 2. * 12.)
+
+
+def fold_1_reward(points: np.ndarray,
+                  width: float = CLOTH_WIDTH) -> Tuple[np.ndarray, np.ndarray]:
+    """The reward for the first fold, the distance between the nodes that should end up on top
+    of each other combined with the corner distances
+
+    :param points: The cloth nodes, shape (batch, x, z, 3)
+    :type points: np.ndarray
+    :param width: The width of the cloth
+    :type width: float
+    :return: The rewards and the corner distances, both of shape (batch,)
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    half_z = points.shape[2] // 2
+    distances = _norm(points[:, :, :half_z] - points[:, :, :-half_z - 1:-1])
+    total = distances.sum(axis=(1, 2)) / _normalization(points)
+    corners = corner_distances(points, width)
+    return -(total * TOTAL_DISTANCE_MULTIPLIER + corners * CORNER_DISTANCE_MULTIPLIER), corners
+
+
+def fold_2_reward(points: np.ndarray,
+                  width: float = CLOTH_WIDTH) -> Tuple[np.ndarray, np.ndarray]:
+    """The reward for the second fold, the distance between the nodes that should end up on top
+    of each other combined with the corner distances of the folded cloth
+
+    :param points: The cloth nodes, shape (batch, x, z, 3)
+    :type points: np.ndarray
+    :param width: The width of the cloth
+    :type width: float
+    :return: The rewards and the corner distances, both of shape (batch,)
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    half_x, half_z = points.shape[1] // 2, points.shape[2] // 2
+    near = points[:, :half_x, :half_z] - points[:, :-half_x - 1:-1, :half_z]
+    far = points[:, :half_x, :-half_z - 1:-1] - points[:, :-half_x - 1:-1, :-half_z - 1:-1]
+    total = (_norm(near).sum(axis=(1, 2)) + _norm(far).sum(axis=(1, 2))) / _normalization(points)
+    corners = corner_distances_fold_2(points, width)
+    return -(total * TOTAL_DISTANCE_MULTIPLIER + corners * CORNER_DISTANCE_MULTIPLIER), corners
+
+
+def evaluate(state: BaxterState,
+             observations: np.ndarray,
+             left_hands: Optional[np.ndarray] = None,
+             right_hands: Optional[np.ndarray] = None,
+             has_rotated: bool = True,
+             radius: float = GRAB_RADIUS,
+             width: float = CLOTH_WIDTH) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Score a batch of observations of a single stage, like the agent in Unity does at every
+    step. The rewards of successful and failed states are not replaced by the
+    success and failure rewards.
+
+    :param state: The stage of the observations
+    :type state: BaxterState
+    :param observations: Full observations, shape (batch, at least 2036)
+    :type observations: np.ndarray
+    :param left_hands: The left grabbers, approximated from the joints when omitted
+    :type left_hands: Optional[np.ndarray]
+    :param right_hands: The right grabbers, approximated from the joints when omitted
+    :type right_hands: Optional[np.ndarray]
+    :param has_rotated: Whether the cloth was rotated after the first fold
+    :type has_rotated: bool
+    :param radius: The check radius of the grabbers
+    :type radius: float
+    :param width: The width of the cloth
+    :type width: float
+    :return: The rewards, whether the states are successful and whether they failed
+    :rtype: Tuple[np.ndarray, np.ndarray, np.ndarray]
+    """
+    if state in (BaxterState.GRAB_CLOTH_1, BaxterState.GRAB_CLOTH_2) and \
+            (left_hands is None or right_hands is None):
+        left_hands, right_hands = hand_positions(observations)
+    return evaluate_points(state, cloth_points(observations), left_hands, right_hands,
+                           has_rotated, radius, width)
+
+
+def evaluate_points(state: BaxterState,
+                    points: np.ndarray,
+                    left_hands: Optional[np.ndarray] = None,
+                    right_hands: Optional[np.ndarray] = None,
+                    has_rotated: bool = True,
+                    radius: float = GRAB_RADIUS,
+                    width: float = CLOTH_WIDTH) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Score a batch of cloths of a single stage, see :func:`evaluate`
+
+    :param state: The stage of the cloths
+    :type state: BaxterState
+    :param points: The cloth nodes, shape (batch, x, z, 3)
+    :type points: np.ndarray
+    :param left_hands: The left grabbers, only required when grabbing
+    :type left_hands: Optional[np.ndarray]
+    :param right_hands: The right grabbers, only required when grabbing
+    :type right_hands: Optional[np.ndarray]
+    :param has_rotated: Whether the cloth was rotated after the first fold
+    :type has_rotated: bool
+    :param radius: The check radius of the grabbers
+    :type radius: float
+    :param width: The width of the cloth
+    :type width: float
+    :return: The rewards, whether the states are successful and whether they failed
+    :rtype: Tuple[np.ndarray, np.ndarray, np.ndarray]
+    """
+    if state == BaxterState.FOLD_1:
+        rewards, corners = fold_1_reward(points, width)
+        return rewards, rewards > -15., corners > 0.6
+    if state == BaxterState.FOLD_2:
+        rewards, corners = fold_2_reward(points, width)
+        return rewards, rewards > -20., corners > 0.8
+
+    left_grab = nodes_within(points, left_hands, radius).any(axis=(1, 2))
+    right_grab = nodes_within(points, right_hands, radius).any(axis=(1, 2))
+
+    if state == BaxterState.GRAB_CLOTH_1:
+        rewards = grab_cloth_1_reward(points, left_hands, right_hands)
+        return rewards, (rewards > -1.2) & left_grab & right_grab, \
+            (rewards <= -1.2) & (left_grab | right_grab)
+
+    rewards = grab_cloth_2_reward(points, left_hands, right_hands, radius)
+    return rewards, (rewards > 70.) & left_grab & right_grab & has_rotated, \
+        (rewards <= -2.5) & (left_grab | right_grab) & has_rotated
@@ -0,0 +1,415 @@
+"""
+Hyperparameter sweep of a stage: the trials of a search space are trained by ``main.py``
+processes, several at once, each pinned to its own set of CPUs and using its own range of Unity
+``worker_id``s. Bad trials are stopped early by successive halving on their evaluations, e.g.
+
+    python sweep.py --space sweep --train Fold1 --name fold1_sweep --config gorilla
+
+The arguments not known by this script are passed on to ``main.py``.
+"""
+import argparse
+import csv
+import itertools
+import math
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import gin
+import numpy as np
+
+from utilities.baxter_state import BaxterState
+
+# Offset between the worker ids of the Unity instances of the slots, as in the pipeline
+WORKER_ID_STRIDE = 100
+# Seconds a stopped trial gets to save its model and close Unity before it is killed
+STOP_TIMEOUT = 60.
+
+
+def expand_space(space: Dict[str, Any], samples: int = 0,
+                 seed: int = 0) -> List[Dict[str, Any]]:
+    """The parameters of the trials of a search space. A list holds the values to try of a
+    parameter, a tuple a distribution to sample from: ``('uniform', low, high)``,
+    ``('log_uniform', low, high)`` or ``('int', low, high)``. Without distributions every
+    combination of the values is a trial, otherwise ``samples`` trials are drawn, picking the
+    values of the lists at random.
+
+    :param space: The values or distribution per parameter
+    :type space: Dict[str, Any]
+    :param samples: The amount of trials to draw, when the space has distributions
+    :type samples: int
+    :param seed: Seed of the random trials
+    :type seed: int
+    :raises ValueError: Thrown when a distribution is unknown, or when the space has
+                        distributions but no samples
+    :return: The value per parameter of every trial
+    :rtype: List[Dict[str, Any]]
+    """
+    names = sorted(space)
+    if not any(isinstance(space[name], tuple) for name in names):
+        grid = itertools.product(*(space[name] for name in names))
+        return [dict(zip(names, values)) for values in grid]
+    if samples < 1:
+        raise ValueError('A search space with distributions needs samples')
+
+    rng = random.Random(seed)
+
+    def _draw(values: Any) -> Any:
+        if not isinstance(values, tuple):
+            return rng.choice(values)
+        distribution, low, high = values
+        if distribution == 'uniform':
+            return rng.uniform(low, high)
+        if distribution == 'log_uniform':
+            return math.exp(rng.uniform(math.log(low), math.log(high)))
+        if distribution == 'int':
+            return rng.randint(low, high)
+        raise ValueError('Unknown distribution {}'.format(distribution))
+
+    return [{name: _draw(space[name]) for name in names} for _ in range(samples)]
+
+
+def trial_bindings(parameters: Dict[str, Any], state: BaxterState, folder: str,
+                   single_stage: bool) -> List[str]:
+    """The gin bindings of a trial. A parameter without a configurable, e.g. ``gamma``, is
+    bound for the ``train_*`` function of the trained stage. The model, its evaluations and
+    its TensorBoard logs are kept in the folder of the trial.
+
+    :param parameters: The value per parameter of the trial
+    :type parameters: Dict[str, Any]
+    :param state: The trained stage
+    :type state: BaxterState
+    :param folder: The folder of the trial
+    :type folder: str
+    :param single_stage: Whether the trial trains with --single
+    :type single_stage: bool
+    :return: The bindings, e.g. ``train_fold1.gamma=0.95``
+    :rtype: List[str]
+    """
+    train_function = 'train_{}'.format(BaxterState.to_csharp(state).lower())
+    loop = 'single_stage_training' if single_stage else 'train_loop'
+    bindings = [
+        '{}.model_folder={!r}'.format(loop, folder),
+        '{}.save_name={!r}'.format(loop, 'model'),
+        '{}.tensorboard_log={!r}'.format(train_function, folder + 'tensorboard/')
+    ]
+    for name, value in sorted(parameters.items()):
+        if '.' not in name:
+            name = '{}.{}'.format(train_function, name)
+        bindings.append('{}={!r}'.format(name, value))
+    return bindings
+
+
+def cpu_slots(parallel: int) -> List[List[int]]:
+    """Divide the CPUs this process may run on in a contiguous set per slot, when there are
+    more slots than CPUs the slots share them
+
+    :param parallel: The amount of slots
+    :type parallel: int
+    :return: The CPUs of every slot
+    :rtype: List[List[int]]
+    """
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else \
+        list(range(os.cpu_count() or 1))
+    if parallel > len(cpus):
+        return [[cpus[slot % len(cpus)]] for slot in range(parallel)]
+    return [chunk.tolist() for chunk in np.array_split(np.array(cpus), parallel)]
+
+
+def read_evaluations(folder: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """The evaluations written by the evaluation callback of a trial so far
+
+    :param folder: The folder of the trial
+    :type folder: str
+    :return: The timesteps and mean rewards of the evaluations, None when there are none yet
+             or the file is being written
+    :rtype: Optional[Tuple[np.ndarray, np.ndarray]]
+    """
+    path = os.path.join(folder, 'logs', 'evaluations.npz')
+    try:
+        with np.load(path) as evaluations:
+            return evaluations['timesteps'], evaluations['results'].mean(axis=1)
+    except (OSError, ValueError, KeyError, EOFError):
+        return None
+
+
+class SuccessiveHalving:
+    """
+    Asynchronous successive halving: the rungs are at ``min_timesteps`` times a power of the
+    ``reduction_factor``. When a trial reaches a rung, its mean reward of the first evaluation
+    at or after the rung is compared to the other trials that reached it, and it is stopped
+    unless it is in the best ``1 / reduction_factor`` of them. The first trials at a rung,
+    which have nothing to compare to, continue.
+    """
+
+    def __init__(self, min_timesteps: int, reduction_factor: int):
+        """
+        :param min_timesteps: The timesteps of the first rung, 0 never stops a trial
+        :type min_timesteps: int
+        :param reduction_factor: The factor between the timesteps of the rungs, only the best
+                                 trial out of this many continues at a rung
+        :type reduction_factor: int
+        """
+        self.min_timesteps = min_timesteps
+        self.reduction_factor = reduction_factor
+        # The reward of every trial that reached a rung, per rung
+        self.rungs: Dict[int, Dict[int, float]] = {}
+
+    def _rung(self, index: int) -> int:
+        return self.min_timesteps * self.reduction_factor**index
+
+    def report(self, trial: int, timesteps: np.ndarray, rewards: np.ndarray) -> bool:
+        """Record the evaluations of a trial at the rungs it reached
+
+        :param trial: The index of the trial
+        :type trial: int
+        :param timesteps: The timesteps of its evaluations, in order
+        :type timesteps: np.ndarray
+        :param rewards: The mean rewards of its evaluations
+        :type rewards: np.ndarray
+        :return: Whether the trial should continue
+        :rtype: bool
+        """
+        if self.min_timesteps <= 0:
+            return True
+        index = 0
+        while self._rung(index) <= timesteps[-1]:
+            rung = self._rung(index)
+            recorded = self.rungs.setdefault(rung, {})
+            if trial not in recorded:
+                recorded[trial] = float(rewards[np.searchsorted(timesteps, rung)])
+                # Only judge the trial once, when it reaches the rung
+                kept = len(recorded) // self.reduction_factor
+                if kept > 0 and recorded[trial] < sorted(recorded.values(), reverse=True)[kept - 1]:
+                    return False
+            index += 1
+        return True
+
+
+class Trial:
+    """
+    A trial of the sweep, trained by its own ``main.py`` process with its output in
+    ``trial.log`` of its folder.
+    """
+
+    def __init__(self, index: int, parameters: Dict[str, Any], folder: str):
+        """
+        :param index: The index of the trial
+        :type index: int
+        :param parameters: The value per parameter of the trial
+        :type parameters: Dict[str, Any]
+        :param folder: The folder of the trial
+        :type folder: str
+        """
+        self.index = index
+        self.parameters = parameters
+        self.folder = folder
+        self.status = 'pending'
+        self.process: Optional[subprocess.Popen] = None
+        self.slot: Optional[int] = None
+        self.start = self.end = None
+        self.timesteps = 0
+        self.best_reward = self.last_reward = float('nan')
+
+    def launch(self, command: List[str], slot: int, cpus: List[int]) -> None:
+        """Start the process of the trial in its own session, pinned to the CPUs of its slot,
+        which the Unity instances it starts inherit
+
+        :param command: The command line of ``main.py``
+        :type command: List[str]
+        :param slot: The slot the trial runs in
+        :type slot: int
+        :param cpus: The CPUs of the slot
+        :type cpus: List[int]
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        pin = (lambda: os.sched_setaffinity(0, cpus)) if hasattr(os, 'sched_setaffinity') else None
+        with open(os.path.join(self.folder, 'trial.log'), 'w') as log:
+            self.process = subprocess.Popen(command,
+                                            stdout=log,
+                                            stderr=subprocess.STDOUT,
+                                            preexec_fn=pin,
+                                            start_new_session=True)
+        self.slot = slot
+        self.status = 'running'
+        self.start = time.time()
+
+    def update(self) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Read the evaluations of the trial so far
+
+        :return: The timesteps and mean rewards of the evaluations, if any
+        :rtype: Optional[Tuple[np.ndarray, np.ndarray]]
+        """
+        evaluations = read_evaluations(self.folder)
+        if evaluations is not None and len(evaluations[0]) > 0:
+            timesteps, rewards = evaluations
+            self.timesteps = int(timesteps[-1])
+            self.best_reward, self.last_reward = float(rewards.max()), float(rewards[-1])
+        return evaluations
+
+    def stop(self) -> None:
+        """Interrupt the process of the trial and its Unity instances, and kill them when they
+        don't exit in time
+        """
+        try:
+            os.killpg(self.process.pid, signal.SIGINT)
+            self.process.wait(STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            os.killpg(self.process.pid, signal.SIGKILL)
+            self.process.wait()
+        except ProcessLookupError:
+            self.process.wait()
+
+    def finish(self, status: str) -> None:
+        """Record the end of the trial
+
+        :param status: completed, stopped or failed
+        :type status: str
+        """
+        self.status = status
+        self.end = time.time()
+        self.update()
+
+
+def write_results(trials: List[Trial], path: str) -> None:
+    """Write a row per trial, the best trials first
+
+    :param trials: The trials of the sweep
+    :type trials: List[Trial]
+    :param path: The CSV file
+    :type path: str
+    """
+    names = sorted({name for trial in trials for name in trial.parameters})
+    ranked = sorted(trials,
+                    key=lambda trial: -trial.best_reward if not math.isnan(trial.best_reward) else
+                    math.inf)
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['trial', 'status', 'timesteps', 'best_reward', 'last_reward', 'seconds'] +
+                        names)
+        for trial in ranked:
+            seconds = '' if trial.start is None else \
+                round((trial.end or time.time()) - trial.start)
+            writer.writerow([
+                trial.index, trial.status, trial.timesteps, trial.best_reward, trial.last_reward,
+                seconds
+            ] + [trial.parameters.get(name, '') for name in names])
+
+
+@gin.configurable
+def run_sweep(state: BaxterState,
+              name: str,
+              arguments: List[str],
+              space: Dict[str, Any],
+              folder: str,
+              parallel: int = 1,
+              samples: int = 0,
+              seed: int = 0,
+              min_timesteps: int = 0,
+              reduction_factor: int = 3,
+              poll_interval: float = 30.) -> List[Trial]:
+    """Train the trials of a search space for a stage, ``parallel`` at once
+
+    :param state: The stage to train
+    :type state: BaxterState
+    :param name: The name of the sweep, the trials are named after it
+    :type name: str
+    :param arguments: The command line arguments of ``main.py``, e.g. the config profile
+    :type arguments: List[str]
+    :param space: The values or distribution per parameter, see ``expand_space``
+    :type space: Dict[str, Any]
+    :param folder: Folder of the sweep, with the results table and a folder per trial
+    :type folder: str
+    :param parallel: The amount of trials running at once
+    :type parallel: int
+    :param samples: The amount of trials drawn from a space with distributions
+    :type samples: int
+    :param seed: Seed of the drawn trials
+    :type seed: int
+    :param min_timesteps: The timesteps of the first rung of the successive halving, 0 trains
+                          every trial completely
+    :type min_timesteps: int
+    :param reduction_factor: The factor between the rungs, the best of this many trials
+                             continues at a rung
+    :type reduction_factor: int
+    :param poll_interval: Seconds between reading the evaluations of the trials
+    :type poll_interval: float
+    :return: The trials
+    :rtype: List[Trial]
+    """
+    folder = os.path.join(folder, name, '')
+    trials = [
+        Trial(index, parameters, '{}trial_{}/'.format(folder, index))
+        for (index, parameters) in enumerate(expand_space(space, samples, seed))
+    ]
+    print("Sweep of {} trials, {} at once".format(len(trials), parallel))
+    slots = cpu_slots(parallel)
+    free_slots = list(range(parallel))
+    pending = list(trials)
+    running: List[Trial] = []
+    scheduler = SuccessiveHalving(min_timesteps, reduction_factor)
+    results_path = folder + 'results.csv'
+    os.makedirs(folder, exist_ok=True)
+
+    try:
+        while pending or running:
+            while pending and free_slots:
+                trial, slot = pending.pop(0), free_slots.pop(0)
+                command = [sys.executable, 'main.py'] + arguments + [
+                    '--train', BaxterState.to_csharp(state), '--name',
+                    '{}_trial_{}'.format(name, trial.index), '--worker-offset',
+                    str(slot * WORKER_ID_STRIDE)
+                ]
+                for binding in trial_bindings(trial.parameters, state, trial.folder,
+                                              '--single' in arguments):
+                    command += ['--gin-binding', binding]
+                trial.launch(command, slot, slots[slot])
+                running.append(trial)
+                print("Started trial {} on CPUs {}: {}".format(trial.index, slots[slot],
+                                                               trial.parameters))
+
+            time.sleep(poll_interval)
+            for trial in list(running):
+                exit_code = trial.process.poll()
+                if exit_code is not None:
+                    trial.finish('completed' if exit_code == 0 else 'failed')
+                else:
+                    evaluations = trial.update()
+                    if evaluations is None or len(evaluations[0]) == 0 or \
+                            scheduler.report(trial.index, *evaluations):
+                        continue
+                    trial.stop()
+                    trial.finish('stopped')
+                print("Trial {} {} at {} timesteps, best reward {:.2f}".format(
+                    trial.index, trial.status, trial.timesteps, trial.best_reward))
+                running.remove(trial)
+                free_slots.append(trial.slot)
+            write_results(trials, results_path)
+    except KeyboardInterrupt:
+        for trial in running:
+            trial.stop()
+            trial.finish('stopped')
+        raise
+    finally:
+        write_results(trials, results_path)
+    print("Results written to {}".format(results_path))
+    return trials
+
+
+parser = argparse.ArgumentParser(description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--space',
+                    help='The config of the sweep in configs/, e.g. sweep',
+                    default='sweep')
+parser.add_argument('--train', help='The stage of the sweep', required=True)
+parser.add_argument('--name', help='The name of the sweep', default='SweepNoName')
+
+if __name__ == "__main__":
+    args, main_arguments = parser.parse_known_args()
+    gin.parse_config_file('configs/{}.gin'.format(args.space))
+    # pylint: disable=no-value-for-parameter
+    run_sweep(BaxterState.from_str(args.train), args.name, main_arguments)
@@ -0,0 +1,52 @@
+"""
+Smoke tests of the DQN variants training on several environments at once.
+"""
+import gym
+import numpy as np
+import pytest
+
+from stable_baselines3.common.vec_env import DummyVecEnv
+
+from baselines.prioritized_dqn import PrioritizedVecDQN
+from baselines.vec_dqn import VecDQN
+
+
+class CountingEnv(gym.Env):
+    """A tiny environment whose episodes end after a fixed amount of steps
+    """
+
+    observation_space = gym.spaces.Box(low=0., high=1., shape=(2,), dtype=np.float32)
+    action_space = gym.spaces.Discrete(2)
+
+    def __init__(self, episode_length: int = 5):
+        self.episode_length = episode_length
+        self.steps = 0
+
+    def reset(self):
+        self.steps = 0
+        return self._observation()
+
+    def step(self, action):
+        self.steps += 1
+        return self._observation(), float(action), self.steps >= self.episode_length, {}
+
+    def _observation(self) -> np.ndarray:
+        return np.array([self.steps / self.episode_length, 1.], dtype=np.float32)
+
+
+@pytest.mark.parametrize('dqn_class', [VecDQN, PrioritizedVecDQN])
+def test_learn_on_several_envs(dqn_class):
+    env = DummyVecEnv([CountingEnv, CountingEnv])
+    model = dqn_class('MlpPolicy',
+                      env,
+                      buffer_size=100,
+                      learning_starts=10,
+                      batch_size=8,
+                      train_freq=2,
+                      target_update_interval=10)
+    assert model.n_envs == 2
+
+    model.learn(total_timesteps=40)
+
+    assert model.num_timesteps >= 40
+    assert model.replay_buffer.size() >= 40
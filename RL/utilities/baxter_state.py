@@ -0,0 +1,56 @@
+"""
+Module containing the stages of the folding process, kept separate from the state manager
+such that it can be used without loading the Unity and Stable Baselines dependencies.
+"""
+from enum import Enum
+
+
+class BaxterState(Enum):
+    """
+    Enum class for the different steps of the reinforcement learning. The values are the IDs
+    of the states in the messages of the state side channel, the same as in C#.
+    """
+    GRAB_CLOTH_1 = 1
+    FOLD_1 = 2
+    GRAB_CLOTH_2 = 3
+    FOLD_2 = 4
+
+    @staticmethod
+    def from_str(label: str):
+        """Returns the correct Enum based on the given string
+
+        :param label: Name of state
+        :type label: str
+        :raises ValueError: Thrown when unknown state is given as label
+        :return: Enum of the state
+        :rtype: BaxterState
+        """
+        try:
+            return _STATES[label]
+        except KeyError:
+            raise ValueError(label) from None
+
+    @staticmethod
+    def to_csharp(label) -> str:
+        """Returns the correct string based on the given enum value
+
+        :param label: enum value
+        :type label: BaxterState
+        :raises NotImplementedError: Thrown when unknown enum value is given
+        :return: String representing the enum value
+        :rtype: str
+        """
+        try:
+            return _CSHARP_NAMES[label]
+        except KeyError:
+            raise NotImplementedError(label) from None
+
+
+# The names of the states in C#, also used on the command line and in the names of the files
+_CSHARP_NAMES = {
+    BaxterState.GRAB_CLOTH_1: "GrabCloth1",
+    BaxterState.FOLD_1: "Fold1",
+    BaxterState.GRAB_CLOTH_2: "GrabCloth2",
+    BaxterState.FOLD_2: "Fold2"
+}
+_STATES = {name: state for (state, name) in _CSHARP_NAMES.items()}
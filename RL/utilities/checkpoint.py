@@ -0,0 +1,484 @@
+"""
+Module used to save models and checkpoints of the training without blocking it. The weights, the
+optimizer state and the other attributes of a model are copied into memory on the training
+thread, and written to a zip file by a background thread, which Stable Baselines loads like any
+other saved model. A checkpoint also holds the replay buffer, of which only the transitions
+added since the previous checkpoint are written.
+"""
+import atexit
+import json
+import os
+import queue
+import shutil
+import threading
+import zipfile
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import gin
+import numpy as np
+import stable_baselines3
+import torch as th
+from stable_baselines3 import DQN
+from stable_baselines3.common.buffers import ReplayBuffer
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.save_util import data_to_json, load_from_zip_file, recursive_getattr
+
+from utilities.observation_codec import EncodedObservations
+
+# The attributes of a model restored by --resume, next to its parameters. The last
+# observations are left out, the environment is reset when the training continues.
+RESUMED_ATTRIBUTES = ('num_timesteps', '_n_calls', '_n_updates', '_episode_num',
+                      '_current_progress_remaining', 'exploration_rate')
+
+
+class ModelSnapshot(NamedTuple):
+    """
+    A copy of a model in memory, in the form Stable Baselines writes to its zip files
+    """
+    data: str
+    params: Dict[str, Dict]
+    pytorch_variables: Optional[Dict[str, Any]]
+
+
+def _copy(value: Any) -> Any:
+    """Copy the tensors of a state dict, which are the tensors of the model itself"""
+    if isinstance(value, th.Tensor):
+        return value.detach().cpu().clone()
+    if isinstance(value, dict):
+        return {key: _copy(item) for (key, item) in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_copy(item) for item in value)
+    return value
+
+
+def snapshot_model(model: DQN, policy_parameters: Optional[Dict[str, th.Tensor]] = None
+                   ) -> ModelSnapshot:
+    """Copy what ``model.save`` writes into memory, this has to be called on the training
+    thread
+
+    :param model: The model
+    :type model: DQN
+    :param policy_parameters: Save these parameters of the policy instead of its current
+                              ones, e.g. of an earlier evaluated version
+    :type policy_parameters: Optional[Dict[str, th.Tensor]]
+    :return: The snapshot
+    :rtype: ModelSnapshot
+    """
+    # pylint: disable=protected-access
+    data = model.__dict__.copy()
+    exclude = set(model._excluded_save_params())
+    state_dicts_names, torch_variable_names = model._get_torch_save_params()
+    for name in state_dicts_names + torch_variable_names:
+        exclude.add(name.split('.')[0])
+    for name in exclude:
+        data.pop(name, None)
+
+    pytorch_variables = None
+    if torch_variable_names:
+        pytorch_variables = {
+            name: _copy(recursive_getattr(model, name)) for name in torch_variable_names
+        }
+    params = _copy(model.get_parameters())
+    if policy_parameters is not None:
+        params['policy'] = _copy(policy_parameters)
+    return ModelSnapshot(data_to_json(data), params, pytorch_variables)
+
+
+def write_model(snapshot: ModelSnapshot, path: str) -> None:
+    """Write a snapshot to a zip file like ``model.save`` does, replacing the file at once
+    such that it is never read half written
+
+    :param snapshot: The snapshot of the model
+    :type snapshot: ModelSnapshot
+    :param path: The path of the file, ending in .zip
+    :type path: str
+    """
+    temporary = path[:-len('.zip')] + '.tmp.zip'
+    with zipfile.ZipFile(temporary, 'w') as archive:
+        archive.writestr('data', snapshot.data)
+        if snapshot.pytorch_variables is not None:
+            with archive.open('pytorch_variables.pth', mode='w') as file:
+                th.save(snapshot.pytorch_variables, file)
+        for name, state_dict in snapshot.params.items():
+            with archive.open(name + '.pth', mode='w') as file:
+                th.save(state_dict, file)
+        archive.writestr('_stable_baselines3_version', stable_baselines3.__version__)
+    os.replace(temporary, path)
+
+
+class BackgroundWriter:
+    """
+    Runs the writes of the snapshots one after the other in a background thread. At most
+    ``max_pending`` writes wait, after that the training waits for the writer, which bounds the
+    memory taken by the snapshots. A write that failed is raised again by the next call.
+    """
+
+    def __init__(self, max_pending: int = 2):
+        """
+        :param max_pending: The amount of writes that can wait for the thread
+        :type max_pending: int
+        """
+        self.__queue: queue.Queue = queue.Queue(max_pending)
+        self.__error: Optional[BaseException] = None
+        self.__thread: Optional[threading.Thread] = None
+        self.__lock = threading.Lock()
+
+    def __run(self) -> None:
+        while True:
+            write = self.__queue.get()
+            try:
+                if self.__error is None:
+                    write()
+            except BaseException as error:  # pylint: disable=broad-except
+                self.__error = error
+            finally:
+                self.__queue.task_done()
+
+    def __raise(self) -> None:
+        if self.__error is not None:
+            error, self.__error = self.__error, None
+            raise error
+
+    def submit(self, write: Callable[[], None]) -> None:
+        """Run a write in the background, after the writes submitted before it
+
+        :param write: The write
+        :type write: Callable[[], None]
+        """
+        self.__raise()
+        with self.__lock:
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run,
+                                                 name='checkpoint-writer',
+                                                 daemon=True)
+                self.__thread.start()
+        self.__queue.put(write)
+
+    def wait(self) -> None:
+        """Wait until all submitted writes are done
+        """
+        if self.__thread is not None:
+            self.__queue.join()
+        self.__raise()
+
+
+# The writer of this process, which finishes its writes before the process exits
+writer = BackgroundWriter()
+atexit.register(writer.wait)
+
+
+def save_model(model: DQN, path: str,
+               policy_parameters: Optional[Dict[str, th.Tensor]] = None) -> None:
+    """Save a model in the background, like ``model.save`` would
+
+    :param model: The model
+    :type model: DQN
+    :param path: The path of the file, .zip is appended when it's missing like Stable
+                 Baselines does
+    :type path: str
+    :param policy_parameters: Save these parameters of the policy instead of its current ones
+    :type policy_parameters: Optional[Dict[str, th.Tensor]]
+    """
+    if not path.endswith('.zip'):
+        path += '.zip'
+    snapshot = snapshot_model(model, policy_parameters)
+    writer.submit(lambda: write_model(snapshot, path))
+
+
+def _buffer_arrays(buffer: ReplayBuffer) -> Dict[str, np.ndarray]:
+    """The arrays of a replay buffer with a row per slot, by name"""
+    arrays = {}
+    for name in ('observations', 'next_observations', 'actions', 'rewards', 'dones',
+                 'timeouts'):
+        array = getattr(buffer, name, None)
+        if isinstance(array, EncodedObservations):
+            arrays[name + '_exact'] = array.exact
+            arrays[name + '_cloth'] = array.cloth
+        elif isinstance(array, np.ndarray):
+            arrays[name] = array
+    return arrays
+
+
+def _buffer_extras(buffer: ReplayBuffer) -> Dict[str, np.ndarray]:
+    """The state of a replay buffer that isn't stored per slot, copied"""
+    extras = {}
+    if hasattr(buffer, 'sum_tree'):
+        extras['sum_tree'] = buffer.sum_tree.tree.copy()
+        extras['min_tree'] = buffer.min_tree.tree.copy()
+        extras['max_priority'] = np.array(buffer.max_priority)
+    if isinstance(buffer.observations, EncodedObservations) and \
+            buffer.observations.codec.rest_pose is not None:
+        extras['rest_pose'] = buffer.observations.codec.rest_pose.copy()
+    return extras
+
+
+class ReplayBufferCheckpoint:
+    """
+    Writes a replay buffer in chunks: a checkpoint only writes the slots written since the
+    previous checkpoint, and the buffer is restored by writing the chunks in order, the later
+    chunks overwriting the slots the buffer has reused since. Once the chunks would hold more
+    than twice the slots of the buffer, the whole buffer is written as a single chunk instead
+    and the older chunks are removed.
+
+    A ``MemmapReplayBuffer`` already keeps itself on disk, it is only flushed.
+    """
+
+    def __init__(self, folder: str, state: Optional[Dict[str, Any]] = None):
+        """
+        :param folder: The folder of the chunks
+        :type folder: str
+        :param state: The state of the latest checkpoint, to continue writing its chunks
+        :type state: Optional[Dict[str, Any]]
+        """
+        self.folder = folder
+        state = state or {}
+        self.chunks: List[str] = state.get('chunks', [])
+        self.rows = state.get('rows', 0)
+        self.timesteps = state.get('timesteps', 0)
+        self.next_chunk = state.get('next_chunk', 0)
+
+    def snapshot(self, buffer: ReplayBuffer,
+                 timesteps: int) -> Tuple[Callable[[], None], Dict[str, Any]]:
+        """Copy the slots written since the previous checkpoint, this has to be called on the
+        training thread
+
+        :param buffer: The replay buffer, which gets a transition per timestep
+        :type buffer: ReplayBuffer
+        :param timesteps: The timesteps of the model
+        :type timesteps: int
+        :return: The write of the new chunks, and the state of the checkpoint once written
+        :rtype: Tuple[Callable[[], None], Dict[str, Any]]
+        """
+        if hasattr(buffer, 'flush'):
+            buffer.flush()
+            return (lambda: None), {'memmap': True}
+
+        size = buffer.buffer_size if buffer.full else buffer.pos
+        added = min(timesteps - self.timesteps, buffer.buffer_size)
+        if not self.chunks or not 0 <= added < buffer.buffer_size or \
+                self.rows + added > 2 * buffer.buffer_size:
+            # Start over with the whole buffer
+            ranges = [(0, size)]
+            self.chunks, self.rows = [], 0
+        else:
+            start = (buffer.pos - added) % buffer.buffer_size
+            ranges = [(start, start + added)] if start + added <= buffer.buffer_size else \
+                [(start, buffer.buffer_size), (0, buffer.pos)]
+
+        arrays = _buffer_arrays(buffer)
+        chunks = []
+        for start, stop in ranges:
+            if stop > start:
+                name = 'chunk_{}.npz'.format(self.next_chunk)
+                self.next_chunk += 1
+                rows = {key: array[start:stop].copy() for (key, array) in arrays.items()}
+                chunks.append((name, start, rows))
+                self.chunks.append(name)
+                self.rows += stop - start
+        extras = _buffer_extras(buffer)
+        self.timesteps = timesteps
+        state = {
+            'chunks': list(self.chunks),
+            'rows': self.rows,
+            'timesteps': timesteps,
+            'next_chunk': self.next_chunk,
+            'pos': int(buffer.pos),
+            'full': bool(buffer.full),
+            'extras': 'extras_{}.npz'.format(timesteps) if extras else None
+        }
+
+        def _write() -> None:
+            os.makedirs(self.folder, exist_ok=True)
+            for name, start, rows in chunks:
+                _save_arrays(os.path.join(self.folder, name), start=np.array(start), **rows)
+            if extras:
+                _save_arrays(os.path.join(self.folder, state['extras']), **extras)
+
+        return _write, state
+
+    def remove_unused(self, state: Dict[str, Any]) -> None:
+        """Remove the files that the latest checkpoint doesn't use anymore
+
+        :param state: The state of the latest checkpoint
+        :type state: Dict[str, Any]
+        """
+        used = set(state.get('chunks', [])) | {state.get('extras')}
+        if not os.path.isdir(self.folder):
+            return
+        for name in os.listdir(self.folder):
+            if name not in used:
+                os.remove(os.path.join(self.folder, name))
+
+    def restore(self, buffer: ReplayBuffer, state: Dict[str, Any]) -> None:
+        """Write the chunks of a checkpoint into an empty replay buffer of the same size
+
+        :param buffer: The replay buffer
+        :type buffer: ReplayBuffer
+        :param state: The state of the checkpoint
+        :type state: Dict[str, Any]
+        """
+        if state.get('memmap'):
+            return
+        arrays = _buffer_arrays(buffer)
+        for name in state['chunks']:
+            with np.load(os.path.join(self.folder, name)) as chunk:
+                start = int(chunk['start'])
+                for key, array in arrays.items():
+                    rows = chunk[key]
+                    array[start:start + len(rows)] = rows
+        buffer.pos, buffer.full = state['pos'], state['full']
+        if state['extras'] is not None:
+            with np.load(os.path.join(self.folder, state['extras'])) as extras:
+                if 'sum_tree' in extras:
+                    buffer.sum_tree.tree[:] = extras['sum_tree']
+                    buffer.min_tree.tree[:] = extras['min_tree']
+                    buffer.max_priority = float(extras['max_priority'])
+                if 'rest_pose' in extras:
+                    buffer.observations.codec.rest_pose = extras['rest_pose']
+
+
+def _save_arrays(path: str, **arrays: np.ndarray) -> None:
+    """Write arrays to an uncompressed .npz file, replacing the file at once"""
+    temporary = path[:-len('.npz')] + '.tmp.npz'
+    np.savez(temporary, **arrays)
+    os.replace(temporary, path)
+
+
+@gin.configurable
+class Checkpointer:
+    """
+    Writes checkpoints of a model being trained to a folder: ``checkpoint_<timesteps>.zip``
+    with the model, the chunks of its replay buffer in ``replay_buffer/`` and ``latest.json``,
+    which points to the latest complete checkpoint. Only the latest ``keep`` models are kept.
+    """
+
+    def __init__(self,
+                 folder: str,
+                 resume: bool = False,
+                 keep: int = 2,
+                 save_replay_buffer: bool = True):
+        """
+        :param folder: The folder of the checkpoints
+        :type folder: str
+        :param resume: Continue the checkpoints in the folder, otherwise they are removed
+                       once the first new checkpoint is written
+        :type resume: bool
+        :param keep: The amount of checkpoints of the model to keep, at least 1
+        :type keep: int
+        :param save_replay_buffer: Whether the checkpoints include the replay buffer
+        :type save_replay_buffer: bool
+        """
+        self.folder = folder
+        self.keep = max(keep, 1)
+        self.save_replay_buffer = save_replay_buffer
+        self.latest = self._read_latest() if resume else None
+        self.__clear = not resume
+        self.replay_buffer = ReplayBufferCheckpoint(
+            os.path.join(folder, 'replay_buffer'),
+            None if self.latest is None else self.latest['replay_buffer'])
+
+    def _latest_file(self) -> str:
+        return os.path.join(self.folder, 'latest.json')
+
+    def _read_latest(self) -> Optional[Dict[str, Any]]:
+        if not os.path.isfile(self._latest_file()):
+            return None
+        with open(self._latest_file()) as file:
+            return json.load(file)
+
+    def checkpoint(self, model: DQN) -> None:
+        """Snapshot the model and the new part of its replay buffer, and write them in the
+        background
+
+        :param model: The model being trained
+        :type model: DQN
+        """
+        snapshot = snapshot_model(model)
+        write_buffer, buffer_state = (lambda: None), None
+        if self.save_replay_buffer and model.replay_buffer is not None:
+            write_buffer, buffer_state = self.replay_buffer.snapshot(
+                model.replay_buffer, model.num_timesteps)
+        name = 'checkpoint_{}.zip'.format(model.num_timesteps)
+        latest = {'model': name, 'timesteps': model.num_timesteps, 'replay_buffer': buffer_state}
+
+        def _write() -> None:
+            if self.__clear:
+                # The checkpoints of an earlier training in the folder
+                shutil.rmtree(self.folder, ignore_errors=True)
+                self.__clear = False
+            os.makedirs(self.folder, exist_ok=True)
+            write_buffer()
+            write_model(snapshot, os.path.join(self.folder, name))
+            # The checkpoint is complete once the latest file points to it
+            temporary = self._latest_file() + '.tmp'
+            with open(temporary, 'w') as file:
+                json.dump(latest, file)
+            os.replace(temporary, self._latest_file())
+            self.latest = latest
+            self._remove_old()
+
+        writer.submit(_write)
+
+    def _remove_old(self) -> None:
+        models = sorted((int(name[len('checkpoint_'):-len('.zip')]), name)
+                        for name in os.listdir(self.folder)
+                        if name.startswith('checkpoint_') and name.endswith('.zip') and
+                        '.tmp' not in name)
+        for _, name in models[:-self.keep]:
+            if name != self.latest['model']:
+                os.remove(os.path.join(self.folder, name))
+        if self.latest['replay_buffer'] is not None:
+            self.replay_buffer.remove_unused(self.latest['replay_buffer'])
+
+    def restore(self, model: DQN) -> bool:
+        """Restore the latest checkpoint into a new model: its parameters and optimizer, its
+        timesteps and exploration, and its replay buffer
+
+        :param model: The model, created like the model of the checkpoint
+        :type model: DQN
+        :return: Whether there was a checkpoint to restore
+        :rtype: bool
+        """
+        if self.latest is None:
+            return False
+        data, params, _ = load_from_zip_file(os.path.join(self.folder, self.latest['model']),
+                                             device=model.device)
+        model.set_parameters(params, exact_match=True, device=model.device)
+        for name in RESUMED_ATTRIBUTES:
+            if name in data:
+                setattr(model, name, data[name])
+        if self.latest['replay_buffer'] is not None and model.replay_buffer is not None:
+            self.replay_buffer.restore(model.replay_buffer, self.latest['replay_buffer'])
+        return True
+
+
+class CheckpointCallback(BaseCallback):
+    """
+    Writes a checkpoint every ``save_freq`` calls and at the end of the training
+    """
+
+    def __init__(self, checkpointer: Checkpointer, save_freq: int, verbose: int = 0):
+        """
+        :param checkpointer: The checkpointer of the model
+        :type checkpointer: Checkpointer
+        :param save_freq: Amount of calls between the checkpoints
+        :type save_freq: int
+        :param verbose: Print every checkpoint when 1
+        :type verbose: int
+        """
+        super().__init__(verbose)
+        self.checkpointer = checkpointer
+        self.save_freq = save_freq
+
+    def _checkpoint(self) -> None:
+        self.checkpointer.checkpoint(self.model)
+        if self.verbose > 0:
+            print("Checkpoint at {} timesteps".format(self.num_timesteps))
+
+    def _on_step(self) -> bool:
+        if self.save_freq > 0 and self.n_calls % self.save_freq == 0:
+            self._checkpoint()
+        return True
+
+    def _on_training_end(self) -> None:
+        self._checkpoint()
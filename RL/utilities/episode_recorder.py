@@ -0,0 +1,466 @@
+"""
+Module used to record the episodes of an environment to disk, such that the rollouts of Unity
+can be reused by later trainings. A recording is a folder of chunks holding a fixed amount of
+steps each, with an index of the chunks and of the episodes per stage.
+"""
+import json
+import os
+import queue
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import gin
+import gym
+import numpy as np
+
+from utilities.baxter_state import BaxterState
+from utilities.observation_codec import ObservationCodec
+from utilities.observation_mask import compile_mask
+
+# Action of the last row of an episode, which only holds the observation the episode ended in
+NO_ACTION = -1
+INDEX_FILE = 'index.json'
+REST_POSE_FILE = 'rest_pose.npy'
+
+
+def _write_json(path: str, content: dict) -> None:
+    """Replace a JSON file at once, such that a crash never leaves half a file behind
+    """
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as file:
+        json.dump(content, file)
+    os.replace(temporary, path)
+
+
+def _codec_from_index(index: dict, folder: str) -> ObservationCodec:
+    rest_pose_file = os.path.join(folder, REST_POSE_FILE)
+    return ObservationCodec(cloth_range=tuple(index['codec']['cloth_range']),
+                            float16=index['codec']['float16'],
+                            delta_to_rest=index['codec']['delta_to_rest'],
+                            rest_pose=np.load(rest_pose_file)
+                            if os.path.isfile(rest_pose_file) else None)
+
+
+@gin.configurable
+class EpisodeRecorder(gym.Wrapper):
+    """
+    Records every step of the wrapped environment, with the full observation before the step,
+    the action, the reward, whether the episode ended and the stage of the step. Every episode
+    ends with a row of the observation it ended in, which has no action.
+
+    The rows are collected in preallocated chunks, a full chunk is compressed and written to disk
+    by a background thread, so recording doesn't slow down the steps. Recording into a folder
+    which already contains a recording appends to it.
+
+    Only the steps that pass through the wrapper are recorded: the steps the
+    ``VolatileSpaceUnityGymWrapper`` takes while replaying the earlier stages during a reset are not.
+    """
+
+    def __init__(self,
+                 env: gym.Env,
+                 folder: str,
+                 state_dto: 'StateManager' = None,
+                 chunk_size: int = 4096,
+                 codec: Optional[ObservationCodec] = None):
+        """
+        :param env: The environment to record, its ``last_observation`` is recorded when it has
+                    one, as the observations it returns only hold the range of the current model
+        :type env: gym.Env
+        :param folder: The folder of the recording, created when it doesn't exist yet
+        :type folder: str
+        :param state_dto: The state manager of the environment, which knows the current stage
+        :type state_dto: StateManager
+        :param chunk_size: Amount of rows per chunk
+        :type chunk_size: int
+        :param codec: The codec of the observations, defaults to the gin configured one and is
+                      ignored when appending to a recording
+        :type codec: Optional[ObservationCodec]
+        """
+        super().__init__(env)
+        self.folder = folder
+        self.state_dto = state_dto
+        self.chunk_size = chunk_size
+
+        os.makedirs(folder, exist_ok=True)
+        index_file = os.path.join(folder, INDEX_FILE)
+        if os.path.isfile(index_file):
+            with open(index_file) as file:
+                self.index = json.load(file)
+            self.codec = _codec_from_index(self.index, folder)
+        else:
+            self.codec = ObservationCodec() if codec is None else codec
+            self.index = {
+                'observation_size': None,
+                'codec': {
+                    'cloth_range': [self.codec.cloth_start, self.codec.cloth_stop],
+                    'float16': self.codec.cloth_dtype == np.float16,
+                    'delta_to_rest': self.codec.delta_to_rest
+                },
+                'chunks': [],
+                'episodes': {},
+                'stages': {}
+            }
+
+        self._episode = max(map(int, self.index['episodes']), default=-1) + 1
+        self._observation = None
+        self._rows = 0
+        self._chunk = None
+
+        # Chunks waiting to be written, bounded such that a stalled disk can't fill the memory
+        self._chunks = queue.Queue(maxsize=4)
+        # A write that failed in the writer, raised again on the training thread
+        self._error: Optional[BaseException] = None
+        self._writer = threading.Thread(target=self._write_chunks, daemon=True)
+        self._writer.start()
+
+    def _full_observation(self, observation: np.ndarray) -> np.ndarray:
+        return getattr(self.env, 'last_observation', observation)
+
+    def _state(self) -> int:
+        """The stage of the current step, 0 when it is unknown
+        """
+        if self.state_dto is None:
+            return 0
+        state = self.state_dto.curr_state or self.state_dto.train_state
+        return 0 if state is None else state.value
+
+    def _allocate(self, observation_size: int) -> Dict[str, np.ndarray]:
+        return {
+            'observations': np.empty((self.chunk_size, observation_size), dtype=np.float32),
+            'actions': np.empty(self.chunk_size, dtype=np.int64),
+            'rewards': np.empty(self.chunk_size, dtype=np.float32),
+            'dones': np.empty(self.chunk_size, dtype=np.bool_),
+            'states': np.empty(self.chunk_size, dtype=np.int8),
+            'episodes': np.empty(self.chunk_size, dtype=np.int64)
+        }
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _append(self, observation: np.ndarray, action: int, reward: float, done: bool) -> None:
+        """Add a row to the current chunk and hand the chunk to the writer once it is full
+        """
+        self._raise_error()
+        if self._chunk is None:
+            self._chunk = self._allocate(len(observation))
+        row = self._rows
+        self._chunk['observations'][row] = observation
+        self._chunk['actions'][row] = action
+        self._chunk['rewards'][row] = reward
+        self._chunk['dones'][row] = done
+        self._chunk['states'][row] = self._state()
+        self._chunk['episodes'][row] = self._episode
+        self._rows += 1
+        if self._rows == self.chunk_size:
+            self._chunks.put((self._chunk, self._rows))
+            self._chunk, self._rows = None, 0
+
+    def _end_episode(self, done: bool) -> None:
+        if self._observation is not None:
+            self._append(self._observation, NO_ACTION, 0., done)
+            self._observation = None
+            self._episode += 1
+
+    def step(self, action):
+        observation, reward, done, info = self.env.step(action)
+        self._append(self._observation, int(action), reward, done)
+        self._observation = self._full_observation(observation)
+        if done:
+            self._end_episode(True)
+        return observation, reward, done, info
+
+    def reset(self, **kwargs):
+        # An episode that is reset before it is done ends without being done
+        self._end_episode(False)
+        observation = self.env.reset(**kwargs)
+        self._observation = self._full_observation(observation)
+        return observation
+
+    def _write_chunks(self) -> None:
+        """Write the chunks handed over by ``_append`` until ``close`` hands over None,
+        this runs in the background thread. Once a write failed, e.g. when the disk is full,
+        the chunks are dropped, such that handing over a chunk never blocks the training.
+        """
+        failed = False
+        while True:
+            item = self._chunks.get()
+            if item is None:
+                return
+            if failed:
+                continue
+            chunk, rows = item
+            try:
+                self._write_chunk({name: column[:rows] for (name, column) in chunk.items()})
+            except BaseException as error:  # pylint: disable=broad-except
+                self._error, failed = error, True
+
+    def _write_chunk(self, chunk: Dict[str, np.ndarray]) -> None:
+        """Compress a chunk, write it and add it to the index
+        """
+        name = 'chunk_{:06d}.npz'.format(len(self.index['chunks']))
+        observations = chunk.pop('observations')
+        compressed = np.frombuffer(self.codec.compress(observations), dtype=np.uint8)
+        temporary = os.path.join(self.folder, name + '.tmp')
+        with open(temporary, 'wb') as file:
+            np.savez(file, observations=compressed, **chunk)
+        os.replace(temporary, os.path.join(self.folder, name))
+
+        chunk_id = len(self.index['chunks'])
+        self.index['observation_size'] = observations.shape[1]
+        self.index['chunks'].append({'file': name, 'rows': len(observations)})
+        rows = np.arange(len(observations))
+        for episode in np.unique(chunk['episodes']):
+            in_episode = chunk['episodes'] == episode
+            entry = self.index['episodes'].setdefault(str(episode), {
+                'chunk': chunk_id,
+                'row': int(rows[in_episode][0]),
+                'length': 0,
+                'return': 0.,
+                'states': []
+            })
+            entry['length'] += int(in_episode.sum())
+            entry['return'] += float(chunk['rewards'][in_episode].sum())
+            for state in np.unique(chunk['states'][in_episode]):
+                if int(state) not in entry['states']:
+                    entry['states'].append(int(state))
+                    self.index['stages'].setdefault(str(state), []).append(int(episode))
+        if self.codec.rest_pose is not None:
+            np.save(os.path.join(self.folder, REST_POSE_FILE), self.codec.rest_pose)
+        _write_json(os.path.join(self.folder, INDEX_FILE), self.index)
+
+    def close(self) -> None:
+        """Write the rows that are still buffered and wait for the writer, before closing the
+        environment
+        """
+        if self._writer.is_alive():
+            self._end_episode(False)
+            if self._rows > 0:
+                self._chunks.put((self._chunk, self._rows))
+                self._chunk, self._rows = None, 0
+            self._chunks.put(None)
+            self._writer.join()
+        self.env.close()
+        self._raise_error()
+
+
+def _transitions(
+    chunk: Dict[str, np.ndarray], state: Optional[BaxterState],
+    observation_range: Optional[List[Tuple[int, int]]]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Get the transitions of the steps of a chunk, the step of the last row is skipped as its
+    next observation is in the next chunk
+    """
+    steps = np.flatnonzero(chunk['actions'][:-1] != NO_ACTION)
+    if state is not None:
+        steps = steps[chunk['states'][steps] == state.value]
+    observations = chunk['observations']
+    if observation_range is not None:
+        observations = observations[:, compile_mask(observation_range).indices]
+    return (observations[steps], observations[steps + 1], chunk['actions'][steps],
+            chunk['rewards'][steps], chunk['dones'][steps])
+
+
+class EpisodeDataset:
+    """
+    Reads the recordings of the ``EpisodeRecorder`` in a folder, including the recordings in its
+    subfolders, e.g. one per worker of a vectorized environment.
+    """
+
+    def __init__(self, folder: str):
+        """
+        :param folder: The folder of the recordings
+        :type folder: str
+        :raises FileNotFoundError: If the folder doesn't contain any recording
+        """
+        self.folder = folder
+        self.recordings: List[Tuple[str, dict, ObservationCodec]] = []
+        for path, _, files in sorted(os.walk(folder)):
+            if INDEX_FILE in files:
+                with open(os.path.join(path, INDEX_FILE)) as file:
+                    index = json.load(file)
+                self.recordings.append((path, index, _codec_from_index(index, path)))
+        if not self.recordings:
+            raise FileNotFoundError("No recorded episodes in {}".format(folder))
+
+    def __len__(self) -> int:
+        """The amount of recorded steps, without the last rows of the episodes
+        """
+        return sum(
+            sum(chunk['rows'] for chunk in index['chunks']) - len(index['episodes'])
+            for (_, index, _) in self.recordings)
+
+    def episodes(self, state: Optional[BaxterState] = None) -> List[dict]:
+        """Get the index entries of the recorded episodes
+
+        :param state: Only the episodes with steps of this stage, all episodes when omitted
+        :type state: Optional[BaxterState]
+        :return: Per episode its recording, first chunk and row, length, return and stages
+        :rtype: List[dict]
+        """
+        episodes = []
+        for path, index, _ in self.recordings:
+            ids = index['episodes'] if state is None else \
+                index['stages'].get(str(state.value), [])
+            episodes.extend(
+                dict(index['episodes'][str(episode)], recording=path, episode=int(episode))
+                for episode in ids)
+        return episodes
+
+    def _read_chunk(self, recording: int, chunk: int) -> Dict[str, np.ndarray]:
+        """Read and decode a single chunk
+
+        :param recording: The index of the recording
+        :type recording: int
+        :param chunk: The index of the chunk in the recording
+        :type chunk: int
+        :return: The columns of the chunk
+        :rtype: Dict[str, np.ndarray]
+        """
+        path, index, codec = self.recordings[recording]
+        entry = index['chunks'][chunk]
+        with np.load(os.path.join(path, entry['file'])) as data:
+            columns = {name: data[name] for name in data.files}
+        columns['observations'] = codec.decompress(columns['observations'].tobytes(),
+                                                   entry['rows'], index['observation_size'])
+        return columns
+
+    def _chunks(self) -> Iterator[Dict[str, np.ndarray]]:
+        """Read the chunks of all recordings in the order they were written, the last row of the
+        previous chunk of the same recording is prepended, such that the step of every row
+        except the last one is followed by the row of its next observation
+        """
+        for recording, (_, index, _) in enumerate(self.recordings):
+            previous = None
+            for chunk in range(len(index['chunks'])):
+                columns = self._read_chunk(recording, chunk)
+                if previous is not None:
+                    columns = {
+                        name: np.concatenate([previous[name][-1:], column])
+                        for (name, column) in columns.items()
+                    }
+                previous = columns
+                yield columns
+
+    def transitions(
+        self,
+        state: Optional[BaxterState] = None,
+        observation_range: Optional[List[Tuple[int, int]]] = None
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+        """Go over the recorded transitions, a batch per chunk
+
+        :param state: Only the steps of this stage, all steps when omitted
+        :type state: Optional[BaxterState]
+        :param observation_range: The observation range of the model, the full observations
+                                  when omitted
+        :type observation_range: Optional[List[Tuple[int, int]]]
+        :return: The observations, next observations, actions, rewards and dones
+        :rtype: Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]]
+        """
+        for chunk in self._chunks():
+            transitions = _transitions(chunk, state, observation_range)
+            if len(transitions[0]) > 0:
+                yield transitions
+
+    def batches(
+        self,
+        batch_size: int,
+        state: Optional[BaxterState] = None,
+        observation_range: Optional[List[Tuple[int, int]]] = None,
+        shuffle_chunks: int = 8
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+        """Stream shuffled batches of transitions endlessly, going over the dataset once per
+        epoch. A background thread reads and decodes the chunks in a random order, while the
+        batches are drawn from a pool of ``shuffle_chunks`` chunks, every chunk contributing in
+        proportion to its remaining steps. Only the rows of a batch are copied, the chunks are
+        kept as they are read. As the chunks are read on their own, the last step of a chunk,
+        whose next observation is the first row of the next chunk, is skipped.
+
+        :param batch_size: The amount of transitions per batch
+        :type batch_size: int
+        :param state: Only the steps of this stage, all steps when omitted
+        :type state: Optional[BaxterState]
+        :param observation_range: The observation range of the model
+        :type observation_range: Optional[List[Tuple[int, int]]]
+        :param shuffle_chunks: Amount of chunks of which the transitions are shuffled together
+        :type shuffle_chunks: int
+        :raises ValueError: If the recordings hold no episodes of the stage
+        :return: The observations, next observations, actions, rewards and dones
+        :rtype: Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]]
+        """
+        if len(self.episodes(state)) == 0:
+            raise ValueError("The recordings in {} hold no episodes of {}".format(
+                self.folder, state))
+        chunks = [(recording, chunk) for (recording, (_, index, _)) in enumerate(self.recordings)
+                  for chunk in range(len(index['chunks']))]
+        mask = None if observation_range is None else compile_mask(observation_range)
+        read = queue.Queue(maxsize=shuffle_chunks)
+
+        def _read_chunks() -> None:
+            while True:
+                for position in np.random.permutation(len(chunks)):
+                    chunk = self._read_chunk(*chunks[position])
+                    steps = np.flatnonzero(chunk['actions'][:-1] != NO_ACTION)
+                    if state is not None:
+                        steps = steps[chunk['states'][steps] == state.value]
+                    if len(steps) == 0:
+                        continue
+                    observations = chunk['observations']
+                    if mask is not None:
+                        # Scattered ranges are gathered once per chunk instead of once per batch
+                        observations = observations[:, mask.slice] if mask.slice is not None \
+                            else observations[:, mask.indices]
+                    read.put([observations, np.random.permutation(steps), chunk, 0])
+
+        threading.Thread(target=_read_chunks, daemon=True).start()
+
+        pool = []
+        while True:
+            pool = [entry for entry in pool if entry[3] < len(entry[1])]
+            remaining = np.array([len(steps) - used for (_, steps, _, used) in pool], dtype=int)
+            while len(pool) < shuffle_chunks or remaining.sum() < batch_size:
+                pool.append(read.get())
+                remaining = np.append(remaining, len(pool[-1][1]))
+
+            # Every chunk contributes its share of the batch, the rounded off rows are taken
+            # from the chunks with the most steps left
+            counts = batch_size * remaining // remaining.sum()
+            left = remaining - counts
+            counts[np.argsort(-left)[:batch_size - counts.sum()]] += 1
+
+            batch = ([], [], [], [], [])
+            for entry, count in zip(pool, counts):
+                observations, steps, chunk, used = entry
+                rows = steps[used:used + count]
+                entry[3] += count
+                batch[0].append(observations[rows])
+                batch[1].append(observations[rows + 1])
+                batch[2].append(chunk['actions'][rows])
+                batch[3].append(chunk['rewards'][rows])
+                batch[4].append(chunk['dones'][rows])
+            yield tuple(np.concatenate(column) for column in batch)
+
+    def fill_replay_buffer(self,
+                           replay_buffer,
+                           state: Optional[BaxterState] = None,
+                           observation_range: Optional[List[Tuple[int, int]]] = None) -> int:
+        """Add the recorded transitions to a Stable Baselines ReplayBuffer, once the buffer is
+        full the oldest transitions are replaced like during a training
+
+        :param replay_buffer: The buffer to fill
+        :type replay_buffer: ReplayBuffer
+        :param state: Only the steps of this stage, all steps when omitted
+        :type state: Optional[BaxterState]
+        :param observation_range: The observation range of the model
+        :type observation_range: Optional[List[Tuple[int, int]]]
+        :return: The amount of added transitions
+        :rtype: int
+        """
+        added = 0
+        for observations, next_observations, actions, rewards, dones in \
+                self.transitions(state, observation_range):
+            for transition in zip(observations, next_observations, actions, rewards, dones):
+                replay_buffer.add(*transition)
+            added += len(actions)
+        return added
@@ -1,9 +1,12 @@
 """Module for custom wrapper used to change the observation range
 """
-from typing import List, Tuple
+from typing import List, Tuple, Union
 
 from gym import Wrapper, spaces
 import numpy as np
+from stable_baselines3.common.vec_env import VecEnv, VecEnvWrapper
+
+from utilities.observation_mask import compile_mask
 
 
 class FilteredWrapper(Wrapper):
@@ -14,9 +17,46 @@ class FilteredWrapper(Wrapper):
     def __init__(self, env, observation_range: List[Tuple[int, int]]):
         super().__init__(env)
 
-        self.__observation_mask = np.concatenate(
-            [range(start, stop) for (start, stop) in observation_range])
+        self.__observation_mask = compile_mask(observation_range)
         self.observation_space = spaces.Box(
-            low=env.observation_space.low[self.__observation_mask],
-            high=env.observation_space.high[self.__observation_mask],
+            low=env.observation_space.low[self.__observation_mask.indices],
+            high=env.observation_space.high[self.__observation_mask.indices],
             shape=(len(self.__observation_mask),))
+
+
+class FilteredVecEnvWrapper(VecEnvWrapper):
+    """The vectorized counterpart of the FilteredWrapper, the workers of the
+    wrapped VecEnv already apply the observation mask, so only the observation
+    space has to be changed.
+    """
+
+    def __init__(self, venv: VecEnv, observation_range: List[Tuple[int, int]]):
+        observation_mask = compile_mask(observation_range)
+        super().__init__(venv,
+                         observation_space=spaces.Box(
+                             low=venv.observation_space.low[observation_mask.indices],
+                             high=venv.observation_space.high[observation_mask.indices],
+                             shape=(len(observation_mask),)))
+
+    def reset(self) -> np.ndarray:
+        return self.venv.reset()
+
+    def step_wait(self):
+        return self.venv.step_wait()
+
+
+def filter_env(env, observation_range: List[Tuple[int, int]]
+              ) -> Union[FilteredWrapper, FilteredVecEnvWrapper]:
+    """Wraps the environment in the filter matching its type, allowing the training
+    models to be created on a single environment as well as on a vectorized one.
+
+    :param env: The (vectorized) environment to filter
+    :type env: Union[gym.Env, VecEnv]
+    :param observation_range: list of ranges [(start, stop), (start, stop)] in the observation space
+    :type observation_range: List[Tuple[int, int]]
+    :return: The filtered environment
+    :rtype: Union[FilteredWrapper, FilteredVecEnvWrapper]
+    """
+    if isinstance(env, VecEnv):
+        return FilteredVecEnvWrapper(env, observation_range)
+    return FilteredWrapper(env, observation_range)
@@ -0,0 +1,166 @@
+"""
+Module containing a lightweight inference engine for the frozen models of the earlier states.
+The Q-network of a Stable Baselines DQN model is copied into NumPy arrays once, after which
+the greedy actions are calculated without any of the overhead of ``predict``.
+"""
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple, Type
+
+import numpy as np
+
+if TYPE_CHECKING:
+    # The engine itself only needs NumPy, e.g. for the actors of the custom Q-learning
+    import torch as th
+    from torch import nn
+    from stable_baselines3 import DQN
+
+
+def _relu(x: np.ndarray) -> np.ndarray:
+    return np.maximum(x, 0., out=x)
+
+
+def _tanh(x: np.ndarray) -> np.ndarray:
+    return np.tanh(x, out=x)
+
+
+# The activation functions supported by the engine by the name of their PyTorch module,
+# applied in place
+ACTIVATIONS = {'ReLU': _relu, 'Tanh': _tanh}
+
+
+class GreedyQPolicy:
+    """The greedy policy of a frozen Q-network, evaluated with NumPy. The weights are stored as
+    contiguous float32 arrays, such that a whole batch of observations from several
+    environments can be evaluated with a single matrix product per layer.
+    """
+
+    def __init__(self, layers: List[Tuple[np.ndarray, np.ndarray,
+                                          Optional[Callable[[np.ndarray], np.ndarray]]]]):
+        """
+        :param layers: Per linear layer its weight of shape (inputs, outputs), its bias and the
+                       activation applied to its output in place, None for the last layer
+        :type layers: List[Tuple[np.ndarray, np.ndarray, Optional[Callable]]]
+        """
+        self.layers = [(np.ascontiguousarray(weight, dtype=np.float32),
+                        np.ascontiguousarray(bias, dtype=np.float32), activation)
+                       for (weight, bias, activation) in layers]
+
+    @staticmethod
+    def from_model(model: 'DQN') -> 'GreedyQPolicy':
+        """Copy the weights out of the Q-network of a DQN model
+
+        :param model: The trained model, with a flattened observation and an MLP Q-network
+        :type model: DQN
+        :raises ValueError: If the Q-network contains a layer the engine doesn't support
+        :return: The inference engine of the model
+        :rtype: GreedyQPolicy
+        """
+        # pylint: disable=import-outside-toplevel
+        import torch as th
+        from torch import nn
+        from stable_baselines3.common.torch_layers import FlattenExtractor
+
+        q_net = model.q_net
+        if not isinstance(q_net.features_extractor, FlattenExtractor):
+            raise ValueError("Unsupported features extractor {}".format(
+                type(q_net.features_extractor).__name__))
+
+        layers = []
+        with th.no_grad():
+            for module in q_net.q_net:
+                if isinstance(module, nn.Linear):
+                    layers.append([
+                        module.weight.detach().cpu().numpy().T,
+                        module.bias.detach().cpu().numpy(), None
+                    ])
+                elif type(module).__name__ in ACTIVATIONS and layers and layers[-1][2] is None:
+                    layers[-1][2] = ACTIVATIONS[type(module).__name__]
+                else:
+                    raise ValueError("Unsupported layer {} in the Q-network".format(module))
+        return GreedyQPolicy([tuple(layer) for layer in layers])
+
+    @staticmethod
+    def from_state_dict(parameters: Dict[str, 'th.Tensor'],
+                        activation_fn: Type['nn.Module'],
+                        prefix: str = 'q_net.q_net.') -> 'GreedyQPolicy':
+        """Create the engine from the state dict of a DQN policy, as stored in the zip file of a
+        model, without creating the model itself
+
+        :param parameters: The state dict of the policy
+        :type parameters: Dict[str, th.Tensor]
+        :param activation_fn: The activation function of the hidden layers
+        :type activation_fn: Type[nn.Module]
+        :param prefix: The prefix of the layers of the Q-network in the state dict
+        :type prefix: str
+        :raises ValueError: If the engine doesn't support the activation function
+        :return: The inference engine of the Q-network
+        :rtype: GreedyQPolicy
+        """
+        if activation_fn.__name__ not in ACTIVATIONS:
+            raise ValueError("Unsupported activation function {}".format(activation_fn))
+        # The linear layers are the numbered modules of the Sequential with a weight
+        indices = sorted(
+            int(name[len(prefix):-len('.weight')])
+            for name in parameters
+            if name.startswith(prefix) and name.endswith('.weight'))
+        kernels = [parameters['{}{}.weight'.format(prefix, index)].cpu().numpy().T
+                   for index in indices]
+        biases = [parameters['{}{}.bias'.format(prefix, index)].cpu().numpy()
+                  for index in indices]
+        activations = [ACTIVATIONS[activation_fn.__name__]] * (len(kernels) - 1) + [None]
+        return GreedyQPolicy(list(zip(kernels, biases, activations)))
+
+    @staticmethod
+    def from_dense_weights(weights: List[np.ndarray]) -> 'GreedyQPolicy':
+        """Create the engine from the weights of an MLP with ReLU activations and a linear
+        output layer, as returned by ``get_weights`` of a Keras model of Dense layers
+
+        :param weights: The kernel and bias of every layer, alternating
+        :type weights: List[np.ndarray]
+        :return: The inference engine of the MLP
+        :rtype: GreedyQPolicy
+        """
+        kernels, biases = weights[0::2], weights[1::2]
+        activations = [_relu] * (len(kernels) - 1) + [None]
+        return GreedyQPolicy(list(zip(kernels, biases, activations)))
+
+    def q_values(self, observations: np.ndarray) -> np.ndarray:
+        """Calculate the Q-values of a batch of observations
+
+        :param observations: Observations of shape (batch, observation size)
+        :type observations: np.ndarray
+        :return: The Q-values of shape (batch, actions)
+        :rtype: np.ndarray
+        """
+        x = np.asarray(observations, dtype=np.float32)
+        for weight, bias, activation in self.layers:
+            x = x @ weight
+            x += bias
+            if activation is not None:
+                x = activation(x)
+        return x
+
+    def predict(self,
+                observation: np.ndarray,
+                state: Optional[np.ndarray] = None,
+                mask: Optional[np.ndarray] = None,
+                deterministic: bool = True) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Get the greedy action, with the same signature as the ``predict`` of Stable Baselines
+        so it can replace the model wherever only the actions are needed
+
+        :param observation: A single observation, or a batch of observations of several
+                            environments
+        :type observation: np.ndarray
+        :param state: Unused, the network has no recurrent state
+        :type state: Optional[np.ndarray]
+        :param mask: Unused, the network has no recurrent state
+        :type mask: Optional[np.ndarray]
+        :param deterministic: Unused, the actions are always greedy
+        :type deterministic: bool
+        :return: The action (or batch of actions) and the unchanged state
+        :rtype: Tuple[np.ndarray, Optional[np.ndarray]]
+        """
+        observation = np.asarray(observation)
+        actions = self.q_values(observation.reshape(-1, observation.shape[-1])).argmax(axis=1)
+        if observation.ndim == 1:
+            return actions[0], state
+        return actions, state
@@ -4,6 +4,9 @@ correct training mode, either multi-stage either single stage
 import uuid
 from mlagents_envs.side_channel import SideChannel, IncomingMessage, OutgoingMessage
 
+# The training modes, sent to Unity as their values in the TrainingMode enum of C#
+MODES = {'Multi': 0, 'Single': 1}
+
 
 class ModeChannel(SideChannel):
     """This Unity ML agents Side Channel is used to communicate
@@ -16,13 +19,13 @@ class ModeChannel(SideChannel):
     def on_message_received(self, msg: IncomingMessage) -> None:
         raise NotImplementedError
 
-    def send_string(self, data: str) -> None:
-        """This message is used to send the string
+    def send_mode(self, mode: str) -> None:
+        """This message is used to send the mode
         that sets the training mode in Unity
 
-        :param data: Either the string "Multi" or "Single"
-        :type data: str
+        :param mode: Either the string "Multi" or "Single"
+        :type mode: str
         """
         msg = OutgoingMessage()
-        msg.write_string(data)
+        msg.write_int32(MODES[mode])
         super().queue_message_to_send(msg)
@@ -0,0 +1,142 @@
+"""
+Module containing the registry of the frozen models of the earlier states. Only the weights of
+the Q-network are read from the zip file of a model, into the greedy inference engine, and the
+engines are cached per file version. A new version of a file is loaded in the background while
+the previous version keeps being used, such that a state transition never waits for a load.
+"""
+import inspect
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, Tuple
+
+import gin
+
+from utilities.inference import GreedyQPolicy
+from utilities.startup import profiler
+
+
+def load_policy(path: str) -> GreedyQPolicy:
+    """Load the greedy inference engine of a DQN model, without creating the model, its
+    optimizer or its environment
+
+    :param path: The zip file of the model
+    :type path: str
+    :raises ValueError: If the Q-network contains a layer the engine doesn't support
+    :return: The inference engine of the model
+    :rtype: GreedyQPolicy
+    """
+    # Stable Baselines is imported by the first load, which runs in the background thread
+    # pylint: disable=import-outside-toplevel
+    from stable_baselines3.common.save_util import load_from_zip_file
+    from stable_baselines3.common.torch_layers import FlattenExtractor
+
+    data, parameters, _ = load_from_zip_file(path, device='cpu')
+    # The arguments the policy was created with, the defaults of the policy class otherwise
+    defaults = inspect.signature(data['policy_class']).parameters
+    policy_kwargs = data.get('policy_kwargs') or {}
+    features_extractor = policy_kwargs.get('features_extractor_class',
+                                           defaults['features_extractor_class'].default)
+    if features_extractor is not FlattenExtractor:
+        raise ValueError("Unsupported features extractor {}".format(features_extractor.__name__))
+    return GreedyQPolicy.from_state_dict(
+        parameters['policy'],
+        policy_kwargs.get('activation_fn', defaults['activation_fn'].default))
+
+
+def _model_file(path: str) -> str:
+    """The file a model is loaded from, Stable Baselines adds the .zip extension when needed
+    """
+    return path if os.path.isfile(path) or path.endswith('.zip') else path + '.zip'
+
+
+@gin.configurable
+class ModelRegistry:
+    """
+    Keeps the inference engines of the most recently used models, keyed by their file and its
+    modification time. Requesting a model whose file changed since it was loaded returns the
+    loaded version until the new version has been loaded by the background thread, which then
+    replaces it at once.
+    """
+
+    def __init__(self, capacity: int = 8):
+        """
+        :param capacity: Amount of model versions kept in memory
+        :type capacity: int
+        """
+        self.capacity = capacity
+
+        self.__lock = threading.Lock()
+        self.__policies: 'OrderedDict[Tuple[str, float], GreedyQPolicy]' = OrderedDict()
+        # The version of every file that was returned last, and the versions being loaded
+        self.__latest: Dict[str, float] = {}
+        self.__loading: Dict[Tuple[str, float], Future] = {}
+        self.__loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='model-registry')
+
+    def __load(self, key: Tuple[str, float]) -> GreedyQPolicy:
+        """Load a version of a model and add it to the cache, this runs in the background
+        thread unless nothing was loaded of the file yet
+        """
+        try:
+            with profiler.measure('load {}'.format(key[0])):
+                policy = load_policy(key[0])
+        except Exception:
+            # A failed load is tried again on the next request
+            with self.__lock:
+                self.__loading.pop(key, None)
+            raise
+        with self.__lock:
+            self.__loading.pop(key, None)
+            self.__policies[key] = policy
+            self.__policies.move_to_end(key)
+            while len(self.__policies) > self.capacity:
+                self.__policies.popitem(last=False)
+        return policy
+
+    def __submit(self, key: Tuple[str, float]) -> Future:
+        """Load a version in the background, unless it is being loaded already.
+        The lock has to be held.
+        """
+        if key not in self.__loading:
+            self.__loading[key] = self.__loader.submit(self.__load, key)
+        return self.__loading[key]
+
+    def get(self, path: str) -> GreedyQPolicy:
+        """Get the inference engine of the latest version of a model. Only the first request
+        of a file waits for it to be loaded.
+
+        :param path: The file of the model, with or without the .zip extension
+        :type path: str
+        :return: The inference engine
+        :rtype: GreedyQPolicy
+        """
+        path = _model_file(path)
+        key = (path, os.path.getmtime(path))
+        with self.__lock:
+            if key in self.__policies:
+                self.__policies.move_to_end(key)
+                self.__latest[path] = key[1]
+                return self.__policies[key]
+            latest = self.__latest.get(path)
+            future = self.__submit(key)
+            if latest is not None and (path, latest) in self.__policies:
+                # Keep using the loaded version until the new one is ready
+                return self.__policies[(path, latest)]
+        policy = future.result()
+        with self.__lock:
+            self.__latest[path] = key[1]
+        return policy
+
+    def prefetch(self, paths: Iterable[str]) -> None:
+        """Load models in the background, e.g. all models of the earlier states at startup.
+        Files that don't exist are skipped.
+
+        :param paths: The files of the models
+        :type paths: Iterable[str]
+        """
+        with self.__lock:
+            for path in paths:
+                path = _model_file(path)
+                if os.path.isfile(path):
+                    self.__submit((path, os.path.getmtime(path)))
@@ -0,0 +1,258 @@
+"""
+Module containing the codec of the observations stored by the replay buffers and recordings.
+The cloth nodes make up almost the whole observation, they are stored as float16 (optionally as
+offsets to the cloth at rest), while the joints and the wrist height are stored as they are.
+"""
+import zlib
+from typing import List, Optional, Tuple
+
+import gin
+import numpy as np
+
+from simulation import rewards
+from utilities.baxter_state import BaxterState
+from utilities.observation_mask import compile_mask
+
+
+def _shuffle(array: np.ndarray) -> bytes:
+    """Group the bytes of the values by their significance, the high bytes of neighbouring
+    values are mostly equal which makes them compress a lot better
+    """
+    values = np.ascontiguousarray(array).reshape(-1).view(np.uint8).reshape(-1, array.itemsize)
+    planes = np.empty((array.itemsize, len(values)), dtype=np.uint8)
+    # Copying a plane at a time is a lot faster than transposing the bytes
+    for byte in range(array.itemsize):
+        planes[byte] = values[:, byte]
+    return planes.tobytes()
+
+
+def _unshuffle(data: bytes, dtype: np.dtype, shape: Tuple[int, ...]) -> np.ndarray:
+    itemsize = np.dtype(dtype).itemsize
+    planes = np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1)
+    values = np.empty((planes.shape[1], itemsize), dtype=np.uint8)
+    for byte in range(itemsize):
+        values[:, byte] = planes[byte]
+    return values.view(dtype).reshape(shape)
+
+
+@gin.configurable
+class ObservationCodec:
+    """
+    Encodes batches of observations into a float32 part and a cloth part, storing the cloth
+    part as float16 halves the size of an observation. The cloth part can also be stored as the
+    offset of every node to its position at rest, which is taken from the first encoded
+    observation unless it is given. This only gains precision and compression when the cloth
+    stays close to its rest pose, as the offsets are as large as the positions once it moves.
+    """
+
+    def __init__(self,
+                 cloth_range: Tuple[int, int] = (rewards.CLOTH_START, rewards.CLOTH_END),
+                 float16: bool = True,
+                 delta_to_rest: bool = False,
+                 compression_level: int = 6,
+                 rest_pose: Optional[np.ndarray] = None):
+        """
+        :param cloth_range: The start and stop of the cloth nodes in an observation
+        :type cloth_range: Tuple[int, int]
+        :param float16: Store the cloth part as float16
+        :type float16: bool
+        :param delta_to_rest: Store the cloth part as the offset to the cloth at rest
+        :type delta_to_rest: bool
+        :param compression_level: The zlib level of ``compress``, 0 only shuffles the bytes
+        :type compression_level: int
+        :param rest_pose: The cloth part of an observation of the cloth at rest
+        :type rest_pose: Optional[np.ndarray]
+        """
+        self.cloth_start, self.cloth_stop = cloth_range
+        self.cloth_dtype = np.dtype(np.float16 if float16 else np.float32)
+        self.delta_to_rest = delta_to_rest
+        self.compression_level = compression_level
+        self.rest_pose = None if rest_pose is None else np.asarray(rest_pose, dtype=np.float32)
+
+    @staticmethod
+    def for_observation_range(observation_range: List[Tuple[int, int]]) -> 'ObservationCodec':
+        """Create the codec of the observations a model sees through its observation range
+
+        :param observation_range: The observation range of the model
+        :type observation_range: List[Tuple[int, int]]
+        :raises ValueError: If the range only selects scattered nodes of the cloth
+        :return: The codec, which only stores the selected nodes as cloth
+        :rtype: ObservationCodec
+        """
+        indices = compile_mask(observation_range).indices
+        cloth = np.flatnonzero((indices >= rewards.CLOTH_START) & (indices < rewards.CLOTH_END))
+        if len(cloth) == 0:
+            return ObservationCodec(cloth_range=(0, 0))
+        if cloth[-1] - cloth[0] + 1 != len(cloth):
+            raise ValueError(
+                "The cloth isn't contiguous in the observation range {}".format(observation_range))
+        return ObservationCodec(cloth_range=(int(cloth[0]), int(cloth[-1]) + 1))
+
+    def exact_size(self, observation_size: int) -> int:
+        """The amount of values of an observation that are stored as float32
+        """
+        return observation_size - (self.cloth_stop - self.cloth_start)
+
+    def bytes_per_observation(self, observation_size: int) -> int:
+        """The size of an encoded observation, before compression
+        """
+        return self.exact_size(observation_size) * 4 + \
+            (self.cloth_stop - self.cloth_start) * self.cloth_dtype.itemsize
+
+    def encode(self, observations: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Encode observations, the observation has to be the last axis
+
+        :param observations: The observations, of any leading shape
+        :type observations: np.ndarray
+        :return: The float32 part and the cloth part
+        :rtype: Tuple[np.ndarray, np.ndarray]
+        """
+        observations = np.asarray(observations, dtype=np.float32)
+        exact = np.concatenate(
+            [observations[..., :self.cloth_start], observations[..., self.cloth_stop:]], axis=-1)
+        cloth = observations[..., self.cloth_start:self.cloth_stop]
+        if self.delta_to_rest and cloth.shape[-1] > 0:
+            if self.rest_pose is None:
+                self.rest_pose = cloth.reshape(-1, cloth.shape[-1])[0].copy()
+            cloth = cloth - self.rest_pose
+        return exact, cloth.astype(self.cloth_dtype)
+
+    def decode(self, exact: np.ndarray, cloth: np.ndarray) -> np.ndarray:
+        """Decode observations encoded by ``encode``
+
+        :param exact: The float32 part
+        :type exact: np.ndarray
+        :param cloth: The cloth part
+        :type cloth: np.ndarray
+        :return: The float32 observations
+        :rtype: np.ndarray
+        """
+        observations = np.empty(exact.shape[:-1] + (exact.shape[-1] + cloth.shape[-1],),
+                                dtype=np.float32)
+        cloth_stop = self.cloth_start + cloth.shape[-1]
+        observations[..., :self.cloth_start] = exact[..., :self.cloth_start]
+        observations[..., cloth_stop:] = exact[..., self.cloth_start:]
+        observations[..., self.cloth_start:cloth_stop] = cloth
+        if self.delta_to_rest and cloth.shape[-1] > 0:
+            observations[..., self.cloth_start:cloth_stop] += self.rest_pose
+        return observations
+
+    def compress(self, observations: np.ndarray) -> bytes:
+        """Encode a batch of observations and compress it losslessly, e.g. to write it to disk
+
+        :param observations: The observations, of shape (batch, observation size)
+        :type observations: np.ndarray
+        :return: The compressed observations
+        :rtype: bytes
+        """
+        exact, cloth = self.encode(observations)
+        return zlib.compress(_shuffle(exact) + _shuffle(cloth), self.compression_level)
+
+    def decompress(self, data: bytes, count: int, observation_size: int) -> np.ndarray:
+        """Decompress a batch of observations compressed by ``compress``
+
+        :param data: The compressed observations
+        :type data: bytes
+        :param count: The amount of observations
+        :type count: int
+        :param observation_size: The size of an observation
+        :type observation_size: int
+        :return: The observations, of shape (count, observation size)
+        :rtype: np.ndarray
+        """
+        data = zlib.decompress(data)
+        exact_size = self.exact_size(observation_size)
+        split = count * exact_size * 4
+        exact = _unshuffle(data[:split], np.float32, (count, exact_size))
+        cloth = _unshuffle(data[split:], self.cloth_dtype,
+                           (count, observation_size - exact_size))
+        return self.decode(exact, cloth)
+
+
+class EncodedObservations:
+    """
+    Stands in for the observation array of a Stable Baselines ReplayBuffer, it encodes the
+    observations that are written and decodes the observations that are read. Only the
+    indexing of the buffer is supported: rows are selected on the leading axes and the
+    observation axis is always taken as a whole.
+    """
+
+    def __init__(self,
+                 codec: ObservationCodec,
+                 shape: Tuple[int, ...],
+                 exact: Optional[np.ndarray] = None,
+                 cloth: Optional[np.ndarray] = None):
+        """
+        :param codec: The codec of the observations
+        :type codec: ObservationCodec
+        :param shape: The shape of the decoded array, the observations are the last axis
+        :type shape: Tuple[int, ...]
+        :param exact: Storage of the float32 parts, e.g. a memory map, allocated when omitted
+        :type exact: Optional[np.ndarray]
+        :param cloth: Storage of the cloth parts, allocated when omitted
+        :type cloth: Optional[np.ndarray]
+        """
+        self.codec = codec
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(np.float32)
+        exact_size = codec.exact_size(self.shape[-1])
+        self.exact = np.zeros(self.shape[:-1] + (exact_size,), dtype=np.float32) \
+            if exact is None else exact
+        self.cloth = np.zeros(self.shape[:-1] + (self.shape[-1] - exact_size,),
+                              dtype=codec.cloth_dtype) if cloth is None else cloth
+
+    @property
+    def nbytes(self) -> int:
+        return self.exact.nbytes + self.cloth.nbytes
+
+    def _rows(self, key):
+        """Drop a trailing full slice of the observation axis from an index
+        """
+        if isinstance(key, tuple) and len(key) == len(self.shape) and \
+                isinstance(key[-1], slice) and key[-1] == slice(None):
+            return key[:-1]
+        return key
+
+    def __getitem__(self, key) -> np.ndarray:
+        rows = self._rows(key)
+        return self.codec.decode(self.exact[rows], self.cloth[rows])
+
+    def __setitem__(self, key, value: np.ndarray) -> None:
+        rows = self._rows(key)
+        self.exact[rows], self.cloth[rows] = self.codec.encode(value)
+
+
+def use_observation_codec(replay_buffer, codec: ObservationCodec) -> None:
+    """Let an empty Stable Baselines ReplayBuffer store its observations encoded
+
+    :param replay_buffer: The buffer, nothing may have been added to it yet
+    :type replay_buffer: ReplayBuffer
+    :param codec: The codec of the observations of the buffer
+    :type codec: ObservationCodec
+    """
+    replay_buffer.observations = EncodedObservations(codec, replay_buffer.observations.shape)
+    if getattr(replay_buffer, 'next_observations', None) is not None:
+        replay_buffer.next_observations = EncodedObservations(
+            codec, replay_buffer.next_observations.shape)
+
+
+def reward_error(codec: ObservationCodec, state: BaxterState,
+                 observations: np.ndarray) -> Tuple[float, int]:
+    """Compare the rewards of full observations with the rewards of their decoded encoding,
+    using the port of the rewards of ``RectangularClothRewards.cs``
+
+    :param codec: The codec of full observations
+    :type codec: ObservationCodec
+    :param state: The stage of the observations
+    :type state: BaxterState
+    :param observations: Full observations, of shape (batch, 2037)
+    :type observations: np.ndarray
+    :return: The largest absolute reward difference and the amount of observations of
+             which the success or failure changed
+    :rtype: Tuple[float, int]
+    """
+    decoded = codec.decode(*codec.encode(observations))
+    expected, expected_success, expected_failure = rewards.evaluate(state, observations)
+    actual, success, failure = rewards.evaluate(state, decoded)
+    changed = (expected_success != success) | (expected_failure != failure)
+    return float(np.abs(expected - actual).max()), int(changed.sum())
@@ -0,0 +1,98 @@
+"""
+Module containing the compiled observation masks, used to select the observations
+a model uses without copying the whole observation at every step.
+"""
+import functools
+from typing import List, Tuple
+
+import numpy as np
+
+
+class ObservationMask:
+    """Selects the observations within a list of ranges. When the ranges are contiguous,
+    the selection is a slice view of the observation. Otherwise the observations are gathered
+    into one of two preallocated buffers, which are used in turn such that the previous
+    result stays valid, like the last and the new observation of a replay buffer.
+    """
+
+    def __init__(self, observation_range: List[Tuple[int, int]]):
+        """
+        :param observation_range: list of ranges [(start, stop), (start, stop)] in the
+                                  observation space
+        :type observation_range: List[Tuple[int, int]]
+        """
+        self.observation_range = [(start, stop) for (start, stop) in observation_range]
+        self.indices = np.concatenate(
+            [np.arange(start, stop) for (start, stop) in self.observation_range])
+        self.size = len(self.indices)
+
+        # Adjacent ranges, e.g. [(0, 4), (4, 8)], are still a single slice
+        contiguous = self.size > 0 and \
+            np.array_equal(self.indices, np.arange(self.indices[0], self.indices[0] + self.size))
+        self.slice = slice(self.indices[0], self.indices[0] + self.size) if contiguous else None
+
+        self.__buffers = []
+        self.__next_buffer = 0
+        self.__input_shape = None
+        self.__dtype = None
+
+    @property
+    def is_view(self) -> bool:
+        """Whether the selected observations are a view of the observation
+        """
+        return self.slice is not None
+
+    def __call__(self, observation: np.ndarray) -> np.ndarray:
+        """Select the observations within the ranges
+
+        :param observation: The full observation, or a batch of them
+        :type observation: np.ndarray
+        :return: A view of the observation, or a buffer which is reused by the call after
+                 the next one
+        :rtype: np.ndarray
+        """
+        if self.slice is not None:
+            return observation[..., self.slice]
+
+        if observation.shape != self.__input_shape or observation.dtype != self.__dtype:
+            self.__allocate(observation)
+        buffer = self.__buffers[self.__next_buffer]
+        self.__next_buffer = 1 - self.__next_buffer
+        # The indices were checked when allocating, clipping avoids an intermediate copy
+        return observation.take(self.indices, axis=-1, out=buffer, mode='clip')
+
+    def __allocate(self, observation: np.ndarray) -> None:
+        """Allocate the buffers for observations of a new shape or type
+
+        :param observation: The full observation, or a batch of them
+        :type observation: np.ndarray
+        :raises IndexError: If the ranges exceed the observation
+        """
+        if self.size and self.indices.max() >= observation.shape[-1]:
+            raise IndexError("Observation range {} exceeds the observation size {}".format(
+                self.observation_range, observation.shape[-1]))
+        shape = observation.shape[:-1] + (self.size,)
+        self.__buffers = [np.empty(shape, dtype=observation.dtype) for _ in range(2)]
+        self.__input_shape = observation.shape
+        self.__dtype = observation.dtype
+
+    def __len__(self) -> int:
+        return self.size
+
+
+@functools.lru_cache(maxsize=None)
+def _compile(observation_range: Tuple[Tuple[int, int], ...]) -> ObservationMask:
+    return ObservationMask(list(observation_range))
+
+
+def compile_mask(observation_range: List[Tuple[int, int]]) -> ObservationMask:
+    """Get the mask of an observation range, every range is only compiled once such that
+    the environments, their wrappers and the state manager share the same mask
+
+    :param observation_range: list of ranges [(start, stop), (start, stop)] in the
+                              observation space
+    :type observation_range: List[Tuple[int, int]]
+    :return: The compiled mask
+    :rtype: ObservationMask
+    """
+    return _compile(tuple((int(start), int(stop)) for (start, stop) in observation_range))
@@ -0,0 +1,282 @@
+"""
+Module containing an evaluation service for the training, which replaces the EvalCallback of
+Stable Baselines. The current policy is snapshot and evaluated by a pool of worker processes on
+their own environments, while the training continues.
+"""
+import multiprocessing as mp
+import os
+import queue
+import sys
+from typing import Callable, Dict, List, Optional, Tuple
+
+import gin
+import gym
+import numpy as np
+from stable_baselines3.common import logger
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.vec_env.base_vec_env import CloudpickleWrapper
+
+from utilities.checkpoint import save_model
+from utilities.inference import GreedyQPolicy
+
+# Seconds to wait for a worker to stop at the end of the training, before it's terminated
+WORKER_JOIN_TIMEOUT = 30.
+
+
+def _run_evaluator(env_fn: CloudpickleWrapper, gin_config: Optional[str], tasks: mp.Queue,
+                   results: mp.Queue) -> None:
+    """Evaluate the policies handed over by the callback until it hands over None, this runs
+    in the process of an evaluation worker
+
+    :param env_fn: Function creating the environment of the worker
+    :param gin_config: The gin configuration to parse in the worker process
+    :param tasks: Queue of the evaluation id, the policy and the amount of episodes
+    :param results: Queue of the evaluation id, the episode returns and the episode lengths
+    """
+    if gin_config is not None:
+        gin.parse_config(gin_config, skip_unknown=True)
+    env = env_fn.var()
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        evaluation, policy, episodes = task
+        returns, lengths = [], []
+        for _ in range(episodes):
+            observation, done = env.reset(), False
+            episode_return, episode_length = 0., 0
+            while not done:
+                action, _ = policy.predict(observation)
+                observation, reward, done, _ = env.step(action)
+                episode_return += reward
+                episode_length += 1
+            returns.append(episode_return)
+            lengths.append(episode_length)
+        results.put((evaluation, returns, lengths))
+    env.close()
+
+
+@gin.configurable
+class ParallelEvalCallback(BaseCallback):
+    """
+    Evaluates the greedy policy every ``eval_freq`` calls in worker processes, each with its own
+    environment, such that neither the evaluation episodes nor the replay of the earlier stages
+    during their resets pause the training. The results are collected whenever they arrive and
+    written like the EvalCallback does: ``evaluations.npz`` in the log path and the best model
+    in the best model save path. An evaluation is skipped while the previous one is running.
+
+    A worker that dies, e.g. when its Unity instance crashes, is restarted up to
+    ``max_restarts`` times, the evaluation it was running is abandoned.
+    """
+
+    def __init__(self,
+                 env_fns: List[Callable[[], gym.Env]],
+                 eval_freq: int,
+                 best_model_save_path: Optional[str] = None,
+                 log_path: Optional[str] = None,
+                 n_eval_episodes: int = 5,
+                 start_method: Optional[str] = None,
+                 gin_config: Optional[str] = None,
+                 max_restarts: int = 3,
+                 verbose: int = 1):
+        """
+        :param env_fns: Per worker the function creating its environment
+        :type env_fns: List[Callable[[], gym.Env]]
+        :param eval_freq: Amount of calls of the callback between evaluations
+        :type eval_freq: int
+        :param best_model_save_path: Folder to save the best model in, not saved when None
+        :type best_model_save_path: Optional[str]
+        :param log_path: Folder to save the evaluations in, not saved when None
+        :type log_path: Optional[str]
+        :param n_eval_episodes: Amount of episodes per evaluation, divided over the workers
+        :type n_eval_episodes: int
+        :param start_method: The multiprocessing start method of the workers, defaults to
+                             forkserver when available
+        :type start_method: Optional[str]
+        :param gin_config: The gin configuration to parse in the worker processes
+        :type gin_config: Optional[str]
+        :param max_restarts: Amount of times a worker that died is restarted, once all restarts
+                             are used up the dead workers are left out
+        :type max_restarts: int
+        :param verbose: Print the results of the evaluations when 1
+        :type verbose: int
+        """
+        super().__init__(verbose)
+        self.env_fns = env_fns
+        self.eval_freq = eval_freq
+        self.best_model_save_path = best_model_save_path
+        self.log_path = log_path
+        self.n_eval_episodes = n_eval_episodes
+        self.gin_config = gin_config
+        self.max_restarts = max_restarts
+
+        if start_method is None:
+            start_method = 'forkserver' if 'forkserver' in mp.get_all_start_methods() \
+                else 'spawn'
+        self._context = mp.get_context(start_method)
+        self._tasks = None
+        self._results = None
+        # The running worker processes, with the functions creating their environments
+        self._workers: List[mp.Process] = []
+        self._worker_env_fns: List[Callable[[], gym.Env]] = []
+        self._restarts = 0
+
+        # The evaluation that is running, with the timesteps and parameters of its policy
+        self._evaluation = 0
+        self._pending: Optional[Tuple[int, Dict]] = None
+        self._returns: List[float] = []
+        self._lengths: List[int] = []
+
+        self.best_mean_reward = -np.inf
+        self.last_mean_reward = -np.inf
+        self.evaluations_timesteps: List[int] = []
+        self.evaluations_results: List[List[float]] = []
+        self.evaluations_length: List[List[int]] = []
+
+    def _init_callback(self) -> None:
+        for folder in (self.best_model_save_path, self.log_path):
+            if folder is not None:
+                os.makedirs(folder, exist_ok=True)
+
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+        self._worker_env_fns = list(self.env_fns)
+        self._workers = [self._start_worker(env_fn) for env_fn in self._worker_env_fns]
+
+    def _start_worker(self, env_fn: Callable[[], gym.Env]) -> mp.Process:
+        worker = self._context.Process(target=_run_evaluator,
+                                       args=(CloudpickleWrapper(env_fn), self.gin_config,
+                                             self._tasks, self._results),
+                                       daemon=True)
+        worker.start()
+        return worker
+
+    def _check_workers(self, restart: bool) -> None:
+        """Abandon the running evaluation when a worker died, the episodes it was evaluating
+        never arrive, and restart the dead workers
+
+        :param restart: Restart the dead workers, as long as there are restarts left
+        :type restart: bool
+        """
+        for index in reversed(range(len(self._workers))):
+            worker = self._workers[index]
+            if worker.is_alive():
+                continue
+            print("Evaluation worker {} exited with code {}".format(index, worker.exitcode),
+                  file=sys.stderr)
+            if self._pending is not None:
+                print("Abandoning the evaluation at {} timesteps".format(self._pending[0]),
+                      file=sys.stderr)
+                self._pending = None
+            if restart and self._restarts < self.max_restarts:
+                self._restarts += 1
+                self._workers[index] = self._start_worker(self._worker_env_fns[index])
+            else:
+                del self._workers[index]
+                del self._worker_env_fns[index]
+
+    def _start_evaluation(self) -> None:
+        """Snapshot the policy and divide its episodes over the workers
+        """
+        if not self._workers:
+            if self.verbose > 0:
+                print("Skipping the evaluation at {} timesteps, all evaluation workers "
+                      "died".format(self.num_timesteps))
+            return
+        self._evaluation += 1
+        policy = GreedyQPolicy.from_model(self.model)
+        # The parameters are kept to save the evaluated model once it turns out to be the best
+        parameters = {
+            name: tensor.detach().clone()
+            for (name, tensor) in self.model.policy.state_dict().items()
+        }
+        self._pending = (self.num_timesteps, parameters)
+        self._returns, self._lengths = [], []
+        for episodes in np.array_split(np.arange(self.n_eval_episodes), len(self._workers)):
+            if len(episodes) > 0:
+                self._tasks.put((self._evaluation, policy, len(episodes)))
+
+    def _collect(self, block: bool) -> None:
+        """Receive the results of the workers, and finish the evaluation once all its
+        episodes arrived
+
+        :param block: Wait for the running evaluation to finish, as long as the workers run
+        :type block: bool
+        """
+        while self._pending is not None:
+            try:
+                evaluation, returns, lengths = self._results.get(block=block, timeout=1.)
+            except queue.Empty:
+                # The workers aren't restarted anymore when the training ends
+                self._check_workers(restart=not block)
+                if block and self._pending is not None:
+                    continue
+                return
+            if evaluation != self._evaluation:
+                continue
+            self._returns.extend(returns)
+            self._lengths.extend(lengths)
+            if len(self._returns) == self.n_eval_episodes:
+                self._finish_evaluation()
+
+    def _finish_evaluation(self) -> None:
+        timesteps, parameters = self._pending
+        self._pending = None
+
+        self.evaluations_timesteps.append(timesteps)
+        self.evaluations_results.append(self._returns)
+        self.evaluations_length.append(self._lengths)
+        if self.log_path is not None:
+            np.savez(os.path.join(self.log_path, 'evaluations'),
+                     timesteps=self.evaluations_timesteps,
+                     results=self.evaluations_results,
+                     ep_lengths=self.evaluations_length)
+
+        mean_reward, std_reward = np.mean(self._returns), np.std(self._returns)
+        mean_ep_length = np.mean(self._lengths)
+        self.last_mean_reward = mean_reward
+        if self.verbose > 0:
+            print("Eval num_timesteps={}, episode_reward={:.2f} +/- {:.2f}".format(
+                timesteps, mean_reward, std_reward))
+            print("Episode length: {:.2f} +/- {:.2f}".format(mean_ep_length,
+                                                            np.std(self._lengths)))
+        logger.record("eval/mean_reward", float(mean_reward))
+        logger.record("eval/mean_ep_length", mean_ep_length)
+
+        if mean_reward > self.best_mean_reward:
+            if self.verbose > 0:
+                print("New best mean reward!")
+            self.best_mean_reward = mean_reward
+            if self.best_model_save_path is not None:
+                self._save_parameters(parameters)
+
+    def _save_parameters(self, parameters: Dict) -> None:
+        """Save the model with the parameters of the evaluated snapshot, the model has been
+        trained further since. It's written in the background, the training doesn't wait
+        for it.
+        """
+        save_model(self.model, os.path.join(self.best_model_save_path, 'best_model'),
+                   policy_parameters=parameters)
+
+    def _on_step(self) -> bool:
+        self._collect(block=False)
+        if self.eval_freq > 0 and self.n_calls % self.eval_freq == 0:
+            if self._pending is None:
+                self._start_evaluation()
+            elif self.verbose > 0:
+                print("Skipping the evaluation at {} timesteps, the previous one is still "
+                      "running".format(self.num_timesteps))
+        return True
+
+    def _on_training_end(self) -> None:
+        # Write the results of the last evaluation before stopping the workers
+        self._collect(block=True)
+        for _ in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join(timeout=WORKER_JOIN_TIMEOUT)
+            if worker.is_alive():
+                # E.g. a worker stuck in its Unity instance
+                worker.terminate()
+        self._workers = []
@@ -0,0 +1,173 @@
+"""
+Module used to train all stages of the folding process at once, each in its own process.
+Every stage publishes checkpoints of its model, which the later stages load as the evaluation
+model of that stage, such that they train on the start states the latest models reach.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import time
+from typing import List
+
+import gin
+from stable_baselines3 import DQN
+from stable_baselines3.common.callbacks import BaseCallback
+
+from utilities.baxter_state import BaxterState
+from utilities.checkpoint import save_model
+
+# The stages in the order of the folding process, every stage starts where the previous ended
+STAGES = [BaxterState.GRAB_CLOTH_1, BaxterState.FOLD_1, BaxterState.GRAB_CLOTH_2,
+          BaxterState.FOLD_2]
+# Offset between the worker ids of the Unity instances of the stages
+WORKER_ID_STRIDE = 100
+
+
+def checkpoint_file(folder: str, state: BaxterState) -> str:
+    """The file of the latest published checkpoint of a stage
+
+    :param folder: The folder of the pipeline
+    :type folder: str
+    :param state: The stage
+    :type state: BaxterState
+    :return: The path of the checkpoint
+    :rtype: str
+    """
+    return os.path.join(folder, '{}.zip'.format(BaxterState.to_csharp(state)))
+
+
+def _evaluation_load_name(state: BaxterState) -> str:
+    return 'eval_{}.load_name'.format(BaxterState.to_csharp(state).lower())
+
+
+def publish_checkpoint(model: DQN, path: str) -> None:
+    """Save a model at once, such that the other stages never load half a checkpoint. The
+    checkpoint is written in the background, the training continues meanwhile.
+
+    :param model: The model to save
+    :type model: DQN
+    :param path: The path of the checkpoint, ending in .zip
+    :type path: str
+    """
+    save_model(model, path)
+
+
+class CheckpointPublisher(BaseCallback):
+    """
+    Publishes the model being trained every ``publish_freq`` calls and at the end of the
+    training. When the stage has no checkpoint yet, the initial model is published, such that
+    the later stages can already start.
+    """
+
+    def __init__(self, path: str, publish_freq: int, verbose: int = 0):
+        """
+        :param path: The path of the checkpoint
+        :type path: str
+        :param publish_freq: Amount of calls between publishing a checkpoint
+        :type publish_freq: int
+        :param verbose: Print every published checkpoint when 1
+        :type verbose: int
+        """
+        super().__init__(verbose)
+        self.path = path
+        self.publish_freq = publish_freq
+
+    def _publish(self) -> None:
+        publish_checkpoint(self.model, self.path)
+        if self.verbose > 0:
+            print("Published {} at {} timesteps".format(self.path, self.num_timesteps))
+
+    def _on_training_start(self) -> None:
+        if not os.path.isfile(self.path):
+            self._publish()
+
+    def _on_step(self) -> bool:
+        if self.publish_freq > 0 and self.n_calls % self.publish_freq == 0:
+            self._publish()
+        return True
+
+    def _on_training_end(self) -> None:
+        self._publish()
+
+
+def seed_checkpoints(folder: str) -> None:
+    """Start the stages that have no checkpoint in the pipeline folder from their
+    configured evaluation model, when that exists
+
+    :param folder: The folder of the pipeline
+    :type folder: str
+    """
+    os.makedirs(folder, exist_ok=True)
+    for state in STAGES:
+        checkpoint = checkpoint_file(folder, state)
+        if os.path.isfile(checkpoint):
+            continue
+        try:
+            load_name = gin.query_parameter(_evaluation_load_name(state))
+        except ValueError:
+            continue
+        for path in (load_name, load_name + '.zip'):
+            if os.path.isfile(path):
+                print("Starting {} from {}".format(state, path))
+                shutil.copyfile(path, checkpoint)
+                break
+
+
+def configure_stage(folder: str, state: BaxterState) -> None:
+    """Let the evaluation models of the earlier stages be the checkpoints of the pipeline,
+    the ModelRegistry of the state manager reloads them when a newer checkpoint is published
+
+    :param folder: The folder of the pipeline
+    :type folder: str
+    :param state: The stage trained by this process
+    :type state: BaxterState
+    """
+    for upstream in STAGES[:STAGES.index(state)]:
+        gin.bind_parameter(_evaluation_load_name(upstream), checkpoint_file(folder, upstream))
+
+
+def wait_for_upstream(folder: str, state: BaxterState, poll_interval: float = 10.) -> None:
+    """Wait until every earlier stage published its first checkpoint
+
+    :param folder: The folder of the pipeline
+    :type folder: str
+    :param state: The stage trained by this process
+    :type state: BaxterState
+    :param poll_interval: Seconds between checking for the checkpoints
+    :type poll_interval: float
+    """
+    for upstream in STAGES[:STAGES.index(state)]:
+        while not os.path.isfile(checkpoint_file(folder, upstream)):
+            print("Waiting for the first checkpoint of {}".format(upstream))
+            time.sleep(poll_interval)
+
+
+def launch_stages(arguments: List[str], name: str) -> int:
+    """Run a training process per stage, with the given command line arguments of ``main.py``
+    and the stage, name and worker ids of the process appended
+
+    :param arguments: The command line arguments, e.g. the config and --pipeline
+    :type arguments: List[str]
+    :param name: The name of the training, suffixed with the stage per process
+    :type name: str
+    :return: The highest exit code of the processes
+    :rtype: int
+    """
+    processes = []
+    for index, state in enumerate(STAGES):
+        stage = BaxterState.to_csharp(state)
+        # argparse keeps the last occurrence of an argument, so these override the originals
+        processes.append(
+            subprocess.Popen([sys.executable, sys.argv[0]] + arguments + [
+                '--train', stage, '--name', '{}_{}'.format(name, stage), '--worker-offset',
+                str(index * WORKER_ID_STRIDE)
+            ]))
+    try:
+        return max(process.wait() for process in processes)
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        raise
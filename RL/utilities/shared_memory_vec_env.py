@@ -0,0 +1,348 @@
+"""
+Module used to run the workers of a vectorized environment in their own processes without
+pickling their observations. Every worker writes its masked observation, reward and done
+directly into preallocated slots of a ring in shared memory, and the training model reads them
+as NumPy views. Only the commands, the small info dictionaries and the rare calls like
+``get_attr`` go through the pipes of the workers.
+"""
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Type, Union
+
+import gym
+import numpy as np
+from stable_baselines3.common.env_util import is_wrapped
+from stable_baselines3.common.vec_env import VecEnv
+from stable_baselines3.common.vec_env.base_vec_env import (CloudpickleWrapper, VecEnvIndices,
+                                                           VecEnvStepReturn)
+
+
+class SharedBuffers:
+    """
+    The NumPy views of the shared memory of a SharedMemoryVecEnv. Every slot of the ring holds
+    the results of a step or reset of all workers, a worker only writes its own row.
+    """
+
+    def __init__(self, buffer: memoryview, num_envs: int, ring_size: int,
+                 observation_space: gym.spaces.Box, action_space: gym.spaces.Space):
+        """
+        :param buffer: The shared memory, of at least ``SharedBuffers.size`` bytes
+        :type buffer: memoryview
+        :param num_envs: The amount of workers
+        :type num_envs: int
+        :param ring_size: The amount of slots of the ring
+        :type ring_size: int
+        :param observation_space: The full observation space of a worker, the masked
+                                  observations are at most this size
+        :type observation_space: gym.spaces.Box
+        :param action_space: The action space of a worker
+        :type action_space: gym.spaces.Space
+        """
+        offset = 0
+        for name, shape, dtype in self.layout(num_envs, ring_size, observation_space,
+                                              action_space):
+            array = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+            setattr(self, name, array)
+            offset += _aligned(array.nbytes)
+
+    @staticmethod
+    def layout(num_envs: int, ring_size: int, observation_space: gym.spaces.Box,
+               action_space: gym.spaces.Space) -> List[Tuple[str, Tuple[int, ...], np.dtype]]:
+        """The name, shape and type of every array in the shared memory, in order
+
+        :return: The arrays of the shared memory
+        :rtype: List[Tuple[str, Tuple[int, ...], np.dtype]]
+        """
+        size = observation_space.shape[0]
+        return [
+            ('observations', (ring_size, num_envs, size), observation_space.dtype),
+            ('terminal_observations', (ring_size, num_envs, size), observation_space.dtype),
+            # The length of the masked observation and terminal observation of every row
+            ('lengths', (ring_size, num_envs, 2), np.int64),
+            ('rewards', (ring_size, num_envs), np.float64),
+            ('dones', (ring_size, num_envs), np.bool_),
+            ('actions', (num_envs,) + action_space.shape, action_space.dtype),
+        ]
+
+    @classmethod
+    def size(cls, *args) -> int:
+        """The amount of bytes of the shared memory, for the arguments of ``layout``
+
+        :return: The size of the shared memory
+        :rtype: int
+        """
+        return sum(
+            _aligned(int(np.prod(shape)) * np.dtype(dtype).itemsize)
+            for (_, shape, dtype) in cls.layout(*args))
+
+    def write(self, slot: int, index: int, observation: np.ndarray,
+              terminal_observation: Optional[np.ndarray] = None) -> None:
+        """Write the observation of a worker, and the last observation of its episode
+        when it's done
+
+        :param slot: The slot of the ring
+        :type slot: int
+        :param index: The index of the worker
+        :type index: int
+        :param observation: The masked observation
+        :type observation: np.ndarray
+        :param terminal_observation: The last observation of the episode that just ended
+        :type terminal_observation: Optional[np.ndarray]
+        """
+        self.observations[slot, index, :len(observation)] = observation
+        self.lengths[slot, index, 0] = len(observation)
+        if terminal_observation is not None:
+            self.terminal_observations[slot, index, :len(terminal_observation)] = \
+                terminal_observation
+            self.lengths[slot, index, 1] = len(terminal_observation)
+
+
+def _aligned(size: int) -> int:
+    """Round a size up to a multiple of 64 bytes, a cache line"""
+    return -(-size // 64) * 64
+
+
+def _worker(remote: Connection, parent_remote: Connection, index: int,
+            env_fn_wrapper: CloudpickleWrapper) -> None:
+    """Handle the commands of the SharedMemoryVecEnv, this runs in the process of a worker
+
+    :param remote: The pipe to the main process
+    :type remote: Connection
+    :param parent_remote: The end of the pipe of the main process, closed in the worker
+    :type parent_remote: Connection
+    :param index: The index of the worker, its row in the shared memory
+    :type index: int
+    :param env_fn_wrapper: The function creating the environment of the worker
+    :type env_fn_wrapper: CloudpickleWrapper
+    """
+    parent_remote.close()
+    env = env_fn_wrapper.var()
+    memory: Optional[shared_memory.SharedMemory] = None
+    buffers: Optional[SharedBuffers] = None
+    try:
+        while True:
+            command, data = remote.recv()
+            if command == 'step':
+                observation, reward, done, info = env.step(buffers.actions[index].copy())
+                terminal_observation = None
+                if done:
+                    terminal_observation, observation = observation, env.reset()
+                buffers.write(data, index, observation, terminal_observation)
+                buffers.rewards[data, index] = reward
+                buffers.dones[data, index] = done
+                # The steps of Unity hold the full observation once more, they're left out
+                info.pop('step', None)
+                remote.send(info)
+            elif command == 'reset':
+                buffers.write(data, index, env.reset())
+                remote.send(None)
+            elif command == 'get_spaces':
+                remote.send((env.observation_space, env.action_space))
+            elif command == 'attach':
+                name, layout = data
+                memory = shared_memory.SharedMemory(name=name)
+                buffers = SharedBuffers(memory.buf, *layout)
+                remote.send(None)
+            elif command == 'render':
+                remote.send(env.render(data))
+            elif command == 'seed':
+                remote.send(env.seed(data))
+            elif command == 'env_method':
+                method = getattr(env, data[0])
+                remote.send(method(*data[1], **data[2]))
+            elif command == 'get_attr':
+                remote.send(getattr(env, data))
+            elif command == 'set_attr':
+                remote.send(setattr(env, data[0], data[1]))
+            elif command == 'is_wrapped':
+                remote.send(is_wrapped(env, data))
+            elif command == 'close':
+                remote.close()
+                break
+            else:
+                raise NotImplementedError('`{}` is not implemented in the worker'.format(command))
+    except KeyboardInterrupt:
+        print('SharedMemoryVecEnv worker: got KeyboardInterrupt')
+    finally:
+        # The views have to be released before the shared memory can be closed
+        buffers = None
+        if memory is not None:
+            memory.close()
+        env.close()
+
+
+class SharedMemoryVecEnv(VecEnv):
+    """
+    A vectorized environment like the SubprocVecEnv of Stable Baselines, of which the workers
+    write their results into a ring of slots in shared memory. The observations, rewards and
+    dones returned by ``reset`` and ``step`` are views of a slot, they stay valid for the next
+    ``ring_size - 1`` steps, which is enough for the model to add the previous and the new
+    observation of a step to its replay buffer. Copy them to keep them any longer.
+
+    The workers never run ahead of the model: a worker only writes a slot when it's asked
+    for a step, and a slot is only handed out again once the model moved ``ring_size - 1``
+    slots further, so the slots the model still reads are never overwritten.
+
+    The workers mask their observations, so these can be smaller than the observation space
+    of the environments, but all workers have to return observations of the same size.
+    """
+
+    def __init__(self,
+                 env_fns: List[Callable[[], gym.Env]],
+                 start_method: Optional[str] = None,
+                 ring_size: int = 2):
+        """
+        :param env_fns: Functions creating the environments
+        :type env_fns: List[Callable[[], gym.Env]]
+        :param start_method: The multiprocessing start method of the worker processes,
+                             defaults to forkserver when available
+        :type start_method: Optional[str]
+        :param ring_size: The amount of slots of the ring, at least 2
+        :type ring_size: int
+        """
+        if ring_size < 2:
+            raise ValueError('The ring needs at least 2 slots, got {}'.format(ring_size))
+        self.waiting = False
+        self.closed = False
+        self.ring_size = ring_size
+        self.slot = ring_size - 1
+        self.memory: Optional[shared_memory.SharedMemory] = None
+        self.buffers: Optional[SharedBuffers] = None
+
+        if start_method is None:
+            # Fork isn't thread safe, forkserver is the safer default like in Stable Baselines
+            start_method = 'forkserver' if 'forkserver' in mp.get_all_start_methods() else \
+                'spawn'
+        context = mp.get_context(start_method)
+        self.remotes, work_remotes = zip(*[context.Pipe() for _ in env_fns])
+        self.processes = []
+        for index, (work_remote, remote, env_fn) in enumerate(
+                zip(work_remotes, self.remotes, env_fns)):
+            process = context.Process(target=_worker,
+                                      args=(work_remote, remote, index,
+                                            CloudpickleWrapper(env_fn)),
+                                      daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        self.remotes[0].send(('get_spaces', None))
+        observation_space, action_space = self.remotes[0].recv()
+        if not isinstance(observation_space, gym.spaces.Box) or \
+                len(observation_space.shape) != 1:
+            self.close()
+            raise ValueError('Only flat Box observations can be shared, got {}'.format(
+                observation_space))
+
+        layout = (len(env_fns), ring_size, observation_space, action_space)
+        self.memory = shared_memory.SharedMemory(create=True, size=SharedBuffers.size(*layout))
+        self.buffers = SharedBuffers(self.memory.buf, *layout)
+        for remote in self.remotes:
+            remote.send(('attach', (self.memory.name, layout)))
+        for remote in self.remotes:
+            remote.recv()
+        super().__init__(len(env_fns), observation_space, action_space)
+
+    def _next_slot(self) -> int:
+        self.slot = (self.slot + 1) % self.ring_size
+        return self.slot
+
+    def _observations(self, slot: int, column: int = 0) -> np.ndarray:
+        """The views of the observations of all workers in a slot"""
+        lengths = self.buffers.lengths[slot, :, column]
+        if (lengths != lengths[0]).any():
+            raise ValueError('The workers returned observations of different sizes: {}'.format(
+                lengths.tolist()))
+        return self.buffers.observations[slot, :, :lengths[0]]
+
+    def step_async(self, actions: np.ndarray) -> None:
+        self.buffers.actions[:] = actions
+        slot = self._next_slot()
+        for remote in self.remotes:
+            remote.send(('step', slot))
+        self.waiting = True
+
+    def step_wait(self) -> VecEnvStepReturn:
+        infos: List[Dict[str, Any]] = [remote.recv() for remote in self.remotes]
+        self.waiting = False
+        slot = self.slot
+        dones = self.buffers.dones[slot]
+        for index in np.flatnonzero(dones):
+            length = self.buffers.lengths[slot, index, 1]
+            infos[index]['terminal_observation'] = \
+                self.buffers.terminal_observations[slot, index, :length]
+        return self._observations(slot), self.buffers.rewards[slot], dones, infos
+
+    def reset(self) -> np.ndarray:
+        slot = self._next_slot()
+        for remote in self.remotes:
+            remote.send(('reset', slot))
+        for remote in self.remotes:
+            remote.recv()
+        return self._observations(slot)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        if self.waiting:
+            for remote in self.remotes:
+                remote.recv()
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for process in self.processes:
+            process.join()
+        self.closed = True
+        if self.memory is not None:
+            self.buffers = None
+            try:
+                self.memory.close()
+            except BufferError:
+                # The model still holds views of the last slots, the memory is unmapped
+                # once these are gone
+                pass
+            self.memory.unlink()
+
+    def get_images(self) -> Sequence[np.ndarray]:
+        for remote in self.remotes:
+            remote.send(('render', 'rgb_array'))
+        return [remote.recv() for remote in self.remotes]
+
+    def seed(self, seed: Optional[int] = None) -> List[Union[None, int]]:
+        for index, remote in enumerate(self.remotes):
+            remote.send(('seed', None if seed is None else seed + index))
+        return [remote.recv() for remote in self.remotes]
+
+    def _get_target_remotes(self, indices: VecEnvIndices) -> List[Connection]:
+        return [self.remotes[index] for index in self._get_indices(indices)]
+
+    def get_attr(self, attr_name: str, indices: VecEnvIndices = None) -> List[Any]:
+        target_remotes = self._get_target_remotes(indices)
+        for remote in target_remotes:
+            remote.send(('get_attr', attr_name))
+        return [remote.recv() for remote in target_remotes]
+
+    def set_attr(self, attr_name: str, value: Any, indices: VecEnvIndices = None) -> None:
+        target_remotes = self._get_target_remotes(indices)
+        for remote in target_remotes:
+            remote.send(('set_attr', (attr_name, value)))
+        for remote in target_remotes:
+            remote.recv()
+
+    def env_method(self,
+                   method_name: str,
+                   *method_args,
+                   indices: VecEnvIndices = None,
+                   **method_kwargs) -> List[Any]:
+        target_remotes = self._get_target_remotes(indices)
+        for remote in target_remotes:
+            remote.send(('env_method', (method_name, method_args, method_kwargs)))
+        return [remote.recv() for remote in target_remotes]
+
+    def env_is_wrapped(self,
+                       wrapper_class: Type[gym.Wrapper],
+                       indices: VecEnvIndices = None) -> List[bool]:
+        target_remotes = self._get_target_remotes(indices)
+        for remote in target_remotes:
+            remote.send(('is_wrapped', wrapper_class))
+        return [remote.recv() for remote in target_remotes]
@@ -0,0 +1,76 @@
+"""Module containing the cache of start states, used to skip replaying
+the evaluation models of the earlier states at every reset.
+"""
+from typing import Dict, List, Optional
+
+import gin
+import numpy as np
+
+from utilities.baxter_state import BaxterState
+
+
+@gin.configurable
+class StartStateCache:
+    """Keeps a pool of full observations per BaxterState, taken when the evaluation
+    models reached that state. An environment can restore such a snapshot instead of
+    replaying the earlier states. Part of the resets still replay the earlier states,
+    such that the pool keeps being refreshed with new start states.
+    """
+
+    def __init__(self, pool_size: int = 16, refresh_rate: float = 0.1):
+        """
+        :param pool_size: Amount of snapshots kept per state, 0 disables the cache
+        :type pool_size: int
+        :param refresh_rate: Fraction of the resets that replay the earlier states
+                             once the pool is full, to replace the oldest snapshot
+        :type refresh_rate: float
+        """
+        self.pool_size = pool_size
+        self.refresh_rate = refresh_rate
+
+        self.__pools: Dict[BaxterState, List[np.ndarray]] = {}
+        self.__oldest: Dict[BaxterState, int] = {}
+
+    def sample(self, state: BaxterState) -> Optional[np.ndarray]:
+        """Get a random snapshot of a state
+
+        :param state: The state the episode should start in
+        :type state: BaxterState
+        :return: The full observation of the snapshot, or None when the earlier
+                 states should be replayed to add a new snapshot
+        :rtype: Optional[np.ndarray]
+        """
+        pool = self.__pools.get(state, [])
+        if self.pool_size <= 0 or len(pool) < self.pool_size or \
+                np.random.random() < self.refresh_rate:
+            return None
+        return pool[np.random.randint(len(pool))]
+
+    def add(self, state: BaxterState, observation: np.ndarray) -> None:
+        """Store a snapshot, once the pool is full the oldest snapshot is replaced
+
+        :param state: The state that was reached
+        :type state: BaxterState
+        :param observation: The full observation when the state was reached
+        :type observation: np.ndarray
+        """
+        if self.pool_size <= 0:
+            return
+
+        pool = self.__pools.setdefault(state, [])
+        observation = np.array(observation, dtype=np.float32)
+        if len(pool) < self.pool_size:
+            pool.append(observation)
+        else:
+            oldest = self.__oldest.get(state, 0)
+            pool[oldest] = observation
+            self.__oldest[state] = (oldest + 1) % self.pool_size
+
+    def clear(self) -> None:
+        """Drop all snapshots, e.g. when the evaluation models that reached them changed
+        """
+        self.__pools.clear()
+        self.__oldest.clear()
+
+    def __len__(self) -> int:
+        return sum(len(pool) for pool in self.__pools.values())
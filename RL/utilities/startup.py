@@ -0,0 +1,105 @@
+"""
+Module used to start the training and evaluation quickly. The heavy frameworks are imported by a
+background thread while the main thread waits for the handshake with Unity, and the duration of
+every step of the startup is recorded for ``--profile-startup``.
+"""
+import contextlib
+import importlib
+import threading
+import time
+from typing import Iterator, List, Optional, Tuple
+
+
+class StartupProfiler:
+    """
+    Records the steps of the startup of the process, with the thread they ran on, such that
+    the report shows which steps overlap.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # The name, thread, start and end of every step, relative to the start of the profiler
+        self.steps: List[Tuple[str, str, float, float]] = []
+        self.__lock = threading.Lock()
+
+    def record(self, step: str, start: float, end: Optional[float] = None) -> None:
+        """Record a step that has finished
+
+        :param step: The name of the step
+        :type step: str
+        :param start: The ``time.perf_counter`` at the start of the step
+        :type start: float
+        :param end: The ``time.perf_counter`` at the end of the step, defaults to now
+        :type end: Optional[float]
+        """
+        end = time.perf_counter() if end is None else end
+        with self.__lock:
+            self.steps.append((step, threading.current_thread().name, start - self.start,
+                               end - self.start))
+
+    @contextlib.contextmanager
+    def measure(self, step: str) -> Iterator[None]:
+        """Record the duration of the body of the with statement as a step
+
+        :param step: The name of the step
+        :type step: str
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(step, start)
+
+    def report(self) -> str:
+        """The steps recorded so far, in the order they started
+
+        :return: A line per step with its start, duration and thread
+        :rtype: str
+        """
+        with self.__lock:
+            steps = sorted(self.steps, key=lambda step: step[2])
+        lines = ['{:>8s} {:>8s}  {:20s} {}'.format('start', 'duration', 'thread', 'step')]
+        lines.extend('{:7.2f}s {:7.2f}s  {:20s} {}'.format(start, end - start, thread, step)
+                     for (step, thread, start, end) in steps)
+        lines.append('{:7.2f}s since the startup began'.format(time.perf_counter() - self.start))
+        return '\n'.join(lines)
+
+
+# The profiler of this process, started when the first module imports this one
+profiler = StartupProfiler()
+
+
+class BackgroundImporter:
+    """
+    Imports modules in a background thread, e.g. PyTorch and Stable Baselines while Unity starts.
+    An import that fails is raised again by ``wait``.
+    """
+
+    def __init__(self, modules: List[str]):
+        """
+        :param modules: The names of the modules to import, in order
+        :type modules: List[str]
+        """
+        self.modules = modules
+        self.__error: Optional[BaseException] = None
+        self.__thread = threading.Thread(target=self.__run, name='background-imports',
+                                         daemon=True)
+        self.__thread.start()
+
+    def __run(self) -> None:
+        try:
+            for module in self.modules:
+                with profiler.measure('import {}'.format(module)):
+                    importlib.import_module(module)
+        except BaseException as error:  # pylint: disable=broad-except
+            self.__error = error
+
+    def wait(self) -> None:
+        """Wait until all modules are imported
+
+        :raises BaseException: The error of an import that failed
+        """
+        with profiler.measure('wait for the background imports'):
+            self.__thread.join()
+        if self.__error is not None:
+            raise self.__error
@@ -1,70 +1,28 @@
 """
 Module used to get the models for each step and for setting up the side channel with Unity.
 """
-from typing import Callable, Tuple, List
+from typing import TYPE_CHECKING, Any, Callable, Optional, Tuple, List, Type, Union
 import uuid
-from enum import Enum
 
 import gin
 from mlagents_envs.side_channel import SideChannel, IncomingMessage, OutgoingMessage
-from stable_baselines3 import DQN
 
-from baselines.custom_dqn_policies import AddaptedAdamDQNPolicy
-from utilities.filtered_wrapper import FilteredWrapper
-from utilities.volatile_space_gym_wrapper import VolatileSpaceUnityGymWrapper
+from utilities.baxter_state import BaxterState
+from utilities.model_registry import ModelRegistry
+from utilities.observation_mask import compile_mask
+from utilities.start_state_cache import StartStateCache
 import numpy as np
 
+if TYPE_CHECKING:
+    # Stable Baselines is only imported once a model is created, such that the configurables of
+    # this module can be parsed before PyTorch has been imported
+    from stable_baselines3 import DQN
+    from stable_baselines3.common.vec_env import VecEnv
+    from utilities.volatile_space_gym_wrapper import VolatileSpaceUnityGymWrapper
 
-class BaxterState(Enum):
-    """
-    Enum class for the different steps of the reinforcement learning.
-    """
-    GRAB_CLOTH_1 = 1
-    FOLD_1 = 2
-    GRAB_CLOTH_2 = 3
-    FOLD_2 = 4
-
-    @staticmethod
-    def from_str(label: str):
-        """Returns the correct Enum based on the given string
-
-        :param label: Name of state
-        :type label: str
-        :raises ValueError: Thrown when unknown state is given as label
-        :return: Enum of the state
-        :rtype: BaxterState
-        """
-        if label == "GrabCloth1":
-            return BaxterState.GRAB_CLOTH_1
-        elif label == "Fold1":
-            return BaxterState.FOLD_1
-        elif label == "GrabCloth2":
-            return BaxterState.GRAB_CLOTH_2
-        elif label == "Fold2":
-            return BaxterState.FOLD_2
-        else:
-            raise ValueError
-
-    @staticmethod
-    def to_csharp(label) -> str:
-        """Returns the correct string based on the given enum value
-
-        :param label: enum value
-        :type label: BaxterState
-        :raises NotImplementedError: Thrown when unknown enum value is given
-        :return: String representing the enum value
-        :rtype: str
-        """
-        if label == BaxterState.GRAB_CLOTH_1:
-            return "GrabCloth1"
-        elif label == BaxterState.FOLD_1:
-            return "Fold1"
-        elif label == BaxterState.GRAB_CLOTH_2:
-            return "GrabCloth2"
-        elif label == BaxterState.FOLD_2:
-            return "Fold2"
-        else:
-            raise NotImplementedError
+# The types of the messages sent to Unity over the state side channel
+TRAIN_STATE_MESSAGE = 0
+SNAPSHOT_MESSAGE = 1
 
 
 class StateChannel(SideChannel):
@@ -76,6 +34,9 @@ class StateChannel(SideChannel):
 
     For example, when the first fold is completed this channel
     will be used to reconfigure the Unity environment for the next step.
+
+    The messages are binary, the states are sent as their values in ``BaxterState``. Unity
+    sends the state it moved to together with its episode and step, at most once per step.
     """
 
     def __init__(self, state_manager) -> None:
@@ -86,51 +47,84 @@ class StateChannel(SideChannel):
 
     def on_message_received(self, msg: IncomingMessage) -> None:
         """
-        When a message is received, Unity is letting us know which state to move on to
+        When a message is received, Unity is letting us know which state to move on to. This
+        is called while exchanging a step with Unity, so the state manager only moves to the
+        state once the step is done.
         """
-        message = msg.read_string()
-        self.state_manager.set_state(BaxterState.from_str(message))
+        state, episode, step = msg.read_int32(), msg.read_int32(), msg.read_int32()
+        self.state_manager.post_state(BaxterState(state), episode, step)
 
-    def send_string(self, data: str) -> None:
-        """This message is used to pass a
-        string  message to Unity
+    def send_train_state(self, state: BaxterState) -> None:
+        """Let Unity know which state is trained, so it can end the episode after this state
 
-        :param data: The message to be passed to Unity.
-        :type data: str
+        :param state: The trained state
+        :type state: BaxterState
         """
-        # Add the string to an OutgoingMessage
         msg = OutgoingMessage()
-        msg.write_string(BaxterState.to_csharp(data))
+        msg.write_int32(TRAIN_STATE_MESSAGE)
+        msg.write_int32(state.value)
         # We call this method to queue the data we want to send
         super().queue_message_to_send(msg)
 
+    def send_snapshot(self, state: BaxterState, observation: np.ndarray) -> None:
+        """Let Unity restore a start state at the beginning of the next episode,
+        this message has to be sent before resetting the environment.
+
+        :param state: The state of the snapshot
+        :type state: BaxterState
+        :param observation: The full observation when the state was reached
+        :type observation: np.ndarray
+        """
+        msg = OutgoingMessage()
+        msg.write_int32(SNAPSHOT_MESSAGE)
+        msg.write_int32(state.value)
+        msg.write_float32_list(observation.tolist())
+        super().queue_message_to_send(msg)
+
 
 class StateManager:
     """
     This class manages the env based on the state of the training.
     """
 
-    def __init__(self, train_state=None):
+    def __init__(self, train_state=None, build_train_model=True):
+        """
+        :param train_state: The state of the model to be trained, None when evaluating
+        :type train_state: BaxterState
+        :param build_train_model: Whether to create the training model, the workers of a
+                                  vectorized environment only need its observation range
+        :type build_train_model: bool
+        """
         self.env = None
-        self.eval_model = None
+        self.eval_policy = None  # greedy inference engine of the eval model
         self.curr_state = None
         self.train_state = train_state  # the model to be trained
+        self.build_train_model = build_train_model
 
         self.__is_env_loaded = False
-        self.__await_state = None
+        # The latest state posted by Unity, with its episode and step
+        self.__pending_state: Optional[Tuple[BaxterState, int, int]] = None
+        # The episode and step of Unity when it moved to the current state
+        self.curr_episode = None
+        self.curr_step = None
 
         # The following attributes are initialised to None to comply to the linter
         self.train_model = None
         self.train_observation_mask = None
         self.train_observation_range = []
 
+        # Start states reached by the evaluation models, to skip them on the next resets
+        self.start_states = StartStateCache()
+
         self.evaluation_model_creator = {
             BaxterState.GRAB_CLOTH_1: eval_grabcloth1,
             BaxterState.FOLD_1: eval_fold1,
             BaxterState.GRAB_CLOTH_2: eval_grabcloth2,
             BaxterState.FOLD_2: eval_fold2
         }
-        self.evaluation_models = {}
+        # The inference engines of the evaluation models, reloaded when their file changes
+        self.models = ModelRegistry()
+        self.evaluation_policies = {}
         self.eval_observation_ranges = {}
 
         self.training_model_creator = {
@@ -140,6 +134,36 @@ class StateManager:
             BaxterState.FOLD_2: train_fold2
         }
 
+        # Load the models of the states before the trained state in the background, while the
+        # environment is still starting
+        self.models.prefetch(
+            self.__evaluation_config(state)[0] for state in self.evaluation_model_creator
+            if self.train_state is None or state.value < self.train_state.value)
+
+    def post_state(self, state: BaxterState, episode: int = -1, step: int = -1) -> None:
+        """Move to a state by the next ``apply_pending_state``, without doing any work yet.
+        The states posted before it are dropped, only the latest one is applied.
+
+        :param state: The state Unity moved to
+        :type state: BaxterState
+        :param episode: The episode of Unity in which it moved to the state
+        :type episode: int
+        :param step: The step of Unity in the episode
+        :type step: int
+        """
+        self.__pending_state = (state, episode, step)
+
+    def apply_pending_state(self) -> None:
+        """Move to the latest posted state, if any. The environment calls this after every
+        step and reset, such that the observation range and the evaluation model are changed
+        outside the handling of the messages of Unity.
+        """
+        if self.__pending_state is None or not self.__is_env_loaded:
+            return
+        state, self.curr_episode, self.curr_step = self.__pending_state
+        self.__pending_state = None
+        self.set_state(state)
+
     def set_state(self, state: BaxterState) -> None:
         """Sets the current state
 
@@ -147,28 +171,36 @@ class StateManager:
         :type state: BaxterState
         """
         if not self.__is_env_loaded:  # if environment not available yet
-            self.__await_state = state
+            self.post_state(state)
             return
 
         if self.curr_state == state:
-            print(self.curr_state)
-            print("already in state")
             return
 
-        print("New state: ", state)
         self.curr_state = state
-        print(self.curr_state)
 
         if state != self.train_state:
-            if state not in self.evaluation_models:
-                (self.evaluation_models[state], self.eval_observation_ranges[state]) \
-                    = self.evaluation_model_creator[state](self.env)
-            self.eval_model = self.evaluation_models[state]
+            load_name, self.eval_observation_ranges[state] = self.__evaluation_config(state)
+            policy = self.models.get(load_name)
+            if state in self.evaluation_policies and policy is not self.evaluation_policies[state]:
+                # The start states were reached by the previous version of the model
+                print("Reloaded the evaluation model of {}".format(state))
+                self.start_states.clear()
+            self.evaluation_policies[state] = policy
+            self.eval_policy = policy
             self.env.set_observation_range(self.eval_observation_ranges[state])
         else:
-            self.eval_model = None
+            self.eval_policy = None
             self.env.set_observation_range(self.train_observation_range)
 
+    def __evaluation_config(self, state: BaxterState) -> Tuple[str, List[Tuple[int, int]]]:
+        """The file and the observation range of the evaluation model of a state, as
+        configured for its ``eval_*`` function
+        """
+        name = self.evaluation_model_creator[state].__name__
+        return (gin.query_parameter('{}.load_name'.format(name)),
+                gin.query_parameter('{}.observation_range'.format(name)))
+
     def initialize_env(self, env) -> None:
         """Initialize the environment in the correct state
         :param env: The current environment
@@ -176,20 +208,25 @@ class StateManager:
         """
         self.env = env
 
-        self.train_model, self.train_observation_range = \
-            (None, None) if self.train_state is None \
-            else self.training_model_creator[self.train_state](env)
-        self.train_observation_mask = None if self.train_model is None else \
-            np.concatenate([range(start, stop) for (start, stop) in self.train_observation_range])
+        if self.train_state is None:
+            self.train_model, self.train_observation_range = None, None
+        elif self.build_train_model:
+            self.train_model, self.train_observation_range = \
+                self.training_model_creator[self.train_state](env)
+        else:
+            creator = self.training_model_creator[self.train_state]
+            self.train_observation_range = gin.query_parameter(
+                '{}.observation_range'.format(creator.__name__))
+        self.train_observation_mask = None if self.train_observation_range is None else \
+            compile_mask(self.train_observation_range)
 
         self.__is_env_loaded = True
-        self.set_state(self.__await_state)
-        self.__await_state = None
+        self.apply_pending_state()
 
 
 @gin.configurable
 def eval_grabcloth1(env, observation_range: List[Tuple[int, int]],
-                    load_name: str) -> Tuple[DQN, List[Tuple[int, int]]]:
+                    load_name: str) -> Tuple['DQN', List[Tuple[int, int]]]:
     """Gets the model and observation range for evaluating GrabCloth1
 
     :param env: Unity environment to evaluate on
@@ -204,13 +241,17 @@ def eval_grabcloth1(env, observation_range: List[Tuple[int, int]],
         model : the training model for GrabCloth1
         observation_range : specifies which observations are used in this model
     """
+    # pylint: disable=import-outside-toplevel
+    from stable_baselines3 import DQN
+    from utilities.filtered_wrapper import FilteredWrapper
+
     model = DQN.load(load_name, env=FilteredWrapper(env, observation_range))
     return model, observation_range
 
 
 @gin.configurable
 def eval_fold1(env, observation_range: List[Tuple[int, int]],
-               load_name: str) -> Tuple[DQN, List[Tuple[int, int]]]:
+               load_name: str) -> Tuple['DQN', List[Tuple[int, int]]]:
     """Gets the model and observation range for evaluating Fold1
 
     :param env: Unity environment to evaluate on
@@ -225,13 +266,17 @@ def eval_fold1(env, observation_range: List[Tuple[int, int]],
         model : the training model for Fold1
         observation_range : specifies which observations are used in this model
     """
+    # pylint: disable=import-outside-toplevel
+    from stable_baselines3 import DQN
+    from utilities.filtered_wrapper import FilteredWrapper
+
     model = DQN.load(load_name, env=FilteredWrapper(env, observation_range))
     return model, observation_range
 
 
 @gin.configurable
 def eval_grabcloth2(env, observation_range: List[Tuple[int, int]],
-                    load_name: str) -> Tuple[DQN, List[Tuple[int, int]]]:
+                    load_name: str) -> Tuple['DQN', List[Tuple[int, int]]]:
     """Gets the model and observation range for evaluating GrabCloth2
 
     :param env: Unity environment to evaluate on
@@ -246,13 +291,17 @@ def eval_grabcloth2(env, observation_range: List[Tuple[int, int]],
         model : the training model for GrabCloth2
         observation_range : specifies which observations are used in this model
     """
+    # pylint: disable=import-outside-toplevel
+    from stable_baselines3 import DQN
+    from utilities.filtered_wrapper import FilteredWrapper
+
     model = DQN.load(load_name, env=FilteredWrapper(env, observation_range))
     return model, observation_range
 
 
 @gin.configurable
 def eval_fold2(env, observation_range: List[Tuple[int, int]],
-               load_name: str) -> Tuple[DQN, List[Tuple[int, int]]]:
+               load_name: str) -> Tuple['DQN', List[Tuple[int, int]]]:
     """Gets the model and observation range for evaluating Fold2
 
     :param env: Unity environment to evaluate on
@@ -267,23 +316,28 @@ def eval_fold2(env, observation_range: List[Tuple[int, int]],
         model : the training model for Fold2
         observation_range : specifies which observations are used in this model
     """
+    # pylint: disable=import-outside-toplevel
+    from stable_baselines3 import DQN
+    from utilities.filtered_wrapper import FilteredWrapper
+
     model = DQN.load(load_name, env=FilteredWrapper(env, observation_range))
     return model, observation_range
 
 
 @gin.configurable
-def train_grabcloth1(env: VolatileSpaceUnityGymWrapper,
+def train_grabcloth1(env: 'VolatileSpaceUnityGymWrapper',
                      observation_range: List[Tuple[int, int]], verbose: int,
                      gamma: float, batch_size: int, buffer_size: int,
                      learning_starts: int, learning_rate: float,
                      exploration_fraction: float,
                      exploration_initial_eps: float,
                      exploration_final_eps: float, target_update_interval: int,
-                     tensorboard_log: str) -> Tuple[DQN, List[Tuple[int, int]]]:
+                     tensorboard_log: str,
+                     prioritized_replay: bool = False) -> Tuple['DQN', List[Tuple[int, int]]]:
     """Gets the model and observation range for training GrabCloth1
 
-    :param env: Unity environment to evaluate on
-    :type env: UnityToGymWrapper
+    :param env: Unity environment to train on, either a single or a vectorized one
+    :type env: Union[UnityToGymWrapper, VecEnv]
     :param observation_range: The range of observations that is used to
                             train this model based on the observations
                             received from the Unity side
@@ -311,40 +365,44 @@ def train_grabcloth1(env: VolatileSpaceUnityGymWrapper,
     :type target_update_interval: int
     :param tensorboard_log: Path determining where to store the TensorBoard logs
     :type tensorboard_log: str
+    :param prioritized_replay: Replay the experiences proportional to their TD error,
+                               configured through ``PrioritizedReplayBuffer``
+    :type prioritized_replay: bool
 
     :return:
         model : the training model for GrabCloth1
         observation_range : specifies which observations are used in this model
     """
-
-    model = DQN(AddaptedAdamDQNPolicy,
-                env=FilteredWrapper(env, observation_range),
-                verbose=verbose,
-                gamma=gamma,
-                batch_size=batch_size,
-                buffer_size=buffer_size,
-                learning_starts=learning_starts,
-                learning_rate=learning_rate,
-                exploration_fraction=exploration_fraction,
-                exploration_initial_eps=exploration_initial_eps,
-                exploration_final_eps=exploration_final_eps,
-                target_update_interval=target_update_interval,
-                tensorboard_log=tensorboard_log)
+    model = _create_model(env,
+                          observation_range,
+                          prioritized_replay,
+                          verbose=verbose,
+                          gamma=gamma,
+                          batch_size=batch_size,
+                          buffer_size=buffer_size,
+                          learning_starts=learning_starts,
+                          learning_rate=learning_rate,
+                          exploration_fraction=exploration_fraction,
+                          exploration_initial_eps=exploration_initial_eps,
+                          exploration_final_eps=exploration_final_eps,
+                          target_update_interval=target_update_interval,
+                          tensorboard_log=tensorboard_log)
     return model, observation_range
 
 
 @gin.configurable
-def train_fold1(env: VolatileSpaceUnityGymWrapper,
+def train_fold1(env: 'VolatileSpaceUnityGymWrapper',
                 observation_range: List[Tuple[int, int]], verbose: int,
                 gamma: float, batch_size: int, buffer_size: int,
                 learning_starts: int, learning_rate: float,
                 exploration_fraction: float, exploration_initial_eps: float,
                 exploration_final_eps: float, target_update_interval: int,
-                tensorboard_log: str) -> Tuple[DQN, List[Tuple[int, int]]]:
+                tensorboard_log: str,
+                prioritized_replay: bool = False) -> Tuple['DQN', List[Tuple[int, int]]]:
     """Gets the model and observation range for training Fold1
 
-    :param env: Unity environment to evaluate on
-    :type env: UnityToGymWrapper
+    :param env: Unity environment to train on, either a single or a vectorized one
+    :type env: Union[UnityToGymWrapper, VecEnv]
     :param observation_range: The range of observations that is used to
                             train this model based on the observations
                             received from the Unity side
@@ -372,40 +430,45 @@ def train_fold1(env: VolatileSpaceUnityGymWrapper,
     :type target_update_interval: int
     :param tensorboard_log: Path determining where to store the TensorBoard logs
     :type tensorboard_log: str
+    :param prioritized_replay: Replay the experiences proportional to their TD error,
+                               configured through ``PrioritizedReplayBuffer``
+    :type prioritized_replay: bool
 
     :return:
         model : the training model for Fold1
         observation_range : specifies which observations are used in this model
     """
-    model = DQN(AddaptedAdamDQNPolicy,
-                env=FilteredWrapper(env, observation_range),
-                verbose=verbose,
-                gamma=gamma,
-                batch_size=batch_size,
-                buffer_size=buffer_size,
-                learning_starts=learning_starts,
-                learning_rate=learning_rate,
-                exploration_fraction=exploration_fraction,
-                exploration_initial_eps=exploration_initial_eps,
-                exploration_final_eps=exploration_final_eps,
-                target_update_interval=target_update_interval,
-                tensorboard_log=tensorboard_log)
+    model = _create_model(env,
+                          observation_range,
+                          prioritized_replay,
+                          verbose=verbose,
+                          gamma=gamma,
+                          batch_size=batch_size,
+                          buffer_size=buffer_size,
+                          learning_starts=learning_starts,
+                          learning_rate=learning_rate,
+                          exploration_fraction=exploration_fraction,
+                          exploration_initial_eps=exploration_initial_eps,
+                          exploration_final_eps=exploration_final_eps,
+                          target_update_interval=target_update_interval,
+                          tensorboard_log=tensorboard_log)
     return model, observation_range
 
 
 @gin.configurable
-def train_grabcloth2(env: VolatileSpaceUnityGymWrapper,
+def train_grabcloth2(env: 'VolatileSpaceUnityGymWrapper',
                      observation_range: List[Tuple[int, int]], verbose: int,
                      gamma: float, batch_size: int, buffer_size: int,
                      learning_starts: int, learning_rate: float,
                      exploration_fraction: float,
                      exploration_initial_eps: float,
                      exploration_final_eps: float, target_update_interval: int,
-                     tensorboard_log: str) -> Tuple[DQN, List[Tuple[int, int]]]:
+                     tensorboard_log: str,
+                     prioritized_replay: bool = False) -> Tuple['DQN', List[Tuple[int, int]]]:
     """Gets the model and observation range for training GrabCloth2
 
-    :param env: Unity environment to evaluate on
-    :type env: UnityToGymWrapper
+    :param env: Unity environment to train on, either a single or a vectorized one
+    :type env: Union[UnityToGymWrapper, VecEnv]
     :param observation_range: The range of observations that is used to
                             train this model based on the observations
                             received from the Unity side
@@ -433,39 +496,44 @@ def train_grabcloth2(env: VolatileSpaceUnityGymWrapper,
     :type target_update_interval: int
     :param tensorboard_log: Path determining where to store the TensorBoard logs
     :type tensorboard_log: str
+    :param prioritized_replay: Replay the experiences proportional to their TD error,
+                               configured through ``PrioritizedReplayBuffer``
+    :type prioritized_replay: bool
 
     :return:
         model : the training model for GrabCloth2
         observation_range : specifies which observations are used in this model
     """
-    model = DQN(AddaptedAdamDQNPolicy,
-                env=FilteredWrapper(env, observation_range),
-                verbose=verbose,
-                gamma=gamma,
-                batch_size=batch_size,
-                buffer_size=buffer_size,
-                learning_starts=learning_starts,
-                learning_rate=learning_rate,
-                exploration_fraction=exploration_fraction,
-                exploration_initial_eps=exploration_initial_eps,
-                exploration_final_eps=exploration_final_eps,
-                target_update_interval=target_update_interval,
-                tensorboard_log=tensorboard_log)
+    model = _create_model(env,
+                          observation_range,
+                          prioritized_replay,
+                          verbose=verbose,
+                          gamma=gamma,
+                          batch_size=batch_size,
+                          buffer_size=buffer_size,
+                          learning_starts=learning_starts,
+                          learning_rate=learning_rate,
+                          exploration_fraction=exploration_fraction,
+                          exploration_initial_eps=exploration_initial_eps,
+                          exploration_final_eps=exploration_final_eps,
+                          target_update_interval=target_update_interval,
+                          tensorboard_log=tensorboard_log)
     return model, observation_range
 
 
 @gin.configurable
-def train_fold2(env: VolatileSpaceUnityGymWrapper,
+def train_fold2(env: 'VolatileSpaceUnityGymWrapper',
                 observation_range: List[Tuple[int, int]], verbose: int,
                 gamma: float, batch_size: int, buffer_size: int,
                 learning_starts: int, learning_rate: float,
                 exploration_fraction: float, exploration_initial_eps: float,
                 exploration_final_eps: float, target_update_interval: int,
-                tensorboard_log: str) -> Tuple[DQN, List[Tuple[int, int]]]:
+                tensorboard_log: str,
+                prioritized_replay: bool = False) -> Tuple['DQN', List[Tuple[int, int]]]:
     """Gets the model and observation range for training Fold2
 
-    :param env: Unity environment to evaluate on
-    :type env: UnityToGymWrapper
+    :param env: Unity environment to train on, either a single or a vectorized one
+    :type env: Union[UnityToGymWrapper, VecEnv]
     :param observation_range: The range of observations that is used to
                             train this model based on the observations
                             received from the Unity side
@@ -493,28 +561,79 @@ def train_fold2(env: VolatileSpaceUnityGymWrapper,
     :type target_update_interval: int
     :param tensorboard_log: Path determining where to store the TensorBoard logs
     :type tensorboard_log: str
+    :param prioritized_replay: Replay the experiences proportional to their TD error,
+                               configured through ``PrioritizedReplayBuffer``
+    :type prioritized_replay: bool
 
     :return:
         model : the training model for Fold2
         observation_range : specifies which observations are used in this model
     """
-
-    model = DQN(AddaptedAdamDQNPolicy,
-                env=FilteredWrapper(env, observation_range),
-                verbose=verbose,
-                gamma=gamma,
-                batch_size=batch_size,
-                buffer_size=buffer_size,
-                learning_starts=learning_starts,
-                learning_rate=learning_rate,
-                exploration_fraction=exploration_fraction,
-                exploration_initial_eps=exploration_initial_eps,
-                exploration_final_eps=exploration_final_eps,
-                target_update_interval=target_update_interval,
-                tensorboard_log=tensorboard_log)
+    model = _create_model(env,
+                          observation_range,
+                          prioritized_replay,
+                          verbose=verbose,
+                          gamma=gamma,
+                          batch_size=batch_size,
+                          buffer_size=buffer_size,
+                          learning_starts=learning_starts,
+                          learning_rate=learning_rate,
+                          exploration_fraction=exploration_fraction,
+                          exploration_initial_eps=exploration_initial_eps,
+                          exploration_final_eps=exploration_final_eps,
+                          target_update_interval=target_update_interval,
+                          tensorboard_log=tensorboard_log)
     return model, observation_range
 
 
+def _create_model(env: Union['VolatileSpaceUnityGymWrapper', 'VecEnv'],
+                  observation_range: List[Tuple[int, int]], prioritized_replay: bool,
+                  **kwargs: Any) -> 'DQN':
+    """Create the DQN of a training function, with the adapted Adam policy on the filtered
+    observations of the environment
+
+    :param env: The environment to train on
+    :type env: Union[UnityToGymWrapper, VecEnv]
+    :param observation_range: The range of observations used by the model
+    :type observation_range: List[Tuple[int, int]]
+    :param prioritized_replay: Whether to use prioritized experience replay
+    :type prioritized_replay: bool
+    :param kwargs: The hyperparameters of the DQN
+    :return: The model
+    :rtype: DQN
+    """
+    # pylint: disable=import-outside-toplevel
+    from baselines.custom_dqn_policies import AddaptedAdamDQNPolicy
+    from utilities.filtered_wrapper import filter_env
+
+    dqn = _dqn_class(env, prioritized_replay)
+    return dqn(AddaptedAdamDQNPolicy, env=filter_env(env, observation_range), **kwargs)
+
+
+def _dqn_class(env: Union['VolatileSpaceUnityGymWrapper', 'VecEnv'],
+               prioritized_replay: bool = False) -> Type['DQN']:
+    """Select the DQN implementation able to collect experiences from the given environment
+
+    :param env: The environment to train on
+    :type env: Union[UnityToGymWrapper, VecEnv]
+    :param prioritized_replay: Whether to use prioritized experience replay
+    :type prioritized_replay: bool
+    :return: VecDQN for vectorized environments with multiple workers, DQN otherwise,
+             or their prioritized variants
+    :rtype: Type[DQN]
+    """
+    # pylint: disable=import-outside-toplevel
+    from stable_baselines3 import DQN
+    from stable_baselines3.common.vec_env import VecEnv
+    from baselines.prioritized_dqn import PrioritizedDQN, PrioritizedVecDQN
+    from baselines.vec_dqn import VecDQN
+
+    vectorized = isinstance(env, VecEnv) and env.num_envs > 1
+    if prioritized_replay:
+        return PrioritizedVecDQN if vectorized else PrioritizedDQN
+    return VecDQN if vectorized else DQN
+
+
 def linear_schedule(initial_value: float) -> Callable[[float], float]:
     """
     Linear learning rate.
@@ -0,0 +1,267 @@
+"""
+Module used to find out where the time of a training step goes. The methods of the phases of a
+step (the simulation, masking the observation, the state messages from Unity, ``predict`` and
+``train`` of the model, ...) are wrapped by timers only when profiling, so the training doesn't
+pay anything for the profiler when it's disabled. The durations are kept in histograms per phase
+and per state, which give the percentiles in TensorBoard and in a summary at the end.
+"""
+import csv
+import functools
+import json
+import math
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import gin
+import numpy as np
+from stable_baselines3.common import logger
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.vec_env import VecEnv
+
+from utilities.baxter_state import BaxterState
+
+# The histograms have 20 bins per decade, every bin is 12% wider than the previous one,
+# covering durations of 1 nanosecond up to 1000 seconds
+BINS_PER_DECADE = 20
+BINS = 12 * BINS_PER_DECADE + 1
+# The percentiles reported in TensorBoard and in the summary
+PERCENTILES = (50, 90, 99)
+
+
+class StepProfiler:
+    """
+    Keeps a histogram of the durations of every phase, per state the phase started in.
+    The methods of a phase are timed by replacing them on the instance with ``instrument``.
+    """
+
+    def __init__(self, state_fn: Callable[[], Optional[BaxterState]]):
+        """
+        :param state_fn: Returns the current state, which labels the measured durations
+        :type state_fn: Callable[[], Optional[BaxterState]]
+        """
+        self.state_fn = state_fn
+        # Per phase and state: the counts of the bins, the total and the longest duration
+        self.histograms: Dict[Tuple[str, Optional[BaxterState]], List] = {}
+
+    def record(self, phase: str, state: Optional[BaxterState], duration: int) -> None:
+        """Add a duration to the histogram of a phase
+
+        :param phase: The phase
+        :type phase: str
+        :param state: The state the phase started in
+        :type state: Optional[BaxterState]
+        :param duration: The duration in nanoseconds
+        :type duration: int
+        """
+        histogram = self.histograms.get((phase, state))
+        if histogram is None:
+            histogram = self.histograms[(phase, state)] = [np.zeros(BINS, dtype=np.int64), 0, 0]
+        index = int(math.log10(duration) * BINS_PER_DECADE) if duration > 1 else 0
+        histogram[0][min(index, BINS - 1)] += 1
+        histogram[1] += duration
+        histogram[2] = max(histogram[2], duration)
+
+    def instrument(self, obj: Any, method: str, phase: str) -> None:
+        """Time every call of a method of an object as a phase, by replacing the method on
+        the instance. Calls through the instance, including ``self.method`` in the class
+        itself, are timed.
+
+        :param obj: The object
+        :type obj: Any
+        :param method: The name of the method
+        :type method: str
+        :param phase: The phase of the calls
+        :type phase: str
+        """
+        function = getattr(obj, method)
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            state = self.state_fn()
+            start = time.perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(phase, state, time.perf_counter_ns() - start)
+
+        setattr(obj, method, timed)
+
+    def summary(self,
+                counts: Optional[Dict[Tuple[str, Optional[BaxterState]], np.ndarray]] = None
+                ) -> List[Dict[str, Any]]:
+        """The statistics of every phase per state, in milliseconds
+
+        :param counts: Only summarize these counts of the bins, e.g. the difference with an
+                       earlier copy of the histograms, all durations when None
+        :type counts: Optional[Dict[Tuple[str, Optional[BaxterState]], np.ndarray]]
+        :return: Per phase and state its count, mean, percentiles and maximum
+        :rtype: List[Dict[str, Any]]
+        """
+        rows = []
+        for (phase, state), (bins, total, longest) in sorted(self.histograms.items(),
+                                                              key=lambda item: str(item[0])):
+            if counts is not None:
+                bins = counts[(phase, state)]
+            count = int(bins.sum())
+            if count == 0:
+                continue
+            row = {'state': _state_name(state), 'phase': phase, 'count': count}
+            if counts is None:
+                row['mean_ms'] = total / count / 1e6
+            cumulative = np.cumsum(bins)
+            for percentile in PERCENTILES:
+                index = int(np.searchsorted(cumulative, count * percentile / 100))
+                # The geometric middle of the bin
+                row['p{}_ms'.format(percentile)] = 10**((index + .5) / BINS_PER_DECADE) / 1e6
+            if counts is None:
+                row['max_ms'] = longest / 1e6
+            rows.append(row)
+        return rows
+
+    def counts(self) -> Dict[Tuple[str, Optional[BaxterState]], np.ndarray]:
+        """A copy of the counts of the bins of every histogram
+
+        :return: The counts per phase and state
+        :rtype: Dict[Tuple[str, Optional[BaxterState]], np.ndarray]
+        """
+        return {key: histogram[0].copy() for (key, histogram) in self.histograms.items()}
+
+    def write(self, folder: str) -> None:
+        """Write the summary of all durations to ``step_profile.csv`` and ``step_profile.json``
+
+        :param folder: The folder to write the summary in
+        :type folder: str
+        """
+        rows = self.summary()
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, 'step_profile.json'), 'w') as file:
+            json.dump(rows, file, indent=2)
+        with open(os.path.join(folder, 'step_profile.csv'), 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=list(rows[0]) if rows else ['phase'])
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def _state_name(state: Optional[BaxterState]) -> str:
+    return 'Unknown' if state is None else BaxterState.to_csharp(state)
+
+
+def instrument_training(profiler: StepProfiler, model: Any, env: Any,
+                        state_channel: Any = None) -> None:
+    """Time the phases of a training step, the ``train`` phase is timed by the
+    ``StepProfilerCallback``:
+
+    - ``predict``: the Q-network choosing the actions of a step
+    - ``env_step``: a step of the environment, including its simulation and observation mask
+    - ``simulation``: the exchange with Unity, which includes its physics ticks and the
+      handling of its messages, or the physics of the headless simulation
+    - ``observation_mask``: masking the observation of a step
+    - ``side_channel``: receiving a state message of Unity
+    - ``state_transition``: moving to the state of that message after the step, e.g. switching
+      to the evaluation model of the state
+    - ``reset``: a reset, including the replay of the earlier stages, of which the steps are
+      also timed with the state they were replayed in
+
+    The workers of a vectorized environment run in their own processes, then only the step
+    of all workers together is timed as ``env_step``. The model itself is left as it is, as
+    its attributes are saved with it.
+
+    :param profiler: The profiler
+    :type profiler: StepProfiler
+    :param model: The model that is being trained
+    :type model: DQN
+    :param env: The training environment, as passed to the state manager
+    :type env: Union[gym.Env, VecEnv]
+    :param state_channel: The state channel of the Unity environment, if any
+    :type state_channel: StateChannel
+    """
+    profiler.instrument(model.policy, 'predict', 'predict')
+    if isinstance(env, VecEnv):
+        profiler.instrument(env, 'step_wait', 'env_step')
+        return
+
+    env = env.unwrapped
+    profiler.instrument(env, 'step', 'env_step')
+    profiler.instrument(env, 'reset', 'reset')
+    profiler.instrument(env, 'mask_observation', 'observation_mask')
+    if hasattr(env, 'unity_env'):
+        profiler.instrument(env.unity_env, 'step', 'simulation')
+    else:
+        profiler.instrument(env, '_simulate', 'simulation')
+    if state_channel is not None:
+        profiler.instrument(state_channel, 'on_message_received', 'side_channel')
+        profiler.instrument(state_channel.state_manager, 'apply_pending_state',
+                            'state_transition')
+
+
+@gin.configurable
+class StepProfilerCallback(BaseCallback):
+    """
+    Times the gradient steps between collecting the rollouts as the ``train`` phase, and logs
+    the percentiles of the durations of the phases since the previous log to TensorBoard every
+    ``log_freq`` calls, as ``profile/<state>/<phase>_p<percentile>_ms``. At the end of the
+    training the summary of all durations is written next to the TensorBoard logs.
+    """
+
+    def __init__(self, profiler: StepProfiler, summary_folder: str, log_freq: int = 1000,
+                 verbose: int = 0):
+        """
+        :param profiler: The profiler of the training
+        :type profiler: StepProfiler
+        :param summary_folder: Folder to write the summary in when there are no TensorBoard logs
+        :type summary_folder: str
+        :param log_freq: Amount of calls between logging the percentiles
+        :type log_freq: int
+        :param verbose: Print the summary at the end of the training when 1
+        :type verbose: int
+        """
+        super().__init__(verbose)
+        self.profiler = profiler
+        self.summary_folder = summary_folder
+        self.log_freq = log_freq
+        self._logged = profiler.counts()
+        # The start of the gradient steps after the last rollout, with the state at that time
+        self._train_start: Optional[Tuple[int, Optional[BaxterState]]] = None
+
+    def _log(self) -> None:
+        counts = self.profiler.counts()
+        window = {
+            key: bins - self._logged[key] if key in self._logged else bins
+            for (key, bins) in counts.items()
+        }
+        for row in self.profiler.summary(window):
+            for percentile in PERCENTILES[0], PERCENTILES[-1]:
+                logger.record(
+                    'profile/{}/{}_p{}_ms'.format(row['state'], row['phase'], percentile),
+                    row['p{}_ms'.format(percentile)])
+        self._logged = counts
+
+    def _on_rollout_end(self) -> None:
+        # The model trains after a rollout once it has collected its learning starts
+        if self.model.num_timesteps > self.model.learning_starts:
+            self._train_start = (time.perf_counter_ns(), self.profiler.state_fn())
+
+    def _record_train(self) -> None:
+        if self._train_start is not None:
+            start, state = self._train_start
+            self.profiler.record('train', state, time.perf_counter_ns() - start)
+            self._train_start = None
+
+    def _on_rollout_start(self) -> None:
+        self._record_train()
+
+    def _on_step(self) -> bool:
+        if self.log_freq > 0 and self.n_calls % self.log_freq == 0:
+            self._log()
+        return True
+
+    def _on_training_end(self) -> None:
+        self._record_train()
+        folder = logger.get_dir() or self.summary_folder
+        self.profiler.write(folder)
+        if self.verbose > 0:
+            print("Step profile written to {}".format(folder))
+            for row in self.profiler.summary():
+                print("{state:12s} {phase:18s} {count:8d} x  p50 {p50_ms:9.3f} ms  "
+                      "p99 {p99_ms:9.3f} ms".format(**row))
@@ -0,0 +1,157 @@
+"""Module used to run several Unity instances side by side and expose them
+as a single vectorized environment to the training model.
+"""
+from typing import Callable, List, Optional
+
+import gin
+import gym
+from mlagents_envs.environment import UnityEnvironment
+from stable_baselines3.common.monitor import Monitor
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv, VecEnv
+
+from simulation.cloth_env import ClothEnv
+from utilities.episode_recorder import EpisodeRecorder
+from utilities.mode_channel import ModeChannel
+from utilities.shared_memory_vec_env import SharedMemoryVecEnv
+from utilities.state_manager import StateManager, StateChannel, BaxterState
+from utilities.volatile_space_gym_wrapper import VolatileSpaceUnityGymWrapper
+
+
+def record_episodes(env: gym.Env, episodes_folder: Optional[str],
+                    state_manager: StateManager) -> gym.Env:
+    """Wrap an environment in an EpisodeRecorder, when a folder to record in is given
+
+    :param env: The environment
+    :type env: gym.Env
+    :param episodes_folder: The folder of the recording, None to not record
+    :type episodes_folder: Optional[str]
+    :param state_manager: The state manager of the environment
+    :type state_manager: StateManager
+    :return: The environment, recorded or not
+    :rtype: gym.Env
+    """
+    if episodes_folder is None:
+        return env
+    return EpisodeRecorder(env, episodes_folder, state_manager)
+
+
+def make_unity_worker(worker_id: int,
+                      train_state: BaxterState,
+                      unity_file: str,
+                      log_folder: str,
+                      single_stage: bool = False,
+                      gin_config: Optional[str] = None,
+                      episodes_folder: Optional[str] = None
+                     ) -> Callable[[], Monitor]:
+    """Creates the function that builds the environment of a single worker. Every worker
+    gets its own Unity instance, StateManager and StateChannel, only the observations
+    of the model that is being trained leave the worker.
+
+    :param worker_id: Offset of the port used to communicate with this Unity instance
+    :type worker_id: int
+    :param train_state: The state that is being trained
+    :type train_state: BaxterState
+    :param unity_file: Path to the Unity executable, the editor can only host a single worker
+    :type unity_file: str
+    :param log_folder: Folder to store the log file of the Unity executable
+    :type log_folder: str
+    :param single_stage: Whether the worker trains a single stage instead of the chained stages
+    :type single_stage: bool
+    :param gin_config: The gin configuration to parse in the worker process, this is required
+                       when the worker runs in a freshly started process
+    :type gin_config: Optional[str]
+    :param episodes_folder: Folder to record the episodes of the worker in, if any
+    :type episodes_folder: Optional[str]
+    :return: Function creating the monitored environment of the worker
+    :rtype: Callable[[], Monitor]
+    """
+
+    def _init() -> Monitor:
+        if gin_config is not None:
+            gin.parse_config(gin_config, skip_unknown=True)
+
+        # The model is trained in the main process, the worker only needs the observation mask
+        state_manager = StateManager(train_state, build_train_model=False)
+        state_channel = StateChannel(state_manager)
+        side_channels = [state_channel]
+
+        mode_channel = ModeChannel()
+        if single_stage:
+            side_channels.append(mode_channel)
+
+        env = UnityEnvironment(file_name=unity_file,
+                               worker_id=worker_id,
+                               seed=1 + worker_id,
+                               side_channels=side_channels,
+                               log_folder='{}_{}'.format(log_folder, worker_id))
+        env = VolatileSpaceUnityGymWrapper(env, state_manager, state_channel)
+        env = record_episodes(env, episodes_folder, state_manager)
+        state_manager.initialize_env(env)
+
+        if single_stage:
+            mode_channel.send_mode('Single')
+        # let unity know which model we're training, so it can end the episode after this state
+        state_channel.send_train_state(train_state)
+        return Monitor(env)
+
+    return _init
+
+
+def make_headless_worker(train_state: BaxterState,
+                         single_stage: bool = False,
+                         gin_config: Optional[str] = None,
+                         episodes_folder: Optional[str] = None) -> Callable[[], Monitor]:
+    """Creates the function that builds the environment of a single worker which simulates
+    the scene in Python, instead of starting a Unity instance.
+
+    :param train_state: The state that is being trained
+    :type train_state: BaxterState
+    :param single_stage: Whether the worker trains a single stage instead of the chained stages
+    :type single_stage: bool
+    :param gin_config: The gin configuration to parse in the worker process, this is required
+                       when the worker runs in a freshly started process
+    :type gin_config: Optional[str]
+    :param episodes_folder: Folder to record the episodes of the worker in, if any
+    :type episodes_folder: Optional[str]
+    :return: Function creating the monitored environment of the worker
+    :rtype: Callable[[], Monitor]
+    """
+
+    def _init() -> Monitor:
+        if gin_config is not None:
+            gin.parse_config(gin_config, skip_unknown=True)
+
+        state_manager = StateManager(train_state, build_train_model=False)
+        env = record_episodes(ClothEnv(state_manager, single_stage=single_stage),
+                              episodes_folder, state_manager)
+        state_manager.initialize_env(env)
+        return Monitor(env)
+
+    return _init
+
+
+@gin.configurable
+def build_vec_env(env_fns: List[Callable[[], gym.Env]],
+                  start_method: Optional[str] = None,
+                  shared_memory: bool = False) -> VecEnv:
+    """Start the given environments as a single vectorized environment. Every environment
+    runs in its own process, unless only a single environment is requested.
+    Any function returning a gym environment can be used, so a local stand-in
+    environment can take the place of the Unity workers.
+
+    :param env_fns: Functions creating the environments
+    :type env_fns: List[Callable[[], gym.Env]]
+    :param start_method: The multiprocessing start method of the worker processes,
+                         defaults to forkserver when available
+    :type start_method: Optional[str]
+    :param shared_memory: Let the workers write their observations to shared memory
+                          instead of sending them through pipes
+    :type shared_memory: bool
+    :return: The vectorized environment
+    :rtype: VecEnv
+    """
+    if len(env_fns) == 1:
+        return DummyVecEnv(env_fns)
+    if shared_memory:
+        return SharedMemoryVecEnv(env_fns, start_method=start_method)
+    return SubprocVecEnv(env_fns, start_method=start_method)
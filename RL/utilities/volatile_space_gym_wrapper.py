@@ -6,6 +6,8 @@ import numpy as np
 from gym_unity.envs import UnityToGymWrapper, GymStepResult
 from mlagents_envs.base_env import BaseEnv
 
+from utilities.observation_mask import compile_mask
+
 
 class VolatileSpaceUnityGymWrapper(UnityToGymWrapper):
     """This is a subclass of the UnityToGymWrapper
@@ -13,28 +15,57 @@ class VolatileSpaceUnityGymWrapper(UnityToGymWrapper):
     in between tasks.
     """
 
-    def __init__(self, unity_env: BaseEnv, state_dto: 'StateManager' = None):
+    def __init__(self,
+                 unity_env: BaseEnv,
+                 state_dto: 'StateManager' = None,
+                 state_channel: 'StateChannel' = None):
         """ Creates a Gym wrapper around a given gym wrapper, where the observation and
         action space can be changed in between tasks
         :param unity_env: The environment
         :param state_dto: if this parameter is passed, it will use the embedded
         model to pre-evaluate the model until
         it reaches the desired state to start training
+        :param state_channel: if this parameter is passed, the states Unity posts on it are
+        applied after every step and reset. If state_dto is passed as well, the start states
+        reached by the embedded model are cached and restored by Unity on later resets
         """
 
         super().__init__(unity_env)
+        self.unity_env = unity_env
 
-        self.__observation_mask = list(range(self._observation_space.shape[0]))
+        self.__observation_mask = compile_mask([(0, self._observation_space.shape[0])])
+        self.__last_observation = None
         self.state_dto = state_dto
+        self.state_channel = state_channel
 
     def set_observation_range(self, ranges: List[Tuple[int, int]]) -> None:
         """ Hides the non-relevant observations from the Gym class using this wrapper by passing a
         list of ranges of relevant observations
         @param ranges: list of ranges [(start, stop), (start, stop)] in the observation space
         """
-        selected_indexes = np.concatenate(
-            [range(start, stop) for (start, stop) in ranges])
-        self.__observation_mask = selected_indexes
+        self.__observation_mask = compile_mask(ranges)
+
+    def mask_observation(self, observation: np.ndarray, use_train_mask: bool) -> np.ndarray:
+        """ Hides the non-relevant observations of a step
+        @param observation: the full observation
+        @param use_train_mask: uses the mask of the model that is being trained
+        """
+        mask = self.__observation_mask if not use_train_mask else \
+         self.state_dto.train_observation_mask
+        return mask(observation)
+
+    def __apply_pending_state(self) -> None:
+        """ Move to the state Unity posted during the last step or reset, before its
+        observation is masked
+        """
+        if self.state_channel is not None:
+            self.state_channel.state_manager.apply_pending_state()
+
+    @property
+    def last_observation(self) -> np.ndarray:
+        """The full observation of the latest step or reset, before it was masked
+        """
+        return self.__last_observation
 
     def step(self, action: List[Any], use_train_mask=True) -> GymStepResult:
         """ Perform one timestep in the environment, taking our own
@@ -49,24 +80,34 @@ class VolatileSpaceUnityGymWrapper(UnityToGymWrapper):
             info (dict): contains auxiliary diagnostic information.
         """
         use_train_mask = use_train_mask and self.state_dto is not None and \
-         self.state_dto.train_model is not None
+         self.state_dto.train_observation_mask is not None
 
         observation, reward, done, info = super().step(action)
-        mask = self.__observation_mask if not use_train_mask else \
-         self.state_dto.train_observation_mask
-        return observation[mask], reward, done, info
+        self.__apply_pending_state()
+        self.__last_observation = observation
+        return self.mask_observation(observation, use_train_mask), reward, done, info
 
     def reset(self) -> Union[List[np.ndarray], np.ndarray]:
         """ Resets the state of the environment and returns an initial observation.
         Returns: observation (object/list): the initial observation of the
         space.
         """
+        use_cache = self.state_dto is not None and self.state_channel is not None and \
+         self.state_dto.train_state is not None
+        if use_cache:
+            snapshot = self.state_dto.start_states.sample(self.state_dto.train_state)
+            if snapshot is not None:
+                self.state_channel.send_snapshot(self.state_dto.train_state, snapshot)
 
-        obs = super().reset()[self.__observation_mask]
+        self.__last_observation = super().reset()
+        self.__apply_pending_state()
+        obs = self.__observation_mask(self.__last_observation)
 
+        replayed = False
         while self.state_dto is not None and \
          self.state_dto.train_state != self.state_dto.curr_state:
-            action, _state = self.state_dto.eval_model.predict(obs)
+            replayed = True
+            action, _state = self.state_dto.eval_policy.predict(obs)
             obs, _, done, _ = self.step(action, False)
             self.render()
             if done:
@@ -74,6 +115,11 @@ class VolatileSpaceUnityGymWrapper(UnityToGymWrapper):
                     "evaluation of previous models did not reach"\
                      "a state where it could start training {}"
                     .format(self.state_dto.train_state))
-                obs = super().reset()[self.__observation_mask]
+                self.__last_observation = super().reset()
+                self.__apply_pending_state()
+                obs = self.__observation_mask(self.__last_observation)
 
+        if use_cache and replayed:
+            self.state_dto.start_states.add(self.state_dto.train_state,
+                                            self.__last_observation)
         return obs
@@ -110,8 +110,6 @@ namespace RigidBody
 
             _hasFinishedLoop = false;
 
-            _stateChannel.SendState(_currentState.ToString());
-
             // Reset the cloth
             cloth.ResetToInitialState();
             if (!holdCloth)
@@ -130,6 +128,43 @@ namespace RigidBody
             foreach (var joint in _jointList) JointUtils.ResetJoint(joint);
 
             foreach (var joint in _mirrorJointList) JointUtils.ResetJoint(joint);
+
+            // Python can skip the earlier states by sending a start state it reached before
+            if (_stateChannel.TryTakeSnapshot(out var snapshot)) RestoreSnapshot(snapshot);
+
+            _stateChannel.SendState(_currentState, CompletedEpisodes, StepCount);
+        }
+
+        /// <summary>
+        /// Restore a start state: the joints, the cloth and the state of the folding process.
+        /// The velocities of the cloth are not part of the snapshot and start at zero.
+        /// </summary>
+        /// <param name="snapshot">The snapshot to restore</param>
+        private void RestoreSnapshot(StateSnapshot snapshot)
+        {
+            var observation = snapshot.Observation;
+            var index = 0;
+
+            foreach (var joint in _jointList) JointUtils.SetNormalizedJointRotation(joint, observation[index++]);
+
+            foreach (var joint in _mirrorJointList) JointUtils.SetNormalizedJointRotation(joint, observation[index++]);
+
+            var positions = new Vector3[cloth.GetBones().Length];
+            for (var i = 0; i < positions.Length; i++, index += 3)
+            {
+                var relativePosition = new Vector3(observation[index], observation[index + 1], observation[index + 2]);
+                positions[i] = baxter.transform.TransformPoint(relativePosition);
+            }
+
+            cloth.SnapTo(positions);
+
+            _currentState = snapshot.State;
+            _hasRotated = _currentState == BaxterState.GrabCloth2 || _currentState == BaxterState.Fold2;
+
+            // The grabbers attach themselves again to the nodes they are holding
+            var isHolding = _currentState == BaxterState.Fold1 || _currentState == BaxterState.Fold2;
+            leftHandGrab.isOn = isHolding;
+            rightHandGrab.isOn = isHolding;
         }
 
         public override void CollectObservations(VectorSensor sensor)
@@ -233,7 +268,7 @@ namespace RigidBody
             }
 
             if (send)
-                _stateChannel.SendState(_currentState.ToString());
+                _stateChannel.SendState(_currentState, CompletedEpisodes, StepCount);
         }
 
         /// <summary>
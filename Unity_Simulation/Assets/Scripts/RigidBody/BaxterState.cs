@@ -1,11 +1,15 @@
 namespace RigidBody
 {
+    /// <summary>
+    /// The states of the folding process, the values are the IDs of the states in the messages
+    /// of the state side channel and match the BaxterState enum of Python.
+    /// </summary>
     public enum BaxterState
     {
-        None,
-        Fold1,
-        Fold2,
-        GrabCloth1,
-        GrabCloth2
+        None = 0,
+        GrabCloth1 = 1,
+        Fold1 = 2,
+        GrabCloth2 = 3,
+        Fold2 = 4
     }
 }
\ No newline at end of file
@@ -39,6 +39,19 @@ namespace RigidBody
             return percentage * (upperLimit - lowerLimit) + lowerLimit;
         }
 
+        /// <summary>
+        /// Move a joint immediately to a normalized rotation and keep it there.
+        /// </summary>
+        /// <param name="joint">The joint to move</param>
+        /// <param name="percentage">The position in the articulation range of the joint</param>
+        public static void SetNormalizedJointRotation(ArticulationBody joint, float percentage)
+        {
+            var target = GetDenormalizedJointRotation(joint, percentage);
+            joint.jointPosition = new ArticulationReducedSpace(Mathf.Deg2Rad * target);
+            joint.jointVelocity = new ArticulationReducedSpace(0f);
+            RotateJointToTarget(joint, target);
+        }
+
         /// <summary>
         /// Updates a joint's target rotation to a step in the specified direction.
         /// </summary>
@@ -7,7 +7,7 @@ namespace RigidBody
 {
     /// <summary>
     /// Custom side channel that can exchange messages concerning the mode of training.
-    /// The standard mode is training mode.
+    /// The standard mode is training mode, the mode is sent as the int32 value of TrainingMode.
     /// </summary>
     public class ModeSideChannel : SideChannel
     {
@@ -20,11 +20,11 @@ namespace RigidBody
 
         protected override void OnMessageReceived(IncomingMessage msg)
         {
-            var receivedString = msg.ReadString();
+            var mode = (TrainingMode) msg.ReadInt32();
 #if LOG_MESSAGE
-            Debug.Log("From Python : " + receivedString);
+            Debug.Log("From Python : " + mode);
 #endif
-            TrainingMode = (TrainingMode) Enum.Parse(typeof(TrainingMode), receivedString);
+            TrainingMode = mode;
         }
     }
 }
\ No newline at end of file
@@ -1,40 +1,103 @@
 //#define LOG_MESSAGE
 
 using System;
+using Unity.MLAgents;
 using Unity.MLAgents.SideChannels;
+#if LOG_MESSAGE
+using UnityEngine;
+#endif
 
 namespace RigidBody
 {
     /// <summary>
     /// Custom side channel that can exchanges messages concerning the state.
+    /// The messages are binary: the states are sent as the int32 values of BaxterState.
     /// </summary>
     public class StateSideChannel : SideChannel
     {
+        /// <summary>
+        /// Message setting the state that is trained, followed by the state.
+        /// </summary>
+        private const int TrainStateMessage = 0;
+
+        /// <summary>
+        /// Message announcing a snapshot, followed by the state and the observation to restore.
+        /// </summary>
+        private const int SnapshotMessage = 1;
+
         public BaxterState TrainState = BaxterState.None;
 
+        private StateSnapshot _pendingSnapshot;
+
+        // The latest state of this academy step, only this one is sent to Python
+        private bool _hasPendingState;
+        private BaxterState _pendingState;
+        private int _pendingEpisode;
+        private int _pendingStep;
+
         public StateSideChannel()
         {
             ChannelId = new Guid("621f0a70-4f87-11ea-a6bf-784f4387d1f7");
+            // The messages are collected when the agents send their observations, after the pre step
+            Academy.Instance.AgentPreStep += _ => Flush();
         }
 
         protected override void OnMessageReceived(IncomingMessage msg)
         {
-            var receivedString = msg.ReadString();
+            var messageType = msg.ReadInt32();
+            var state = (BaxterState) msg.ReadInt32();
 #if LOG_MESSAGE
-            Debug.Log("From Python : " + receivedString);
+            Debug.Log($"From Python : {messageType} {state}");
 #endif
-            TrainState = (BaxterState) Enum.Parse(typeof(BaxterState), receivedString);
+            if (messageType == SnapshotMessage)
+            {
+                _pendingSnapshot = new StateSnapshot(state, msg.ReadFloatList());
+                return;
+            }
+
+            TrainState = state;
         }
 
         /// <summary>
-        /// Send a state
+        /// Take the snapshot that should be restored at the start of the next episode, if any.
+        /// </summary>
+        /// <param name="snapshot">The snapshot to restore</param>
+        /// <returns>Whether a snapshot was pending</returns>
+        public bool TryTakeSnapshot(out StateSnapshot snapshot)
+        {
+            snapshot = _pendingSnapshot;
+            _pendingSnapshot = null;
+            return !ReferenceEquals(snapshot, null);
+        }
+
+        /// <summary>
+        /// Send a state. The states sent during the same academy step are coalesced,
+        /// only the latest one is sent at the start of the next step.
         /// </summary>
         /// <param name="state">The current state</param>
-        public void SendState(string state)
+        /// <param name="episode">The amount of episodes the agent completed</param>
+        /// <param name="step">The step of the agent in the current episode</param>
+        public void SendState(BaxterState state, int episode, int step)
         {
+            _hasPendingState = true;
+            _pendingState = state;
+            _pendingEpisode = episode;
+            _pendingStep = step;
+        }
+
+        /// <summary>
+        /// Queue the latest state for Python, if a state was sent during the previous step.
+        /// </summary>
+        private void Flush()
+        {
+            if (!_hasPendingState) return;
+
             using var msgOut = new OutgoingMessage();
-            msgOut.WriteString(state);
+            msgOut.WriteInt32((int) _pendingState);
+            msgOut.WriteInt32(_pendingEpisode);
+            msgOut.WriteInt32(_pendingStep);
             QueueMessageToSend(msgOut);
+            _hasPendingState = false;
         }
     }
 }
\ No newline at end of file
@@ -0,0 +1,22 @@
+using System.Collections.Generic;
+
+namespace RigidBody
+{
+    /// <summary>
+    /// A start state sent by Python, consisting of the state of the folding process
+    /// and the observations of the agent when it reached this state.
+    /// </summary>
+    public sealed class StateSnapshot
+    {
+        public BaxterState State { get; }
+        public IList<float> Observation { get; }
+
+        /// <param name="state">The state of the folding process</param>
+        /// <param name="observation">The observation in the layout of Baxter.CollectObservations</param>
+        public StateSnapshot(BaxterState state, IList<float> observation)
+        {
+            State = state;
+            Observation = observation;
+        }
+    }
+}
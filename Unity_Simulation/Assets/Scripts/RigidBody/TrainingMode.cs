@@ -1,8 +1,11 @@
 namespace RigidBody
 {
+    /// <summary>
+    /// The modes of training, the values are sent by the mode side channel of Python.
+    /// </summary>
     public enum TrainingMode
     {
-        Multi,
-        Single
+        Multi = 0,
+        Single = 1
     }
 }
\ No newline at end of file
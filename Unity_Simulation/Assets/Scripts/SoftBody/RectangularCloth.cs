@@ -209,6 +209,18 @@ namespace SoftBody
             SpringProcessor.SyncPositionUpdatesImmediately();
         }
 
+        /// <summary>
+        /// Snap all nodes of the cloth to the given positions, their velocities are reset.
+        /// </summary>
+        /// <param name="positions">The world positions of the nodes, in the order of the bones</param>
+        public void SnapTo(IReadOnlyList<Vector3> positions)
+        {
+            for (var i = 0; i < positions.Count; i++)
+                SpringProcessor.SpringNodeFor(i).SnapTo(positions[i], false);
+
+            SpringProcessor.SyncPositionUpdatesImmediately();
+        }
+
         /// <summary>
         /// Perform an artificial fold and rotate
         /// </summary>